@@ -1,21 +1,31 @@
-from protprep_packages.pdb_processor import PDBProcessor
-from protprep_packages import sbatch_manager
-from protprep_packages.pdb_combiner import PDBCombiner
-import pymol
-from pymol import cmd
+from protprep_packages.executors import BACKENDS, get_executor
+from protprep_packages.pipeline_scheduler import PipelineScheduler
+from protprep_packages.tables import print_table
+from protprep_packages.tleap_generator import TleapInputGenerator
+from protprep_packages import tracing
+from protprep_packages.tracing import current_span, file_size, span, traced
 from pathlib import Path
-import glob
-import re
-import os
-import pyfiglet
+import argparse
+import logging
 
 """
 The main script that starts the machine and deep learning
 Created by: BSIM
 Contact via email: bsim@swinburne.edu.my OR 105572795@students.swinburne.edu.my
+
+Only light modules are imported at startup. NumPy and the structure readers,
+the RCSB client (requests) and the PyMOL/OpenBabel combiner are imported by
+the functions of the mode that uses them, so the menu comes up at once and
+mode 1 never loads PyMOL or OpenBabel in this process
+(python -m protprep_packages.import_budget checks this).
 """
 
+@traced("chain_clean")
 def extract_single_chain_and_clean(pdb_file, chain_id, pdb_id, cofactors=None, cosubstrates=None, metal_ions=None):
+    import numpy as np
+    from protprep_packages.pdb_parser import format_atom_records, read_atom_table
+    from protprep_packages.cif_reader import is_cif_file, read_cif_atom_table
+
     # Ensure pdb_file is a Path object.
     pdb_file = Path(pdb_file)
     
@@ -27,33 +37,32 @@ def extract_single_chain_and_clean(pdb_file, chain_id, pdb_id, cofactors=None, c
     if metal_ions is not None and isinstance(metal_ions, str):
         metal_ions = [metal_ions]
     
-    # Open the original PDB file and read all lines.
-    with pdb_file.open('r') as infile:
-        lines = infile.readlines()
-
-    filtered_lines = []
-    for line in lines:
-        # Process ATOM records: include only if they belong to the desired chain.
-        if line.startswith("ATOM"):
-            if len(line) > 21 and line[21].strip() == chain_id:
-                filtered_lines.append(line)
-        # Process HETATM records: include only if the residue is in one of the allowed lists
-        # and belongs to the desired chain.
-        elif line.startswith("HETATM"):
-            # Ensure the HETATM record belongs to the desired chain.
-            if len(line) > 21 and line[21].strip() != chain_id:
-                continue
-            resname = line[17:20].strip()  # Residue name is typically in columns 18-20.
-            if ((cofactors is not None and resname in cofactors) or
-                (cosubstrates is not None and resname in cosubstrates) or
-                (metal_ions is not None and resname in metal_ions)):
-                filtered_lines.append(line)
+    # Read the original structure file once into its atom table. PDB files also keep
+    # their text lines; mmCIF/BinaryCIF records are written back out in PDB format.
+    if is_cif_file(pdb_file):
+        lines, atoms = None, read_cif_atom_table(pdb_file)
+    else:
+        lines, atoms = read_atom_table(pdb_file)
+    current_span().set(entry=pdb_id, atoms=len(atoms), bytes=file_size(pdb_file))
+
+    # ATOM records are kept only if they belong to the desired chain.
+    # HETATM records are kept only if they belong to the desired chain and the
+    # residue is in one of the allowed lists.
+    allowed_hetero = set(cofactors or []) | set(cosubstrates or []) | set(metal_ions or [])
+    in_chain = atoms['chain'] == chain_id
+    keep = np.where(atoms['record'] == "ATOM", in_chain, in_chain & np.isin(atoms['resn'], list(allowed_hetero)))
+
+    if lines is None:
+        filtered_lines = format_atom_records(atoms[keep]) + ["END\n"]
+    else:
         # Preserve all other lines (headers, remarks, etc.)
-        else:
-            filtered_lines.append(line)
+        dropped = set(atoms['line'][~keep].tolist())
+        filtered_lines = [line + "\n" for i, line in enumerate(lines) if i not in dropped]
     
     # Create a new file name for the cleaned file.
-    new_pdb_file = pdb_file.with_name("rec_" + pdb_file.stem + f"_{chain_id}_clean{pdb_file.suffix}")
+    stem = Path(pdb_file.stem).stem if pdb_file.suffix == ".gz" else pdb_file.stem
+    suffix = ".pdb" if lines is None else pdb_file.suffix
+    new_pdb_file = pdb_file.with_name("rec_" + stem + f"_{chain_id}_clean{suffix}")
     
     # Write the filtered lines to the new PDB file.
     with new_pdb_file.open('w') as outfile:
@@ -61,8 +70,46 @@ def extract_single_chain_and_clean(pdb_file, chain_id, pdb_id, cofactors=None, c
     
     return new_pdb_file
     
-def process_pdb():
+def process_entry(pdb_id, pdb_file, ligand_to_keep, result, executor=None):
+    """
+    Run the preparation steps for one processed entry: submit the ligand
+    extraction job, extract and clean the selected chain and submit the
+    add_h job for the cleaned receptor. Jobs go to 'executor' (default:
+    get_executor()). Returns the cleaned receptor file.
+    """
+    executor = executor or get_executor()
+    # The logger PDBProcessor configures (named after the class).
+    logger = logging.getLogger("PDBProcessor")
+    chain_id = result['chain_id']
+    cofactors = result['cofactors']
+    cosubstrates = result['cosubstrates']
+    metal_ions = result['metal_ions']
+
+    logger.info("Processing PDB: %s", pdb_id)
+    logger.info("File downloaded to: %s", pdb_file)
+
+    # Extract and clean the ligand for this pdb entry
+    logger.info(f"Extracting the ligand {ligand_to_keep} now")
+    executor.extract_ligands([(pdb_id, pdb_file, ligand_to_keep, chain_id)])
+    #ligand_pdb = extract_and_clean_specific_ligands(pdb_file, pdb_id, ligand_to_keep, chain_id)
+    #processor.logger.info("Ligand file saved to: %s", ligand_pdb)
+
+    # Extract a single chain and clean based on cofactors, cosubstrates, and metal ions
+    new_pdb_file = extract_single_chain_and_clean(pdb_file, chain_id, pdb_id, cofactors, cosubstrates, metal_ions)
+    
+    logger.info(f"Cleaning and adding hydrogens to the receptor protein now")
+    # Run the add_h job for this pdb entry
+    executor.add_h(pdb_id, [new_pdb_file])
+
+    # FANG ZHE HAW PART !
+
+    return new_pdb_file
+
+def process_pdb(executor=None):
+    from protprep_packages.pdb_processor import PDBProcessor
+
     processor = PDBProcessor()
+    executor = executor or get_executor()
 
     # Get user input and download PDB files/ligands
     pdb_file_dictionary = processor.get_basic_info()
@@ -75,32 +122,144 @@ def process_pdb():
     for pdb_id, result in processor.processed_results.items():
         pdb_file = pdb_file_dictionary[pdb_id]['pdb_file']
         ligand_to_keep = pdb_file_dictionary[pdb_id]['ligand']
-        chain_id = result['chain_id']
-        cofactors = result['cofactors']
-        cosubstrates = result['cosubstrates']
-        metal_ions = result['metal_ions']
+        process_entry(pdb_id, pdb_file, ligand_to_keep, result, executor)
+    executor.wait()
+
+def print_status_report(statuses):
+    """Print the per-entry status of a batch run in a box."""
+    rows = [(pdb_id, status, detail) for pdb_id, (status, detail) in statuses.items()]
+    print_table(("PDB", "STATUS", "DETAIL"), rows)
+
+def water_output(receptor_file):
+    """Hydrated receptor written by the add_water step for receptor_file."""
+    from protprep_packages.add_water import default_output
+    return default_output(receptor_file)
 
-        processor.logger.info("Processing PDB: %s", pdb_id)
-        processor.logger.info("File downloaded to: %s", pdb_file)
+@traced("chain_clean")
+def split_chain(pdb_file, chain_id, pdb_id, cofactors=None, cosubstrates=None, metal_ions=None):
+    """
+    tleap counterpart of extract_single_chain_and_clean(): split one chain of
+    a PDB file in a single pass into its receptor (rec_<pdb_id>_<chain>.pdb,
+    protein and cosubstrates) and the cofactor and metal-ion files that
+    TleapInputGenerator combines with it, next to the input.
+    Returns the chain's entry of structure_splitter.split_structure(), or
+    None if the chain has no receptor records.
+    """
+    from protprep_packages.cif_reader import is_cif_file
+    from protprep_packages.structure_splitter import split_structure
 
-        # Extract and clean the ligand for this pdb entry
-        processor.logger.info(f"Extracting the ligand {ligand_to_keep} now")
-        sbatch_manager.create_and_run_sbatch_script_extract_and_clean_specific_ligands(pdb_id, pdb_file, ligand_to_keep, chain_id)
-        #ligand_pdb = extract_and_clean_specific_ligands(pdb_file, pdb_id, ligand_to_keep, chain_id)
-        #processor.logger.info("Ligand file saved to: %s", ligand_pdb)
+    pdb_file = Path(pdb_file)
+    if is_cif_file(pdb_file):
+        raise ValueError(f"{pdb_file.name}: the tleap components are split from PDB-format files only")
+    current_span().set(entry=pdb_id, bytes=file_size(pdb_file))
+    components = split_structure(pdb_file, pdb_id, [chain_id], cofactors, metal_ions, pdb_file.parent, cosubstrates)
+    entry = components.get(chain_id)
+    return entry if entry is not None and entry['receptor'] is not None else None
+
+def write_tleap_input(components, receptor_file):
+    """
+    Write the tleap input combining a receptor file with the cofactor and
+    metal-ion files of its chain (an entry of split_chain()) and return its path.
+    """
+    # tleap runs next to its input and loads the structures by name.
+    return Path(TleapInputGenerator().generate_split_input(components, Path(receptor_file).name)).absolute()
+
+def add_entry_stages(scheduler, pdb_file, result, water=False, tleap=False, water_site=None, water_site_radius=None,
+                     water_engine=None):
+    """
+    Add the preparation stages of one manifest entry to 'scheduler', given
+    its downloaded structure (None if the download failed) and its entry in
+    PDBProcessor.processed_results: download -> chain clean -> add_h, with
+    the ligand extraction (if the entry names a ligand) running next to the
+    chain clean, optionally followed by water addition and a tleap run on
+    the final receptor (the hydrated one with water=True). With tleap=True
+    the chain is cleaned by split_chain(), which keeps the cofactors and
+    metal ions out of the receptor so tleap can combine them with it.
+    water_site and water_site_radius select add_water's pocket mode
+    (default: waters around the whole receptor), water_engine its placement
+    engine (default: grid).
+    """
+    pdb_id = result['pdb_id']
+    ligand_to_keep = result['ligand_name']
+    chain_id = result['chain_id']
+
+    # The structures were fetched in bulk; this stage only hands the file on.
+    scheduler.add_call(pdb_id, "download", lambda results: pdb_file)
+    clean = split_chain if tleap else extract_single_chain_and_clean
+    scheduler.add_call(pdb_id, "chain_clean", lambda results: clean(
+        results['download'], chain_id, pdb_id, result['cofactors'], result['cosubstrates'], result['metal_ions']),
+        after=["download"])
+    if tleap:
+        receptor = lambda results: results['chain_clean']['receptor']
+    else:
+        receptor = lambda results: results['chain_clean']
+    if ligand_to_keep:
+        scheduler.add_job(pdb_id, "extract_lig", "extract_lig",
+                          lambda results: (pdb_id, results['download'], ligand_to_keep, chain_id), after=["download"])
+    # add_h adds the hydrogens to the cleaned receptor in place.
+    scheduler.add_job(pdb_id, "add_h", "add_h", lambda results: (receptor(results),), after=["chain_clean"],
+                      output=receptor)
+    last = "add_h"
+    if water:
+        from protprep_packages.add_water import DEFAULT_SITE_RADIUS
+        site_radius = DEFAULT_SITE_RADIUS if water_site_radius is None else water_site_radius
+        scheduler.add_job(pdb_id, "add_water", "add_water",
+                          lambda results: (results['add_h'], water_output(results['add_h']),
+                                           water_site or "", site_radius, water_engine or "grid"),
+                          after=[last], output=lambda results: water_output(results['add_h']))
+        last = "add_water"
+    if tleap:
+        # The receptor file name is known before its job has run, so the input is written up front.
+        final_receptor = (lambda results: water_output(receptor(results))) if water else receptor
+        scheduler.add_call(pdb_id, "tleap_input",
+                           lambda results: write_tleap_input(results['chain_clean'], final_receptor(results)),
+                           after=["chain_clean"])
+        scheduler.add_job(pdb_id, "tleap", "tleap", lambda results: (results['tleap_input'],),
+                          after=["tleap_input", last])
 
-        # Extract a single chain and clean based on cofactors, cosubstrates, and metal ions
-        new_pdb_file = extract_single_chain_and_clean(pdb_file, chain_id, pdb_id, cofactors, cosubstrates, metal_ions)
-        
-        processor.logger.info(f"Cleaning and adding hydrogens to the receptor protein now")
-        # Run the sbatch script for this pdb entry
-        sbatch_manager.create_and_run_sbatch_script_add_h(pdb_id, new_pdb_file)
+def process_manifest(manifest_file, workers=None, executor=None, water=False, tleap=False, water_site=None,
+                     water_site_radius=None, water_engine=None):
+    """
+    Non-interactive counterpart of process_pdb(): read the entries and their
+    choices from a CSV/JSON manifest into processor.pdb_data and
+    processor.processed_results (PDBProcessor.load_manifest(), which downloads
+    the structures in bulk), then run every entry's stages through the
+    pipeline scheduler, so the chain cleaning and job submissions of
+    different entries overlap.
+    Returns {pdb_id: (status, detail)}.
+    """
+    from protprep_packages.pdb_processor import PDBProcessor
+
+    executor = executor or get_executor(max_workers=workers)
+    processor = PDBProcessor()
+    pdb_data = processor.load_manifest(manifest_file)
+    processor.logger.info("PDB entries collected: %s", list(pdb_data))
+
+    scheduler = PipelineScheduler(executor, max_workers=workers or 8, logger=processor.logger)
+    for pdb_id, result in processor.processed_results.items():
+        add_entry_stages(scheduler, pdb_data[pdb_id]['pdb_file'], result, water, tleap, water_site, water_site_radius,
+                         water_engine)
+    with span("manifest", entries=len(pdb_data)):
+        statuses = scheduler.run()
 
-        # FANG ZHE HAW PART !
+    print_status_report(statuses)
+    return statuses
 
-def combine_pdb():
-    pdb_combiner = PDBCombiner()
-    pdb_combiner.combine_pdb()
+def report_trace(trace_dir):
+    """Print the per-stage summary of a traced run and write its Chrome trace to trace_dir/trace.json."""
+    if not trace_dir:
+        return
+    tracing.print_summary(trace_dir)
+    trace_file = Path(trace_dir) / "trace.json"
+    n_spans = tracing.export_chrome_trace(trace_file, trace_dir)
+    print(f"Wrote {n_spans} spans to {trace_file}")
+
+def combine_pdb(executor=None, ligand_directory=None, top_n=None, max_score=None, post_processing=None):
+    # PyMOL and OpenBabel come in with the combiner, on this path only.
+    from protprep_packages.pdb_combiner import PDBCombiner
+
+    pdb_combiner = PDBCombiner(executor=executor)
+    pdb_combiner.combine_pdb(ligand_directory, top_n, max_score, post_processing)
 
 def print_menu():
 
@@ -143,16 +302,120 @@ def print_menu():
 
 def main():
 
+    parser = argparse.ArgumentParser(description="Protein Preparation Platform")
+    parser.add_argument(
+        "--manifest",
+        help="CSV or JSON manifest (pdb_id, ligand, chain, cofactors, cosubstrates, metals) to process without prompts."
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of worker processes for --manifest and the local backend (default: number of CPUs)."
+    )
+    parser.add_argument(
+        "--backend",
+        choices=BACKENDS,
+        default=None,
+        help="Where to run the ligand extraction, add_h and water jobs: Slurm or a local "
+             "process pool (default: $PROTPREP_BACKEND or slurm)."
+    )
+    parser.add_argument(
+        "--trace",
+        default=None,
+        help="Record tracing spans of this run (and its worker processes) in this directory, "
+             "then write trace.json (Chrome trace format) there and print a per-stage summary."
+    )
+    parser.add_argument(
+        "--water",
+        action="store_true",
+        help="With --manifest: add waters to each cleaned receptor after add_h."
+    )
+    parser.add_argument(
+        "--water-site",
+        default=None,
+        help="With --water: only place waters near these residues, e.g. 'UNL' or 'A:42,A:87' "
+             "(default: around the whole receptor)."
+    )
+    parser.add_argument(
+        "--water-site-radius",
+        type=float,
+        default=None,
+        help="With --water-site: distance (Å) from the site atoms within which waters are placed (default: 8.0)."
+    )
+    parser.add_argument(
+        "--water-engine",
+        choices=("grid", "box"),
+        default=None,
+        help="With --water: place waters on a cubic lattice (grid) or tile a pre-equilibrated water box (box) "
+             "(default: grid)."
+    )
+    parser.add_argument(
+        "--tleap",
+        action="store_true",
+        help="With --manifest: run tleap on each cleaned receptor as the last stage."
+    )
+    parser.add_argument(
+        "--combine",
+        metavar="LIGAND_DIR",
+        help="Combine the cleaned receptor in the current directory with the docked ligands "
+             "in LIGAND_DIR without prompts (mode 2): all of them, or those selected by --top and/or --max-score."
+    )
+    parser.add_argument(
+        "--top",
+        type=int,
+        default=None,
+        help="With --combine: combine only the N best-scoring ligands."
+    )
+    parser.add_argument(
+        "--max-score",
+        type=float,
+        default=None,
+        help="With --combine: combine only the ligands whose best Vina score is at or below this value."
+    )
+    parser.add_argument(
+        "--post-process",
+        choices=("none", "add_h"),
+        default="none",
+        help="With --combine: jobs to run on the complexes, as offered by the interactive prompt (default: none)."
+    )
+    args = parser.parse_args()
+    if args.water_site_radius is not None and not args.water_site_radius > 0:
+        parser.error(f"--water-site-radius must be positive, got {args.water_site_radius}")
+    if args.trace:
+        # Enabled before the executor starts so its worker processes trace as well.
+        tracing.enable(args.trace)
+    executor = get_executor(args.backend, max_workers=args.workers)
+
+    if args.manifest:
+        try:
+            process_manifest(args.manifest, args.workers, executor, args.water, args.tleap, args.water_site,
+                             args.water_site_radius, args.water_engine)
+        finally:
+            executor.shutdown()
+            report_trace(args.trace)
+        return
+
+    if args.combine:
+        try:
+            combine_pdb(executor, args.combine, args.top, args.max_score, args.post_process)
+        finally:
+            executor.shutdown()
+            report_trace(args.trace)
+        return
+
     print_menu()
 
     mode_selection = input(f"Enter the mode to use: ")
 
-    if mode_selection == "1":
-        process_pdb()
-    elif mode_selection == "2":
-        combine_pdb()
+    try:
+        if mode_selection == "1":
+            process_pdb(executor)
+        elif mode_selection == "2":
+            combine_pdb(executor)
+    finally:
+        executor.shutdown()
+        report_trace(args.trace)
 
 if __name__ == "__main__":
     main()
-
-
@@ -2,37 +2,8 @@ from pathlib import Path
 import pymol
 from pymol import cmd
 import argparse
-
-def extract_ligand_metadata(ligand_file):
-    keywords = ["MODEL", "REMARK  Name =", "REMARK VINA RESULT:", 
-                "REMARK INTER + INTRA:", "REMARK INTER:", "REMARK INTRA:", "REMARK UNBOUND:"]
-    metadata = []
-    model1_started = False
-    try:
-        with open(ligand_file, "r") as f:
-            for line in f:
-                line_stripped = line.strip()
-                # Check for model header
-                if line_stripped.startswith("REMARK MODEL"):
-                    # If we haven't started yet and it's MODEL 1, mark as started and add the converted line.
-                    if not model1_started and line_stripped == "REMARK MODEL 1":
-                        metadata.append(line_stripped)
-                        model1_started = True
-                        continue
-                    # If a new model header is found and we already collected MODEL 1, break out.
-                    if model1_started and line_stripped != "REMARK MODEL 1":
-                        break
-
-                # Only process lines if we're in the MODEL 1 block.
-                if model1_started:
-                    for key in keywords:
-                        if line_stripped.startswith(key) and key != "MODEL":
-                            metadata.append(line_stripped)
-                            break
-    except Exception as e:
-        print(f"Error reading ligand file {ligand_file}: {e}")
-    
-    return metadata
+from protprep_packages.ligand_metadata import METADATA_KEYWORDS, extract_ligand_metadata
+from protprep_packages.tracing import current_span, file_size, traced
 
 def insert_metadata_into_pdb_content(pdb_file, metadata_lines):
     try:
@@ -46,11 +17,17 @@ def insert_metadata_into_pdb_content(pdb_file, metadata_lines):
     except Exception as e:
         print(f"Error inserting metadata into pdb file {pdb_file}: {e}")
 
-def add_hydrogens_and_clean_with_pymol(pdb_file):
+def add_hydrogens_and_clean_with_pymol(pdb_file, persistent_session=False):
+    """
+    Add hydrogens to pdb_file, remove nonpolar ones and save it in place.
+    With persistent_session=True PyMOL must already be running; the session is
+    cleared instead of quit so the next file can reuse it.
+    """
     pdb_file = Path(pdb_file)
     
     # Launch PyMOL in quiet/headless mode.
-    pymol.finish_launching(['pymol', '-qc'])
+    if not persistent_session:
+        pymol.finish_launching(['pymol', '-qc'])
     
     # Load the structure into PyMOL.
     obj_name = "structure"
@@ -68,48 +45,82 @@ def add_hydrogens_and_clean_with_pymol(pdb_file):
     
     print(f"Hydrogens added and nonpolar hydrogens removed. Saved to {pdb_file}")
     
-    # Quit PyMOL.
-    cmd.quit()
+    # Quit PyMOL, or just clear it for the next file.
+    if persistent_session:
+        cmd.delete("all")
+    else:
+        cmd.quit()
     
     return pdb_file
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(
-        description="Add hydrogens and remove nonpolar hydrogens from a given PDB file."
-    )
-
-    parser.add_argument(
-        "--pdb_file",
-        required=True,
-        help="Path to the PDB file."
-    )
-    
-    args = parser.parse_args()
-
-    # Define the metadata keywords to search for.
-    metadata_keywords = ["MODEL", "REMARK  Name =", "REMARK VINA RESULT:",
-                         "REMARK INTER + INTRA:", "REMARK INTER:", "REMARK INTRA:", "REMARK UNBOUND:"]
+@traced("add_h")
+def add_hydrogens_keeping_metadata(pdb_file, persistent_session=False):
+    """
+    Run add_hydrogens_and_clean_with_pymol() and restore any docking metadata
+    REMARKs that PyMOL drops when it rewrites the file.
+    """
+    current_span().set(bytes=file_size(pdb_file))
     metadata_present = False
     # Check if the PDB file already contains any metadata lines.
     try:
-        with open(args.pdb_file, "r") as file:
+        with open(pdb_file, "r") as file:
             for line in file:
-                if any(line.strip().startswith(key) for key in metadata_keywords):
+                if any(line.strip().startswith(key) for key in METADATA_KEYWORDS):
                     print(f"Metadata present !")
                     metadata_present = True
                     break
     except Exception as e:
-        print(f"Error checking metadata in {args.pdb_file}: {e}")
+        print(f"Error checking metadata in {pdb_file}: {e}")
 
     # If metadata is present, extract it.
     if metadata_present:
-        metadata = extract_ligand_metadata(args.pdb_file)
+        metadata = extract_ligand_metadata(pdb_file)
     else:
         metadata = []
 
     # Process the file with PyMOL.
-    pdb_file = add_hydrogens_and_clean_with_pymol(args.pdb_file)
+    pdb_file = add_hydrogens_and_clean_with_pymol(pdb_file, persistent_session)
 
     # If we extracted metadata, insert it at the top of the new file.
     if metadata:
         insert_metadata_into_pdb_content(pdb_file, metadata)
+    return pdb_file
+
+def add_hydrogens_to_file_list(file_list):
+    """
+    Packed-job mode: start PyMOL once and process every PDB file listed
+    (one path per line) in file_list.
+    """
+    with open(file_list, "r") as f:
+        pdb_files = [line.strip() for line in f if line.strip()]
+
+    pymol.finish_launching(['pymol', '-qc'])
+    for pdb_file in pdb_files:
+        try:
+            add_hydrogens_keeping_metadata(pdb_file, persistent_session=True)
+        except Exception as e:
+            print(f"Error adding hydrogens to {pdb_file}: {e}")
+            cmd.delete("all")
+    cmd.quit()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Add hydrogens and remove nonpolar hydrogens from a given PDB file."
+    )
+
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument(
+        "--pdb_file",
+        help="Path to the PDB file."
+    )
+    group.add_argument(
+        "--file_list",
+        help="Text file with one PDB path per line, processed in a single PyMOL session."
+    )
+    
+    args = parser.parse_args()
+
+    if args.file_list:
+        add_hydrogens_to_file_list(args.file_list)
+    else:
+        add_hydrogens_keeping_metadata(args.pdb_file)
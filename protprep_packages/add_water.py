@@ -1,152 +1,310 @@
 #!/usr/bin/env python3
-import sys
 import numpy as np
-import random
-import math
 import argparse
+from pathlib import Path
+from protprep_packages.pdb_parser import MISSING_INT, read_atom_table, valid_coordinates
+from protprep_packages.tracing import current_span, file_size, traced
 
 def parse_pdb(filename):
     """
     Parse the PDB file to extract all atom lines and their coordinates.
     Returns a list of lines (for output later) and a numpy array of atom coordinates.
     """
-    pdb_lines = []
-    coords = []
-    with open(filename, 'r') as f:
-        for line in f:
-            pdb_lines.append(line.rstrip())
-            if line.startswith("ATOM") or line.startswith("HETATM"):
-                try:
-                    x = float(line[30:38])
-                    y = float(line[38:46])
-                    z = float(line[46:54])
-                    coords.append([x, y, z])
-                except ValueError:
-                    continue
-    return pdb_lines, np.array(coords)
+    pdb_lines, atoms = read_atom_table(filename)
+    return pdb_lines, valid_coordinates(atoms)
+
+# Pocket mode: waters are placed within this distance (Å) of the site atoms.
+DEFAULT_SITE_RADIUS = 8.0
+
+# Placement engines of add_waters_to_structure(): lattice points or tiled pre-equilibrated box.
+WATER_ENGINES = ("grid", "box")
+
+# Box engine: a tiled water is also removed if one of its hydrogens is closer than this (Å) to the solute.
+BOX_HYDROGEN_CUTOFF = 1.5
+
+# Standard water geometry in Å, one row per atom (O, H1, H2)
+WATER_ATOM_NAMES = ("O", "H1", "H2")
+WATER_TEMPLATE = np.array([[0.0, 0.0, 0.0],
+                           [0.9572, 0.0, 0.0],
+                           [-0.2399872, 0.927297, 0.0]])
+
+def random_rotation_matrices(n, rng=None):
+    """
+    Create n uniformly distributed random 3D rotation matrices.
+    Uniform unit quaternions are drawn with Shoemake's method and converted
+    to rotation matrices in one vectorized step.
+    Returns an array of shape (n, 3, 3).
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    u1, u2, u3 = rng.random((3, n))
+    a = np.sqrt(1.0 - u1)
+    b = np.sqrt(u1)
+    w = a * np.sin(2 * np.pi * u2)
+    x = a * np.cos(2 * np.pi * u2)
+    y = b * np.sin(2 * np.pi * u3)
+    z = b * np.cos(2 * np.pi * u3)
+
+    R = np.empty((n, 3, 3))
+    R[:, 0, 0] = 1 - 2 * (y * y + z * z)
+    R[:, 0, 1] = 2 * (x * y - z * w)
+    R[:, 0, 2] = 2 * (x * z + y * w)
+    R[:, 1, 0] = 2 * (x * y + z * w)
+    R[:, 1, 1] = 1 - 2 * (x * x + z * z)
+    R[:, 1, 2] = 2 * (y * z - x * w)
+    R[:, 2, 0] = 2 * (x * z - y * w)
+    R[:, 2, 1] = 2 * (y * z + x * w)
+    R[:, 2, 2] = 1 - 2 * (x * x + y * y)
+    return R
 
 def random_rotation_matrix():
     """
-    Create a random 3D rotation matrix using Euler angles.
-    """
-    # random Euler angles (in radians)
-    a, b, c = [random.uniform(0, 2*math.pi) for _ in range(3)]
-    Rx = np.array([[1, 0, 0],
-                   [0, math.cos(a), -math.sin(a)],
-                   [0, math.sin(a), math.cos(a)]])
-    Ry = np.array([[math.cos(b), 0, math.sin(b)],
-                   [0, 1, 0],
-                   [-math.sin(b), 0, math.cos(b)]])
-    Rz = np.array([[math.cos(c), -math.sin(c), 0],
-                   [math.sin(c), math.cos(c), 0],
-                   [0, 0, 1]])
-    return Rz @ Ry @ Rx
+    Create a single uniformly distributed random 3D rotation matrix.
+    """
+    return random_rotation_matrices(1)[0]
+
+def create_water_molecules(origins, rng=None):
+    """
+    Create one randomly oriented water molecule per oxygen position in 'origins'.
+    Returns an array of shape (N, 3, 3): water, atom (O, H1, H2), xyz.
+    """
+    origins = np.asarray(origins, dtype=float).reshape(-1, 3)
+    R = random_rotation_matrices(len(origins), rng)
+    return np.einsum("nij,aj->nai", R, WATER_TEMPLATE) + origins[:, None, :]
 
 def create_water_molecule(origin):
     """
     Create a water molecule (O, H1, H2) with the oxygen at 'origin'.
-    The water geometry is based on:
-      O at (0,0,0)
-      H1 at (0.9572, 0, 0)
-      H2 at (-0.2399872, 0.927297, 0)
-    A random rotation is applied to the molecule.
     Returns a list of tuples: (atom_name, x, y, z)
     """
-    # Standard water geometry in Å
-    water_template = {
-        'O': np.array([0.0, 0.0, 0.0]),
-        'H1': np.array([0.9572, 0.0, 0.0]),
-        'H2': np.array([-0.2399872, 0.927297, 0.0])
-    }
-    R = random_rotation_matrix()
-    water_atoms = []
-    for atom, pos in water_template.items():
-        pos_rot = R @ pos + origin
-        water_atoms.append((atom, pos_rot[0], pos_rot[1], pos_rot[2]))
-    return water_atoms
-
-def write_pdb(filename, pdb_lines, water_mols, start_atom_number, start_residue_number):
+    water = create_water_molecules(origin)[0]
+    return [(name, *pos) for name, pos in zip(WATER_ATOM_NAMES, water.tolist())]
+
+@traced("water_write")
+def write_pdb(filename, pdb_lines, water_mols, start_atom_number, start_residue_number, chunk_size=50000):
     """
     Write a new PDB file that includes the original lines and the added waters.
-    water_mols is a list where each element is a list of water atoms.
+    water_mols is an (N, 3, 3) array as returned by create_water_molecules().
+    Waters are formatted and written in chunks to keep memory flat.
     """
+    # Format: ATOM, atom number, atom name, residue name, chain, residue number, x,y,z, occupancy, B-factor, element
+    records = ["ATOM  {:5d} " + f"{name:^4s}" + " HOH A{:4d}    {:8.3f}{:8.3f}{:8.3f}  1.00 20.00           " + f"{name[0]:>2s}\n"
+               for name in WATER_ATOM_NAMES]
+    water_mols = np.asarray(water_mols, dtype=float).reshape(-1, len(WATER_ATOM_NAMES), 3)
     with open(filename, 'w') as f:
         # Write original PDB lines
         for line in pdb_lines:
             f.write(line + "\n")
         # Write water molecules
-        atom_number = start_atom_number
-        res_number = start_residue_number
-        for water in water_mols:
-            for atom in water:
-                # Format: ATOM, atom number, atom name, residue name, chain, residue number, x,y,z, occupancy, B-factor, element
-                record = "ATOM  {atom_number:5d} {atom_name:^4s} HOH A{res_number:4d}    {x:8.3f}{y:8.3f}{z:8.3f}  1.00 20.00           {element:>2s}"
-                element = atom[0][0]  # first letter (e.g., O or H)
-                f.write(record.format(atom_number=atom_number,
-                                        atom_name=atom[0],
-                                        res_number=res_number,
-                                        x=atom[1],
-                                        y=atom[2],
-                                        z=atom[3],
-                                        element=element) + "\n")
-                atom_number += 1
-            res_number += 1
+        for start in range(0, len(water_mols), chunk_size):
+            block = []
+            for i, water in enumerate(water_mols[start:start + chunk_size].tolist(), start=start):
+                res_number = start_residue_number + i
+                atom_number = start_atom_number + i * len(WATER_ATOM_NAMES)
+                for j, (record, (x, y, z)) in enumerate(zip(records, water)):
+                    block.append(record.format(atom_number + j, res_number, x, y, z))
+            f.write("".join(block))
         f.write("END\n")
 
-def add_waters_to_structure(pdb_coords, margin=5.0, spacing=2.75, cutoff=2.2):
+def site_mask(atoms, selection):
+    """
+    Flag the atoms of a binding-site selection: a comma-separated list of
+    residue names (e.g. "UNL"), chain:residue numbers (e.g. "A:42") and/or
+    "ligand" for every HETATM residue other than water.
+    Returns a boolean array with one entry per atom record.
+    """
+    mask = np.zeros(len(atoms), dtype=bool)
+    resn = np.char.strip(atoms['resn'])
+    for item in (item.strip() for item in selection.split(",")):
+        if not item:
+            continue
+        if item.lower() == "ligand":
+            mask |= (np.char.strip(atoms['record']) == "HETATM") & ~np.isin(resn, ("HOH", "WAT"))
+        elif ":" in item:
+            chain, _, resseq = item.partition(":")
+            try:
+                mask |= (np.char.strip(atoms['chain']) == chain.strip()) & (atoms['resseq'] == int(resseq))
+            except ValueError:
+                raise ValueError(f"Invalid site residue '{item}' (expected chain:number, e.g. A:42)")
+        else:
+            mask |= resn == item.upper()
+    return mask
+
+def points_near(points, coords, cutoff, chunk_size=1000000):
+    """
+    Flag the points that lie within 'cutoff' of any of 'coords'.
+    The coordinates are binned into cubic cells of edge 'cutoff' and sorted by
+    cell, so each point is only distance-tested against the atoms of its own
+    and the 26 neighbouring cells, in vectorized passes over all points.
+    Returns a boolean array with one entry per point.
+    """
+    if not cutoff > 0:
+        raise ValueError(f"cutoff must be positive, got {cutoff}")
+    points = np.asarray(points, dtype=float).reshape(-1, 3)
+    coords = np.asarray(coords, dtype=float).reshape(-1, 3)
+    near = np.zeros(len(points), dtype=bool)
+    if len(points) == 0 or len(coords) == 0:
+        return near
+
+    origin = np.min(coords, axis=0)
+    cells = np.floor((coords - origin) / cutoff).astype(np.int64)
+    shape = cells.max(axis=0) + 1
+    keys = np.ravel_multi_index(cells.T, shape)
+    order = np.argsort(keys, kind="stable")
+    keys, coords = keys[order], coords[order]
+    cutoff_sq = cutoff ** 2
+
+    steps = np.array([-1, 0, 1])
+    offsets = np.stack(np.meshgrid(steps, steps, steps, indexing="ij"), axis=-1).reshape(-1, 3)
+    # Nearest cells first: most points within cutoff are found early and drop out of later passes.
+    offsets = offsets[np.argsort(np.abs(offsets).sum(axis=1), kind="stable")]
+    upper = np.max(coords, axis=0) + cutoff
+    for start in range(0, len(points), chunk_size):
+        # Only the points inside the atoms' bounding box (plus cutoff) can be near any of them.
+        chunk_index = start + np.nonzero(np.all((points[start:start + chunk_size] >= origin - cutoff)
+                                                & (points[start:start + chunk_size] <= upper), axis=1))[0]
+        chunk = points[chunk_index]
+        chunk_near = np.zeros(len(chunk), dtype=bool)
+        base = np.floor((chunk - origin) / cutoff).astype(np.int64)
+        for offset in offsets:
+            idx = base + offset
+            candidates = np.nonzero(np.all((idx >= 0) & (idx < shape), axis=1) & ~chunk_near)[0]
+            cell_keys = np.ravel_multi_index(idx[candidates].T, shape)
+            first = np.searchsorted(keys, cell_keys, side="left")
+            count = np.searchsorted(keys, cell_keys, side="right") - first
+            # One pass per atom slot: the k-th atom of every candidate's cell at once.
+            while candidates.size:
+                occupied = count > 0
+                candidates, first, count = candidates[occupied], first[occupied], count[occupied]
+                hit = np.sum((coords[first] - chunk[candidates]) ** 2, axis=1) <= cutoff_sq
+                chunk_near[candidates[hit]] = True
+                candidates, first, count = candidates[~hit], first[~hit] + 1, count[~hit] - 1
+        near[chunk_index] = chunk_near
+    return near
+
+def tile_water_box(min_coords, max_coords, cell=None, box_waters=None):
+    """
+    Cover the region [min_coords, max_coords) with copies of a periodic water
+    box (default: the bundled pre-equilibrated TIP3P box) laid side by side.
+    Waters whose oxygen falls outside the region are dropped.
+    Returns an (N, 3, 3) array of water molecules (water, atom, xyz).
+    """
+    if cell is None or box_waters is None:
+        from protprep_packages.water_box import load_water_box
+        cell, box_waters = load_water_box()
+    min_coords = np.asarray(min_coords, dtype=float)
+    max_coords = np.asarray(max_coords, dtype=float)
+    counts = np.maximum(np.ceil((max_coords - min_coords) / cell).astype(np.int64), 0)
+    tiles = np.indices(counts).reshape(3, -1).T * cell + min_coords
+
+    waters = (box_waters[None, :, :, :] + tiles[:, None, None, :]).reshape(-1, 3, 3)
+    oxygens = waters[:, 0, :]
+    inside = np.all((oxygens >= min_coords) & (oxygens < max_coords), axis=1)
+    return waters[inside]
+
+@traced("water_placement")
+def add_waters_to_structure(pdb_coords, margin=5.0, spacing=2.75, cutoff=2.2, site_coords=None,
+                            site_radius=DEFAULT_SITE_RADIUS, engine="grid"):
     """
     Create a grid of water molecules around the structure.
     - margin: extra distance (Å) added to the bounding box.
     - spacing: grid spacing in Å.
     - cutoff: distance threshold (Å); water oxygen is not placed if too close to any solute atom.
-    Returns a list of water molecules.
+    - site_coords: pocket mode; if given, waters are only placed within
+      site_radius (Å) of these atoms (e.g. the docked ligand) instead of
+      over the whole bounding box.
+    - engine: "grid" places randomly oriented waters on a cubic lattice of
+      'spacing'; "box" tiles the bundled pre-equilibrated water box over the
+      region instead, for liquid density and orientations (spacing unused).
+    Returns an (N, 3, 3) array of water molecules (water, atom, xyz).
     """
+    if engine not in WATER_ENGINES:
+        raise ValueError(f"Unknown water engine '{engine}' (expected one of {', '.join(WATER_ENGINES)})")
+    for name, value in (("spacing", spacing), ("cutoff", cutoff), ("site_radius", site_radius)):
+        if not value > 0:
+            raise ValueError(f"{name} must be positive, got {value}")
     if pdb_coords.size == 0:
         raise ValueError("No coordinates found in the PDB file.")
 
-    min_coords = np.min(pdb_coords, axis=0) - margin
-    max_coords = np.max(pdb_coords, axis=0) + margin
+    if site_coords is not None:
+        site_coords = np.asarray(site_coords, dtype=float).reshape(-1, 3)
+        if site_coords.size == 0:
+            raise ValueError("No atoms found for the binding site.")
+        min_coords = np.min(site_coords, axis=0) - site_radius
+        max_coords = np.max(site_coords, axis=0) + site_radius
+        # Only the solute atoms that can clash with a point of the pocket box are tested.
+        near = np.all((pdb_coords >= min_coords - cutoff) & (pdb_coords <= max_coords + cutoff), axis=1)
+        pdb_coords = pdb_coords[near]
+    else:
+        min_coords = np.min(pdb_coords, axis=0) - margin
+        max_coords = np.max(pdb_coords, axis=0) + margin
+
+    if engine == "box":
+        waters = tile_water_box(min_coords, max_coords)
+        if site_coords is not None:
+            waters = waters[points_near(waters[:, 0, :], site_coords, site_radius)]
+        # Bulk clash removal: one neighbour search for the oxygens, then one for the hydrogens of the survivors.
+        waters = waters[~points_near(waters[:, 0, :], pdb_coords, cutoff)]
+        return waters[~points_near(waters[:, 1:, :], pdb_coords, BOX_HYDROGEN_CUTOFF).reshape(-1, 2).any(axis=1)]
 
-    water_mols = []
     # Generate grid points
     x_range = np.arange(min_coords[0], max_coords[0], spacing)
     y_range = np.arange(min_coords[1], max_coords[1], spacing)
     z_range = np.arange(min_coords[2], max_coords[2], spacing)
+    points = np.stack(np.meshgrid(x_range, y_range, z_range, indexing="ij"), axis=-1).reshape(-1, 3)
 
-    for x in x_range:
-        for y in y_range:
-            for z in z_range:
-                point = np.array([x, y, z])
-                # Check if point is at least cutoff away from any solute atom.
-                dists = np.linalg.norm(pdb_coords - point, axis=1)
-                if np.min(dists) > cutoff:
-                    water_mols.append(create_water_molecule(point))
-    return water_mols
+    # The same neighbour search as the box engine: keep the points inside the pocket,
+    # then those more than cutoff away from all solute atoms.
+    if site_coords is not None:
+        points = points[points_near(points, site_coords, site_radius)]
+    points = points[~points_near(points, pdb_coords, cutoff)]
 
-def main(input_pdb):
+    return create_water_molecules(points)
 
-    output_pdb = "test.pdb"
+def default_output(input_pdb):
+    """Output file of main() for input_pdb: <stem>_water.pdb next to the input."""
+    input_pdb = Path(input_pdb)
+    return input_pdb.with_name(f"{input_pdb.stem}_water.pdb")
+
+@traced("add_water")
+def main(input_pdb, output_pdb=None, site=None, site_radius=DEFAULT_SITE_RADIUS, engine=None):
+    """
+    Add waters to input_pdb and write them to output_pdb (default:
+    default_output(input_pdb)). With a site selection (see site_mask())
+    waters are only placed within site_radius of the site; a selection that
+    matches no atoms falls back to the whole structure with a warning.
+    engine: "grid" or "box" (default: "grid").
+    Returns the output path.
+    """
+
+    output_pdb = Path(output_pdb) if output_pdb is not None else default_output(input_pdb)
+    site_radius = DEFAULT_SITE_RADIUS if site_radius is None else site_radius
+    if not site_radius > 0:
+        raise ValueError(f"site_radius must be positive, got {site_radius}")
+    engine = engine or "grid"
 
     # Parse original PDB
-    pdb_lines, pdb_coords = parse_pdb(input_pdb)
+    pdb_lines, atoms = read_atom_table(input_pdb)
+    pdb_coords = valid_coordinates(atoms)
     print(f"Read {len(pdb_coords)} atoms from {input_pdb}")
+    current_span().set(atoms=len(atoms), bytes=file_size(input_pdb))
+
+    site_coords = None
+    if site:
+        site_coords = valid_coordinates(atoms[site_mask(atoms, site)])
+        if len(site_coords) == 0:
+            print(f"Warning: site '{site}' matches no atoms in {input_pdb}; adding waters around the whole structure")
+            site_coords = None
+        else:
+            print(f"Pocket mode: {len(site_coords)} site atoms ({site}), radius {site_radius} Å")
 
     # Create water molecules
-    water_mols = add_waters_to_structure(pdb_coords)
+    water_mols = add_waters_to_structure(pdb_coords, site_coords=site_coords, site_radius=site_radius, engine=engine)
     print(f"Added {len(water_mols)} water molecules.")
 
     # Determine starting atom and residue numbers for water molecules
-    last_atom_number = 0
-    last_residue_number = 0
-    for line in pdb_lines:
-        if line.startswith("ATOM") or line.startswith("HETATM"):
-            try:
-                atom_num = int(line[6:11])
-                res_num = int(line[22:26])
-                last_atom_number = max(last_atom_number, atom_num)
-                last_residue_number = max(last_residue_number, res_num)
-            except ValueError:
-                continue
+    numbered = (atoms['serial'] != MISSING_INT) & (atoms['resseq'] != MISSING_INT)
+    last_atom_number = max(0, int(atoms['serial'][numbered].max(initial=0)))
+    last_residue_number = max(0, int(atoms['resseq'][numbered].max(initial=0)))
 
     start_atom_number = last_atom_number + 1
     start_residue_number = last_residue_number + 1
@@ -154,6 +312,7 @@ def main(input_pdb):
     # Write output PDB file with added water molecules
     write_pdb(output_pdb, pdb_lines, water_mols, start_atom_number, start_residue_number)
     print(f"Output written to {output_pdb}")
+    return output_pdb
 
 if __name__ == "__main__":
 
@@ -166,7 +325,33 @@ if __name__ == "__main__":
         required=True,
         help="Path to the PDB file."
     )
+    parser.add_argument(
+        "--output",
+        default=None,
+        help="Output PDB file (default: <pdb_file stem>_water.pdb next to the input)."
+    )
+    parser.add_argument(
+        "--site",
+        default=None,
+        help="Pocket mode: only place waters near these residues, e.g. 'ligand', 'UNL' or 'A:42,A:87' "
+             "(default: the whole structure)."
+    )
+    parser.add_argument(
+        "--site_radius",
+        type=float,
+        default=DEFAULT_SITE_RADIUS,
+        help=f"Pocket mode: distance (Å) from the site atoms within which waters are placed (default: {DEFAULT_SITE_RADIUS})."
+    )
+    parser.add_argument(
+        "--engine",
+        choices=WATER_ENGINES,
+        default=None,
+        help="'grid': waters on a cubic lattice; 'box': tile a pre-equilibrated water box "
+             "(default: grid)."
+    )
     
     args = parser.parse_args()
+    if not args.site_radius > 0:
+        parser.error(f"--site_radius must be positive, got {args.site_radius}")
 
-    main(args.pdb_file)
+    main(args.pdb_file, args.output, args.site, args.site_radius, args.engine)
@@ -0,0 +1,275 @@
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+import numpy as np
+from protprep_packages import synthetic
+from protprep_packages.tables import print_table
+
+"""
+Benchmarks of the compute paths on deterministic synthetic structures.
+Each case is timed (best and median of --repeat runs) and memory-profiled
+(tracemalloc peak, in a separate run) for every size in --sizes, and the
+results are written as JSON so runs on two commits can be compared with
+--compare. Cases whose dependencies (PyMOL, OpenBabel) are not installed are
+reported as skipped. The add_water_site cases run add_water.main() with a
+site on each engine and fail if a water is placed outside the pocket.
+
+    python -m protprep_packages.benchmark --sizes 1000 100000 --output bench.json
+    python -m protprep_packages.benchmark --compare bench_old.json --output bench_new.json
+"""
+
+DEFAULT_SIZES = (1000, 10000, 100000, 1000000)
+MAIN_SCRIPT = Path(__file__).resolve().parents[1] / "protprep_main_v3.2.py"
+
+class Skip(Exception):
+    """Raised by a case's setup when it cannot run in this environment."""
+
+def _load_main_module():
+    """Import the main script (its file name is not a valid module name)."""
+    spec = importlib.util.spec_from_file_location("protprep_main", MAIN_SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    try:
+        spec.loader.exec_module(module)
+    except ImportError as e:
+        raise Skip(f"main script imports unavailable: {e}")
+    return module
+
+class Workspace:
+    """Generates and caches the synthetic inputs of one benchmark run."""
+
+    def __init__(self, directory, seed=0):
+        self.directory = Path(directory)
+        self.seed = seed
+        self._files = {}
+
+    def _cached(self, key, make):
+        if key not in self._files:
+            self._files[key] = make(str(self.directory / ("_".join(map(str, key)))))
+        return self._files[key]
+
+    def pdb(self, n_atoms):
+        return self._cached(("protein", n_atoms, ".pdb"),
+                            lambda path: synthetic.write_pdb(path, n_atoms, seed=self.seed))
+
+    def receptor_pdbqt(self, n_atoms):
+        return self._cached(("receptor", n_atoms, ".pdbqt"),
+                            lambda path: synthetic.write_receptor_pdbqt(path, n_atoms, seed=self.seed))
+
+    def ligand_pdbqt(self, n_atoms, index=0):
+        return self._cached(("ligand", n_atoms, index, ".pdbqt"),
+                            lambda path: synthetic.write_ligand_pdbqt(path, n_atoms, seed=self.seed + index))
+
+# Each case: setup(workspace, n_atoms) -> zero-argument callable that runs the measured code.
+
+def _case_parse_pdb(workspace, n_atoms):
+    from protprep_packages.add_water import parse_pdb
+    pdb_file = workspace.pdb(n_atoms)
+    return lambda: parse_pdb(pdb_file)
+
+def _case_add_waters(workspace, n_atoms):
+    from protprep_packages.add_water import add_waters_to_structure, parse_pdb
+    _, coords = parse_pdb(workspace.pdb(n_atoms))
+    return lambda: add_waters_to_structure(coords)
+
+def _case_add_waters_box(workspace, n_atoms):
+    from protprep_packages.add_water import add_waters_to_structure, parse_pdb
+    _, coords = parse_pdb(workspace.pdb(n_atoms))
+    return lambda: add_waters_to_structure(coords, engine="box")
+
+def _case_add_water_site(workspace, n_atoms, engine="grid"):
+    # End to end through add_water.main() in pocket mode; also checks that the
+    # waters stay within the site radius, so a broken site path fails here.
+    from protprep_packages import add_water
+    from protprep_packages.pdb_parser import read_atom_table, valid_coordinates
+    pdb_file = workspace.pdb(n_atoms)
+    output_pdb = str(workspace.directory / f"site_{engine}_{n_atoms}.pdb")
+    site, site_radius = "HEM", 6.0
+
+    def run():
+        add_water.main(pdb_file, output_pdb, site, site_radius, engine)
+        _, atoms = read_atom_table(output_pdb)
+        site_coords = valid_coordinates(atoms[add_water.site_mask(atoms, site)])
+        is_water = (np.char.strip(atoms['resn']) == "HOH") & (np.char.strip(atoms['name']) == "O")
+        oxygens = valid_coordinates(atoms[is_water & (atoms['serial'] > n_atoms)])
+        if not len(oxygens) or not add_water.points_near(oxygens, site_coords, site_radius + 1e-3).all():
+            raise AssertionError(f"{len(oxygens)} waters added, not all within {site_radius} Å of {site}")
+    return run
+
+def _case_pdbqt_to_pdb(workspace, n_atoms):
+    from protprep_packages.pdbqt_converter import convert_file
+    receptor = workspace.receptor_pdbqt(n_atoms)
+    return lambda: convert_file(receptor, str(workspace.directory / f"converted_{n_atoms}.pdb"))
+
+def _case_chain_clean(workspace, n_atoms):
+    main = _load_main_module()
+    pdb_file = workspace.pdb(n_atoms)
+    return lambda: main.extract_single_chain_and_clean(pdb_file, "A", "SYN", ["HEM"], ["SO4"], ["ZN"])
+
+def _case_ligand_metadata(workspace, n_atoms):
+    from protprep_packages.ligand_metadata import extract_ligand_metadata
+    # n_atoms is the total over all poses of the docked ligand.
+    ligand_file = workspace.ligand_pdbqt(max(n_atoms // 9, 1))
+    return lambda: extract_ligand_metadata(ligand_file)
+
+def _case_combine(workspace, n_atoms):
+    try:
+        from protprep_packages.combinator_pdb import PymolCombiner
+        from pymol import cmd
+    except ImportError as e:
+        raise Skip(f"PyMOL/OpenBabel unavailable: {e}")
+    receptor = workspace.receptor_pdbqt(n_atoms)
+    ligands = [workspace.ligand_pdbqt(30, index) for index in range(4)]
+    output_prefix = str(workspace.directory / f"complex_{n_atoms}")
+
+    def run():
+        cmd.delete("all")
+        combiner = PymolCombiner([receptor], list(ligands))
+        combiner.load_structures()
+        return combiner.combine_structures(output_prefix=output_prefix)
+    return run
+
+def _case_compose(workspace, n_atoms):
+    # compose_complexes() runs without PyMOL.
+    from protprep_packages.combinator_pdb import PymolCombiner
+    receptor = workspace.receptor_pdbqt(n_atoms)
+    ligands = [workspace.ligand_pdbqt(30, index) for index in range(4)]
+    output_prefix = str(workspace.directory / f"composed_{n_atoms}")
+    return lambda: PymolCombiner([receptor], list(ligands)).compose_complexes(output_prefix=output_prefix)
+
+CASES = {
+    "parse_pdb": _case_parse_pdb,
+    "add_waters_to_structure": _case_add_waters,
+    "add_waters_box": _case_add_waters_box,
+    "add_water_site": _case_add_water_site,
+    "add_water_site_box": lambda workspace, n_atoms: _case_add_water_site(workspace, n_atoms, "box"),
+    "extract_single_chain_and_clean": _case_chain_clean,
+    "extract_ligand_metadata": _case_ligand_metadata,
+    "pdbqt_to_pdb": _case_pdbqt_to_pdb,
+    "combine_structures": _case_combine,
+    "compose_complexes": _case_compose,
+}
+
+def measure(function, repeat):
+    """Return (timings in seconds, tracemalloc peak in bytes) of 'repeat' timed runs and one traced run."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return timings, peak
+
+def run_benchmarks(cases=None, sizes=DEFAULT_SIZES, repeat=3, seed=0, work_dir=None):
+    """
+    Run the selected cases (default: all of CASES) for every size.
+    Returns a list of result dicts (case, atoms, status, best/median seconds, peak bytes).
+    """
+    results = []
+    with tempfile.TemporaryDirectory(dir=work_dir) as directory:
+        workspace = Workspace(directory, seed)
+        for case in cases or CASES:
+            for n_atoms in sizes:
+                result = {'case': case, 'atoms': n_atoms}
+                try:
+                    function = CASES[case](workspace, n_atoms)
+                    timings, peak = measure(function, repeat)
+                    result.update(status="ok", best_seconds=min(timings),
+                                  median_seconds=statistics.median(timings), repeats=repeat, peak_bytes=peak)
+                except Skip as e:
+                    result.update(status="skipped", reason=str(e))
+                except Exception as e:
+                    result.update(status="error", reason=f"{type(e).__name__}: {e}")
+                print(_format_result(result), flush=True)
+                results.append(result)
+    return results
+
+def _format_result(result):
+    if result['status'] != "ok":
+        return f"{result['case']:<32s} {result['atoms']:>9d} atoms  {result['status']}: {result['reason']}"
+    return (f"{result['case']:<32s} {result['atoms']:>9d} atoms  best {result['best_seconds'] * 1000:10.2f} ms  "
+            f"median {result['median_seconds'] * 1000:10.2f} ms  peak {result['peak_bytes'] / 1e6:8.1f} MB")
+
+def environment():
+    """Describe the code and machine a benchmark run was made on."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=MAIN_SCRIPT.parent,
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'commit': commit,
+        'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        'python': sys.version.split()[0],
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
+
+def compare(baseline, results):
+    """Print the speed and memory ratios of 'results' against a baseline results list."""
+    previous = {(r['case'], r['atoms']): r for r in baseline if r['status'] == "ok"}
+    header = ("CASE", "ATOMS", "BEST ms", "BASELINE ms", "SPEEDUP", "PEAK MB", "BASELINE MB")
+    rows = []
+    for result in results:
+        old = previous.get((result['case'], result['atoms']))
+        if result['status'] != "ok" or old is None:
+            continue
+        rows.append((result['case'], str(result['atoms']),
+                     f"{result['best_seconds'] * 1000:.2f}", f"{old['best_seconds'] * 1000:.2f}",
+                     f"{old['best_seconds'] / result['best_seconds']:.2f}x",
+                     f"{result['peak_bytes'] / 1e6:.1f}", f"{old['peak_bytes'] / 1e6:.1f}"))
+    print_table(header, rows)
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark the compute paths on synthetic structures and write the results as JSON."
+    )
+    parser.add_argument(
+        "--cases",
+        nargs="+",
+        choices=list(CASES),
+        default=None,
+        help="Cases to run (default: all)."
+    )
+    parser.add_argument(
+        "--sizes",
+        nargs="+",
+        type=int,
+        default=list(DEFAULT_SIZES),
+        help="Structure sizes in atoms (default: 1000 10000 100000 1000000)."
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per case and size (default: 3).")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic structures (default: 0).")
+    parser.add_argument("--output", default="benchmark_results.json", help="Results file (JSON).")
+    parser.add_argument("--compare", default=None, help="Earlier results file to compare against.")
+
+    args = parser.parse_args()
+
+    baseline_results = None
+    if args.compare:
+        # Read first: the baseline may be the file about to be overwritten.
+        with open(args.compare, "r") as f:
+            baseline_results = json.load(f)['results']
+
+    benchmark_results = run_benchmarks(args.cases, args.sizes, args.repeat, args.seed)
+    with open(args.output, "w") as f:
+        json.dump({'environment': environment(), 'seed': args.seed, 'results': benchmark_results}, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if baseline_results is not None:
+        compare(baseline_results, benchmark_results)
@@ -0,0 +1,275 @@
+import gzip
+import mmap
+import re
+import numpy as np
+from protprep_packages.pdb_parser import ATOM_DTYPE, MISSING_INT, decode_numbers
+
+"""
+mmCIF and BinaryCIF readers for the _atom_site category.
+Only the atom_site columns the pipeline needs are decoded; everything else in
+the file is skipped without being parsed. Both readers return the same atom
+table as pdb_parser.parse_atom_records().
+"""
+
+CIF_SUFFIXES = (".cif", ".mmcif", ".bcif")
+
+# Atom table field -> atom_site columns to read it from, in order of preference.
+ATOM_SITE_COLUMNS = {
+    'record': ("group_PDB",),
+    'serial': ("id",),
+    'name': ("auth_atom_id", "label_atom_id"),
+    'resn': ("auth_comp_id", "label_comp_id"),
+    'chain': ("auth_asym_id", "label_asym_id"),
+    'resseq': ("auth_seq_id", "label_seq_id"),
+    'x': ("Cartn_x",),
+    'y': ("Cartn_y",),
+    'z': ("Cartn_z",),
+    'occupancy': ("occupancy",),
+    'bfactor': ("B_iso_or_equiv",),
+    'element': ("type_symbol",),
+    'model': ("pdbx_PDB_model_num",),
+}
+
+# CIF tokens for unknown ('?') and inapplicable ('.') values.
+_NULL_TOKENS = (b"?", b".")
+_QUOTED_TOKEN = re.compile(rb"'(?:[^']|'(?!\s))*'(?=\s|$)|\"(?:[^\"]|\"(?!\s))*\"(?=\s|$)|\S+")
+
+def is_cif_file(filename):
+    """Return True if the file name looks like an mmCIF or BinaryCIF file (optionally gzipped)."""
+    name = str(filename).lower()
+    if name.endswith(".gz"):
+        name = name[:-3]
+    return name.endswith(CIF_SUFFIXES)
+
+def read_cif_atom_table(filename, first_model_only=True):
+    """
+    Read the atom table of an mmCIF (.cif) or BinaryCIF (.bcif) file.
+    Returns a structured array with dtype pdb_parser.ATOM_DTYPE.
+    """
+    name = str(filename).lower()
+    if name.endswith(".bcif") or name.endswith(".bcif.gz"):
+        columns = read_bcif_atom_site(filename)
+    else:
+        columns = read_mmcif_atom_site(filename)
+    return atom_site_to_table(columns, first_model_only=first_model_only)
+
+def _wanted_columns():
+    return {name for names in ATOM_SITE_COLUMNS.values() for name in names}
+
+def _open_buffer(filename):
+    """
+    Return a read-only buffer over the file: a memory map for plain files,
+    the decompressed bytes for gzipped ones.
+    """
+    if str(filename).lower().endswith(".gz"):
+        with gzip.open(filename, "rb") as f:
+            return f.read()
+    with open(filename, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+# ---------------------------------------------------------------- mmCIF text
+
+def _tokenize(chunk):
+    """Split a block of CIF data lines into tokens, honouring quoted values."""
+    if b"'" not in chunk and b'"' not in chunk:
+        return chunk.split()
+    return _QUOTED_TOKEN.findall(chunk)
+
+def read_mmcif_atom_site(filename, chunk_size=1 << 24):
+    """
+    Read the requested _atom_site columns of an mmCIF file.
+    The file is memory-mapped; only the atom_site loop is tokenized, in chunks
+    of roughly 'chunk_size' bytes, and only the wanted columns are kept.
+    Returns a dict of column name -> list of raw byte tokens.
+    """
+    buffer = _open_buffer(filename)
+    view = memoryview(buffer)
+    try:
+        header_start = buffer.find(b"\n_atom_site.")
+        if header_start < 0:
+            raise ValueError(f"No _atom_site loop found in {filename}")
+
+        # Header: one "_atom_site.<name>" line per column.
+        names = []
+        pos = header_start + 1
+        while buffer[pos:pos + 11] == b"_atom_site.":
+            end = buffer.find(b"\n", pos)
+            names.append(bytes(view[pos + 11:end]).strip().decode())
+            pos = end + 1
+        data_start = pos
+
+        # The loop ends at the next comment, loop, category or data block.
+        ends = [buffer.find(marker, data_start) for marker in (b"\n#", b"\nloop_", b"\n_", b"\ndata_")]
+        data_end = min([end for end in ends if end >= 0], default=len(buffer))
+
+        wanted = {i: name for i, name in enumerate(names) if name in _wanted_columns()}
+        columns = {name: [] for name in wanted.values()}
+        n_columns = len(names)
+
+        leftover = []
+        pos = data_start
+        while pos < data_end:
+            end = min(pos + chunk_size, data_end)
+            if end < data_end:
+                # Never split a line between two chunks.
+                end = buffer.find(b"\n", end, data_end) + 1 or data_end
+            tokens = leftover + _tokenize(bytes(view[pos:end]))
+            n_full = len(tokens) // n_columns * n_columns
+            for i, name in wanted.items():
+                columns[name].extend(tokens[i:n_full:n_columns])
+            leftover = tokens[n_full:]
+            pos = end
+    finally:
+        view.release()
+        if isinstance(buffer, mmap.mmap):
+            buffer.close()
+    return columns
+
+# ---------------------------------------------------------------- BinaryCIF
+
+_BCIF_TYPES = {1: "<i1", 2: "<i2", 3: "<i4", 4: "<u1", 5: "<u2", 6: "<u4", 32: "<f4", 33: "<f8"}
+
+def _unpack_integers(data, byte_count, is_unsigned):
+    """Undo BinaryCIF IntegerPacking: runs of limit values are summed with the next value."""
+    data = data.astype(np.int64)
+    bits = 8 * byte_count
+    if is_unsigned:
+        continuation = data == (1 << bits) - 1
+    else:
+        continuation = (data == (1 << (bits - 1)) - 1) | (data == -(1 << (bits - 1)))
+    if not np.any(continuation):
+        return data
+    ends = np.nonzero(~continuation)[0]
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    return np.add.reduceat(data, starts)
+
+def _decode_bcif(data, encodings):
+    """Apply a BinaryCIF encoding chain in reverse to recover a column's values."""
+    for encoding in reversed(encodings):
+        kind = encoding["kind"]
+        if kind == "ByteArray":
+            data = np.frombuffer(data, dtype=_BCIF_TYPES[encoding["type"]])
+        elif kind == "FixedPoint":
+            data = data.astype(np.float64) / encoding["factor"]
+        elif kind == "IntervalQuantization":
+            step = (encoding["max"] - encoding["min"]) / (encoding["numSteps"] - 1)
+            data = encoding["min"] + step * data.astype(np.float64)
+        elif kind == "RunLength":
+            data = np.repeat(data[0::2], data[1::2])
+        elif kind == "Delta":
+            data = np.cumsum(data.astype(np.int64)) + encoding["origin"]
+        elif kind == "IntegerPacking":
+            data = _unpack_integers(data, encoding["byteCount"], encoding["isUnsigned"])
+        elif kind == "StringArray":
+            indices = _decode_bcif(data, encoding["dataEncoding"])
+            offsets = _decode_bcif(encoding["offsets"], encoding["offsetEncoding"])
+            string_data = encoding["stringData"].encode()
+            strings = np.array([string_data[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)] + [b""])
+            # Index -1 marks a missing value and maps to the trailing empty string.
+            data = strings[indices]
+        else:
+            raise ValueError(f"Unsupported BinaryCIF encoding: {kind}")
+    return data
+
+def read_bcif_atom_site(filename):
+    """
+    Read the requested _atom_site columns of a BinaryCIF file.
+    The msgpack container is unpacked from a memory map; only the wanted
+    columns of the atom_site category are decoded.
+    Returns a dict of column name -> NumPy array.
+    """
+    try:
+        import msgpack
+    except ImportError:
+        raise ImportError("Reading BinaryCIF files requires the 'msgpack' package (pip install msgpack).")
+
+    buffer = _open_buffer(filename)
+    try:
+        container = msgpack.unpackb(buffer, raw=False)
+    finally:
+        if isinstance(buffer, mmap.mmap):
+            buffer.close()
+
+    wanted = _wanted_columns()
+    for block in container["dataBlocks"]:
+        for category in block["categories"]:
+            if category["name"] != "_atom_site":
+                continue
+            columns = {}
+            for column in category["columns"]:
+                if column["name"] not in wanted:
+                    continue
+                values = _decode_bcif(column["data"]["data"], column["data"]["encoding"])
+                mask = column.get("mask")
+                if mask is not None:
+                    # Non-zero mask entries are '.' or '?' values.
+                    null = _decode_bcif(mask["data"], mask["encoding"]) != 0
+                    if values.dtype.kind == "S":
+                        values = np.where(null, b"", values)
+                    else:
+                        values = np.where(null, np.nan, values.astype(np.float64))
+                columns[column["name"]] = values
+            return columns
+    raise ValueError(f"No _atom_site category found in {filename}")
+
+# ---------------------------------------------------------------- atom table
+
+def _text_column(values, width):
+    """Convert raw CIF tokens to stripped text, removing quotes and null markers."""
+    values = np.asarray(values, dtype="S")
+    if values.size:
+        quoted = (np.char.startswith(values, b"'") & np.char.endswith(values, b"'")) | \
+                 (np.char.startswith(values, b'"') & np.char.endswith(values, b'"'))
+        quoted &= np.char.str_len(values) >= 2
+        if np.any(quoted):
+            values = values.astype(object)
+            values[quoted] = [value[1:-1] for value in values[quoted]]
+            values = values.astype("S")
+        values[np.isin(values, _NULL_TOKENS)] = b""
+    return np.char.decode(values, "ascii", "replace").astype(f"U{width}")
+
+def _number_column(values, dtype, missing):
+    """Convert raw CIF tokens (or already decoded numbers) to a numeric array."""
+    values = np.asarray(values)
+    if values.dtype.kind in "iuf":
+        if dtype is np.int64:
+            return np.where(np.isfinite(values), values, missing).astype(np.int64)
+        return values.astype(dtype)
+    values = values.astype("S")
+    values[np.isin(values, _NULL_TOKENS + (b"",))] = b"x"
+    return decode_numbers(values, dtype, missing)
+
+def atom_site_to_table(columns, first_model_only=True):
+    """
+    Build a pdb_parser.ATOM_DTYPE atom table from decoded atom_site columns.
+    If 'first_model_only' is set, only the first model of multi-model entries is kept.
+    """
+    def pick(field):
+        for name in ATOM_SITE_COLUMNS[field]:
+            if name in columns:
+                return columns[name]
+        return None
+
+    n_atoms = len(next(iter(columns.values()), []))
+    table = np.zeros(n_atoms, dtype=ATOM_DTYPE)
+    table['line'] = -1
+    text_fields = {'record': 6, 'name': 4, 'resn': 5, 'chain': 4, 'element': 2}
+    for field, width in text_fields.items():
+        values = pick(field)
+        if values is not None:
+            table[field] = _text_column(values, width)
+    for field in ('serial', 'resseq'):
+        values = pick(field)
+        table[field] = MISSING_INT if values is None else _number_column(values, np.int64, MISSING_INT)
+    for axis, field in enumerate(('x', 'y', 'z')):
+        values = pick(field)
+        table['xyz'][:, axis] = np.nan if values is None else _number_column(values, np.float64, np.nan)
+    for field in ('occupancy', 'bfactor'):
+        values = pick(field)
+        table[field] = np.nan if values is None else _number_column(values, np.float64, np.nan)
+
+    models = pick('model')
+    if first_model_only and models is not None and n_atoms:
+        models = _number_column(models, np.int64, MISSING_INT)
+        table = table[models == models[0]]
+    return table
@@ -1,17 +1,86 @@
-import pymol
-from pymol import cmd
-from openbabel import openbabel
 import os
+from protprep_packages.ligand_metadata import extract_ligand_metadata
+from protprep_packages.pdbqt_converter import PDBQTConverter, pdbqt_to_pdb_lines
+from protprep_packages.vina_output import VinaOutput
+from protprep_packages.tracing import current_span, file_size, trace_dir, traced
+
+def _serial(field):
+    """Integer in a fixed-width serial field, or None if it is blank or malformed."""
+    try:
+        return int(field)
+    except ValueError:
+        return None
+
+def renumber_records(lines, first_serial):
+    """
+    Renumber the ATOM/HETATM/TER records of the first model in 'lines'
+    consecutively from 'first_serial' and remap the CONECT records to the new
+    serial numbers (bonds to atoms outside that model are dropped). CONECT
+    records inside later MODEL blocks are ignored; those after the last
+    ENDMDL (the PDB convention) are kept.
+    Returns (atom lines, CONECT lines, next free serial number).
+    """
+    atom_lines, conects, serials = [], [], {}
+    serial = first_serial
+    models, in_model = 0, False
+    for line in lines:
+        line = line.rstrip("\r\n")
+        first_model = models == 0 or (models == 1 and in_model)
+        if line.startswith(("ATOM", "HETATM")) and first_model:
+            old = _serial(line[6:11])
+            if old is not None:
+                serials[old] = serial
+            atom_lines.append(f"{line[:6]}{serial % 100000:5d}{line[11:]}\n")
+            serial += 1
+        elif line.startswith("TER") and first_model:
+            atom_lines.append(f"TER   {serial % 100000:5d}{line[11:]}\n")
+            serial += 1
+        elif line.startswith("MODEL"):
+            models += 1
+            in_model = True
+        elif line.startswith("ENDMDL"):
+            in_model = False
+        elif line.startswith("CONECT") and (first_model or not in_model):
+            conects.append([_serial(line[i:i + 5]) for i in range(6, len(line), 5)])
+
+    conect_lines = []
+    for bonded in conects:
+        bonded = [serials.get(old) for old in bonded]
+        partners = [new for new in bonded[1:] if new is not None]
+        if bonded and bonded[0] is not None and partners:
+            conect_lines.append("CONECT" + "".join(f"{new % 100000:5d}" for new in [bonded[0]] + partners) + "\n")
+    return atom_lines, list(dict.fromkeys(conect_lines)), serial
 
 class PymolCombiner:
-    def __init__(self, receptor_file, ligand_files):
+    def __init__(self, receptor_file, ligand_files, converter=None, use_openbabel=False):
+        """
+        converter:     PDBQTConverter for the PDBQT inputs (default: one with a
+                       process pool over all CPUs).
+        use_openbabel: convert with OpenBabel, one file at a time, instead.
+        """
         self.receptor_file = receptor_file
         self.ligand_files = ligand_files
-        pymol.finish_launching(['pymol', '-cq'])
-    
+        self.converter = converter or PDBQTConverter()
+        self.use_openbabel = use_openbabel
+
+    def convert_pdbqt_files(self, files):
+        """
+        Return 'files' with every PDBQT path replaced by its PDB conversion.
+        All PDBQT files are converted in one batch, so they are spread over
+        the converter's process pool and the up-to-date ones are skipped.
+        """
+        pdbqt_files = [f for f in files if isinstance(f, str) and f.endswith('.pdbqt')]
+        if not pdbqt_files:
+            return list(files)
+        if self.use_openbabel:
+            converted = {pdbqt_file: self.convert_pdbqt_to_pdb_openbabel(pdbqt_file) for pdbqt_file in pdbqt_files}
+        else:
+            converted = dict(zip(pdbqt_files, self.converter.convert(pdbqt_files)))
+        return [converted.get(f, f) if isinstance(f, str) else f for f in files]
+
     def convert_pdbqt_to_pdb(self, pdbqt_file):
         """
-        Convert PDBQT files to PDB format using OpenBabel
+        Convert a PDBQT file to PDB format
         
         Parameters:
             pdbqt_file (str): Path to the PDBQT file
@@ -19,7 +88,18 @@ class PymolCombiner:
         Returns:
             str: Path to the converted PDB file
         """
+        return self.convert_pdbqt_files([pdbqt_file])[0]
+
+    @traced("pdbqt_to_pdb_openbabel")
+    def convert_pdbqt_to_pdb_openbabel(self, pdbqt_file):
+        """
+        Convert a PDBQT file to PDB format using OpenBabel (slower, but
+        perceives bonds and writes CONECT records)
+        """
+        from openbabel import openbabel
+
         pdb_file = os.path.splitext(pdbqt_file)[0] + ".pdb"
+        current_span().set(bytes=file_size(pdbqt_file))
         obConversion = openbabel.OBConversion()
         obConversion.SetInAndOutFormats("pdbqt", "pdb")
         mol = openbabel.OBMol()
@@ -29,20 +109,21 @@ class PymolCombiner:
         print(f"Conversion complete: {pdb_file}\n")
         return pdb_file
     
+    def convert_receptors(self):
+        """Convert the PDBQT receptor file(s) to PDB and return the receptor PDB paths."""
+        receptors = self.receptor_file if isinstance(self.receptor_file, list) else [self.receptor_file]
+        self.receptor_pdbs = self.convert_pdbqt_files(receptors)
+        return self.receptor_pdbs
+
+    @traced("combine_load")
     def load_structures(self):
+        # PyMOL is only started on this path; compose_complexes() does without it.
+        import pymol
+        from pymol import cmd
+        pymol.finish_launching(['pymol', '-cq'])
+
         # Handle receptor files
-        self.receptor_pdbs = []
-        if isinstance(self.receptor_file, list):
-            for receptor in self.receptor_file:
-                if isinstance(receptor, str) and receptor.endswith('.pdbqt'):
-                    self.receptor_pdbs.append(self.convert_pdbqt_to_pdb(receptor))
-                else:
-                    self.receptor_pdbs.append(receptor)
-        else:
-            if isinstance(self.receptor_file, str) and self.receptor_file.endswith('.pdbqt'):
-                self.receptor_pdbs = [self.convert_pdbqt_to_pdb(self.receptor_file)]
-            else:
-                self.receptor_pdbs = [self.receptor_file]
+        self.convert_receptors()
         
         self.receptor_names = []
         for i, receptor_pdb in enumerate(self.receptor_pdbs, start=1):
@@ -52,19 +133,10 @@ class PymolCombiner:
             cmd.load(receptor_pdb, receptor_name)
         
         # Process ligand files
-        self.converted_ligands = []
-        self.ligand_base_names = []
         if not isinstance(self.ligand_files, list):
             self.ligand_files = [self.ligand_files]
-            
-        for ligand in self.ligand_files:
-            if isinstance(ligand, str) and ligand.endswith('.pdbqt'):
-                converted_ligand = self.convert_pdbqt_to_pdb(ligand)
-                self.converted_ligands.append(converted_ligand)
-            else:
-                self.converted_ligands.append(ligand)
-            base_name = os.path.splitext(os.path.basename(ligand))[0]
-            self.ligand_base_names.append(base_name)
+        self.converted_ligands = self.convert_pdbqt_files(self.ligand_files)
+        self.ligand_base_names = [os.path.splitext(os.path.basename(ligand))[0] for ligand in self.ligand_files]
         
         self.ligand_object_names = []
         for i, ligand in enumerate(self.converted_ligands, start=1):
@@ -73,12 +145,15 @@ class PymolCombiner:
             print(f"Loading ligand file: {ligand} as {object_name}")
             cmd.load(ligand, object_name)
     
+    @traced("combine")
     def combine_structures(self, output_prefix=None, individual_complexes=True):
         """
         Combines loaded receptor(s) and ligand(s) into one or more PDB files.
         If individual_complexes is True, each ligand will have its own output file combined with the receptor(s).
         Otherwise, all structures are combined into one file.
         """
+        from pymol import cmd
+
         all_objects = cmd.get_object_list()
         if not all_objects:
             print("Error: No objects loaded to combine\n")
@@ -95,6 +170,9 @@ class PymolCombiner:
                 complex_obj_name = f"complex_{i+1}"
                 cmd.create(complex_obj_name, "current_complex")
                 cmd.save(output_file, complex_obj_name)
+                # Drop the receptor copy again so memory does not grow with the number of ligands.
+                cmd.delete(complex_obj_name)
+                cmd.delete("current_complex")
                 print(f"Complex saved as {output_file}\n")
                 output_files.append(output_file)
         else:
@@ -113,37 +191,91 @@ class PymolCombiner:
             cmd.save(output_file, "combined")
             print(f"Combined structure saved as {output_file}\n")
             output_files.append(output_file)
+        if trace_dir() is not None:
+            current_span().set(atoms=cmd.count_atoms("all"), complexes=len(output_files),
+                               bytes=sum(file_size(output_file) or 0 for output_file in output_files))
         return output_files
     
-    def extract_ligand_metadata(self, ligand_file):
-        keywords = ["MODEL", "REMARK  Name =", "REMARK VINA RESULT:", 
-                    "REMARK INTER + INTRA:", "REMARK INTER:", "REMARK INTRA:", "REMARK UNBOUND:"]
-        metadata = []
-        model1_started = False
-        try:
-            with open(ligand_file, "r") as f:
-                for line in f:
-                    line_stripped = line.strip()
-                    # Check for model header
-                    if line_stripped.startswith("MODEL"):
-                        # If we haven't started yet and it's MODEL 1, mark as started and add the converted line.
-                        if not model1_started and line_stripped == "MODEL 1":
-                            metadata.append("REMARK " + line_stripped)
-                            model1_started = True
-                            continue
-                        # If a new model header is found and we already collected MODEL 1, break out.
-                        if model1_started and line_stripped != "MODEL 1":
-                            break
+    def _ligand_pose(self, ligand, pose, with_metadata):
+        """
+        Return (PDB lines, metadata lines) of pose 'pose' of a ligand file.
+        PDBQT ligands are read through their pose index and converted in
+        memory; the first pose of a PDB ligand is read with the file's
+        trailing CONECT records.
+        """
+        if ligand.endswith('.pdbqt'):
+            with VinaOutput(ligand) as vina_output:
+                lines = list(pdbqt_to_pdb_lines(vina_output.pose_lines(pose)))
+                return lines, vina_output.metadata(pose) if with_metadata else []
+        if pose == 1:
+            with open(ligand, "r") as f:
+                return f.readlines(), self.extract_ligand_metadata(ligand) if with_metadata else []
+        with VinaOutput(ligand) as vina_output:
+            return vina_output.pose_lines(pose), vina_output.metadata(pose) if with_metadata else []
 
-                    # Only process lines if we're in the MODEL 1 block.
-                    if model1_started:
-                        for key in keywords:
-                            if line_stripped.startswith(key) and key != "MODEL":
-                                metadata.append(line_stripped)
-                                break
-        except Exception as e:
-            print(f"Error reading ligand file {ligand_file}: {e}")
-        return metadata
+    @traced("compose")
+    def compose_complexes(self, output_prefix=None, with_metadata=True, pose=1):
+        """
+        Write one receptor + ligand complex per ligand without loading anything
+        into PyMOL. The receptor records are read and serialised once; each
+        ligand's pose 'pose' (default: the first, as combine_structures() saves
+        it) is then read through the ligand's pose index, renumbered after the
+        receptor atoms and written out before the next ligand is read, so
+        memory stays bounded by one receptor and one pose however many ligands
+        are combined.
+        With with_metadata=True the pose's docking REMARKs head each file, as
+        in combine_structures_with_metadata().
+        Output file names are those of combine_structures(individual_complexes=True),
+        with a _pose<k> suffix for poses other than the first. Ligands with
+        fewer poses are skipped.
+        Returns the list of output PDB files.
+        """
+        receptor_atoms, receptor_conects = [], []
+        next_serial = 1
+        for receptor_pdb in self.convert_receptors():
+            with open(receptor_pdb, "r") as f:
+                atom_lines, conect_lines, next_serial = renumber_records(f, next_serial)
+            receptor_atoms.extend(atom_lines)
+            receptor_conects.extend(conect_lines)
+        if not receptor_atoms:
+            print("Error: No receptor atoms to combine\n")
+            return
+        receptor_block = "".join(receptor_atoms)
+        receptor_conect_block = "".join(receptor_conects)
+
+        if not isinstance(self.ligand_files, list):
+            self.ligand_files = [self.ligand_files]
+        output_files = []
+        n_bytes = 0
+        for ligand in self.ligand_files:
+            base_name = os.path.splitext(os.path.basename(ligand))[0]
+            if pose != 1:
+                base_name += f"_pose{pose}"
+            output_file = f"{output_prefix}_{base_name}.pdb" if output_prefix else f"complex_{base_name}.pdb"
+            try:
+                ligand_lines, metadata = self._ligand_pose(ligand, pose, with_metadata)
+            except IndexError as e:
+                print(f"Skipping {ligand}: {e}")
+                continue
+            ligand_atoms, ligand_conects, _ = renumber_records(ligand_lines, next_serial)
+            with open(output_file, "w") as f:
+                f.writelines(line + "\n" for line in metadata)
+                f.write(receptor_block)
+                f.writelines(ligand_atoms)
+                f.write(receptor_conect_block)
+                f.writelines(ligand_conects)
+                f.write("END\n")
+                n_bytes += f.tell()
+            print(f"Complex saved as {output_file}\n")
+            output_files.append(output_file)
+        current_span().set(atoms=len(receptor_atoms), complexes=len(output_files), bytes=n_bytes)
+        return output_files
+
+    def extract_ligand_metadata(self, ligand_file):
+        """
+        Returns the MODEL 1 metadata REMARKs of a docked ligand file.
+        """
+        return extract_ligand_metadata(ligand_file)
 
     def insert_metadata_into_pdb_content(self, pdb_file, metadata_lines):
         """
@@ -0,0 +1,184 @@
+import argparse
+import csv
+import glob
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
+from pathlib import Path
+from protprep_packages.tracing import current_span, traced
+from protprep_packages.vina_output import parse_pose_remarks
+
+"""
+Table of the best docking score of every ligand in a directory of Vina outputs.
+Vina writes the poses best first, so a file's score is the VINA RESULT of its
+first MODEL and only the first lines of each file are read. Rows are stored in
+SQLite keyed by path and reused while the file's size and mtime are unchanged;
+on a rescan only new or modified files are read, across a process pool. The
+table can then be filtered to the N best ligands or to those scoring at or
+below a threshold, and written out as CSV:
+
+    python -m protprep_packages.docking_scores /path/to/poses --top 100 --csv top100.csv
+"""
+
+# Scores are kcal/mol: lower is better.
+COLUMNS = ("path", "score", "inter", "intra", "name")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scores (
+    path       TEXT PRIMARY KEY,
+    size       INTEGER NOT NULL,
+    mtime_ns   INTEGER NOT NULL,
+    score      REAL,
+    inter      REAL,
+    intra      REAL,
+    name       TEXT,
+    scanned_at REAL NOT NULL
+);
+"""
+
+def default_index_path():
+    """Return the score table: $PROTPREP_SCORES_DB or ~/.cache/protprep/docking_scores.sqlite3."""
+    return Path(os.environ.get("PROTPREP_SCORES_DB",
+                               Path.home() / ".cache" / "protprep" / "docking_scores.sqlite3"))
+
+def ligand_files(directory):
+    """The ligand .pdbqt files of a directory (cleaned receptors rec_*_clean.pdbqt excluded), sorted."""
+    return sorted(
+        f for f in glob.glob(os.path.join(directory, "*.pdbqt"))
+        if not (os.path.basename(f).startswith("rec_") and os.path.basename(f).endswith("_clean.pdbqt"))
+    )
+
+def read_score(path):
+    """
+    Return (score, inter, intra, name) from the REMARKs of the first pose of a
+    Vina output (None where missing), or the error message as a string if the
+    file cannot be read.
+    """
+    try:
+        with open(path, "r", errors="replace") as f:
+            # parse_pose_remarks() stops at the first record that is not a REMARK.
+            values = parse_pose_remarks(f)
+    except (OSError, UnicodeError) as e:
+        # Returned rather than raised, so one bad file does not abort a parallel scan.
+        return str(e)
+    return values['score'], values['inter'], values['intra'], values['name']
+
+def select_ligands(rows, top_n=None, max_score=None):
+    """
+    Return the rows with a score, best first, keeping only those scoring at
+    or below max_score and then the first top_n (None: no limit).
+    """
+    selected = sorted((row for row in rows if row['score'] is not None), key=lambda row: row['score'])
+    if max_score is not None:
+        selected = [row for row in selected if row['score'] <= max_score]
+    if top_n is not None:
+        selected = selected[:top_n]
+    return selected
+
+def write_csv(rows, csv_file):
+    """Write score rows (COLUMNS) to a CSV file."""
+    with open(csv_file, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=COLUMNS, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(rows)
+
+class DockingScores:
+    def __init__(self, index_path=None, max_workers=None, min_parallel=256):
+        """
+        index_path:   SQLite file holding the score table (default: default_index_path()).
+        max_workers:  size of the process pool (default: number of CPUs).
+        min_parallel: scans of fewer files than this are done in this process.
+        """
+        self.index_path = Path(index_path) if index_path is not None else default_index_path()
+        self.max_workers = max_workers or os.cpu_count()
+        self.min_parallel = min_parallel
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.index_path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    @traced("score_scan")
+    def scan(self, files):
+        """
+        Return the score rows (dicts with COLUMNS) of the given Vina outputs in
+        input order, reading only the files that are new or changed since the
+        table last recorded them. Files that cannot be read are reported and
+        left out, and nothing is recorded for them, so the next scan retries.
+        """
+        paths = list(dict.fromkeys(os.path.abspath(f) for f in files))
+        stats = {}
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError as e:
+                print(f"Skipping {path}: {e}")
+                continue
+            stats[path] = (stat.st_size, stat.st_mtime_ns)
+
+        with closing(self._connect()) as conn:
+            recorded = {path: (size, mtime_ns, score, inter, intra, name)
+                        for path, size, mtime_ns, score, inter, intra, name in conn.execute(
+                            "SELECT path, size, mtime_ns, score, inter, intra, name FROM scores")}
+        pending = [path for path, key in stats.items() if recorded.get(path, ())[:2] != key]
+
+        if len(pending) >= self.min_parallel and self.max_workers > 1:
+            workers = min(self.max_workers, len(pending))
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(read_score, pending, chunksize=max(1, len(pending) // (workers * 4))))
+        else:
+            results = [read_score(path) for path in pending]
+
+        now = time.time()
+        rows = []
+        for path, values in zip(pending, results):
+            if isinstance(values, str):
+                print(f"Skipping {path}: {values}")
+                del stats[path]
+                continue
+            rows.append((path, *stats[path], *values, now))
+        if rows:
+            with closing(self._connect()) as conn, conn:
+                conn.executemany("INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        for path, size, mtime_ns, *values, _ in rows:
+            recorded[path] = (size, mtime_ns, *values)
+        current_span().set(files=len(stats), scanned=len(rows))
+        print(f"Read the scores of {len(rows)} ligand file(s), {len(stats) - len(rows)} unchanged")
+        return [dict(zip(COLUMNS, (path, *recorded[path][2:]))) for path in paths if path in stats]
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Tabulate the best Vina score of every ligand in a directory and list the best ones."
+    )
+    parser.add_argument("directory", help="Directory of Vina output (.pdbqt) files.")
+    parser.add_argument("--top", type=int, default=None, help="Keep the N best-scoring ligands.")
+    parser.add_argument(
+        "--max-score",
+        type=float,
+        default=None,
+        help="Keep the ligands scoring at or below this value (kcal/mol)."
+    )
+    parser.add_argument("--csv", default=None, help="Write the selected rows to this CSV file.")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of worker processes (default: number of CPUs)."
+    )
+
+    args = parser.parse_args()
+
+    score_rows = DockingScores(max_workers=args.workers).scan(ligand_files(args.directory))
+    selected_rows = select_ligands(score_rows, args.top, args.max_score)
+    if args.csv:
+        write_csv(selected_rows, args.csv)
+        print(f"Wrote {len(selected_rows)} row(s) to {args.csv}")
+    else:
+        for row in selected_rows:
+            print(f"{row['score']:8.3f}  {row['path']}")
@@ -0,0 +1,281 @@
+import os
+import queue
+import shlex
+import subprocess
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+from protprep_packages import sbatch_manager
+
+"""
+Execution backends for the heavy preparation steps (ligand extraction,
+hydrogen and water addition). The Slurm backend submits jobs through
+sbatch_manager; the local backend runs the same steps on a process pool with
+one persistent PyMOL session per worker, for workstations and CI without a
+scheduler. Select one per run with get_executor() or $PROTPREP_BACKEND.
+"""
+
+BACKENDS = ("slurm", "local")
+
+# Command run by a Slurm job for each step, one word per item; every word is
+# formatted with the step's arguments and shell-quoted (slurm_command()).
+SLURM_COMMANDS = {
+    "extract_lig": ["python", "-m", "protprep_packages.extract_and_clean_specific_ligands",
+                    "--pdb_file", "{1}", "--pdb_id", "{0}", "--ligand_to_keep", "{2}", "--chain_id", "{3}"],
+    "add_h": ["python", "-m", "protprep_packages.add_h", "--pdb_file", "{0}"],
+    # The site, site radius and engine (arguments 2-4) are added by slurm_command().
+    "add_water": ["python", "-m", "protprep_packages.add_water", "--pdb_file", "{0}", "--output", "{1}"],
+    # The input file is passed to the script as $0.
+    "tleap": ["bash", "-c", 'cd "$(dirname "$0")" && tleap -f "$(basename "$0")"', "{0}"],
+}
+
+# Position of the input structure in each step's arguments, for job sizing.
+STEP_INPUT_ARG = {"extract_lig": 1, "add_h": 0, "add_water": 0, "tleap": 0}
+
+def slurm_command(step, args):
+    """Return the shell command line of a Slurm job running 'step' with 'args'."""
+    command = shlex.join(word.format(*args) for word in SLURM_COMMANDS[step])
+    if step == "add_water":
+        # Only the options that are set, as in the add_water job scripts; an empty site is the whole structure.
+        command += sbatch_manager.water_args(*args[2:5])
+    return command
+
+class SlurmExecutor:
+    """
+    Submit steps as Slurm jobs; single inputs keep their one-job scripts,
+    batches become array jobs (packed per task for add_h and ligand extraction).
+    """
+
+    name = "slurm"
+
+    def __init__(self, throttle=None):
+        self.throttle = throttle
+        self.job_ids = []
+
+    def _record(self, job_id):
+        if job_id is not None:
+            self.job_ids.append(job_id)
+        return job_id
+
+    def extract_ligands(self, tasks):
+        """tasks: list of (pdb_id, pdb_file, ligand_to_keep, chain_id)."""
+        tasks = list(tasks)
+        if len(tasks) == 1:
+            pdb_id, pdb_file, ligand_to_keep, chain_id = tasks[0]
+            sbatch_manager.create_and_run_sbatch_script_extract_and_clean_specific_ligands(pdb_id, pdb_file, ligand_to_keep, chain_id)
+            return None
+        return self._record(sbatch_manager.create_and_run_sbatch_packed_extract_and_clean_specific_ligands(
+            tasks, throttle=self.throttle))
+
+    def add_h(self, pdb_id, pdb_files):
+        pdb_files = list(pdb_files)
+        if len(pdb_files) == 1:
+            sbatch_manager.create_and_run_sbatch_script_add_h(pdb_id, pdb_files[0])
+            return None
+        # Batches are packed: each task starts PyMOL once for a list of files.
+        return self._record(sbatch_manager.create_and_run_sbatch_packed_add_h(pdb_id, pdb_files, throttle=self.throttle))
+
+    def add_water(self, pdb_id, pdb_files, site=None, site_radius=None, engine=None):
+        """
+        site, site_radius: pocket mode of add_water (default: the whole structure).
+        engine: add_water's placement engine (default: grid).
+        """
+        pdb_files = list(pdb_files)
+        if len(pdb_files) == 1:
+            sbatch_manager.create_and_run_sbatch_script_add_water(pdb_id, pdb_files[0], site, site_radius, engine)
+            return None
+        return self._record(sbatch_manager.create_and_run_sbatch_array_add_water(
+            pdb_id, pdb_files, self.throttle, site, site_radius, engine))
+
+    def add_h_and_water(self, pdb_id, pdb_files, site=None, site_radius=None, engine=None):
+        pdb_files = list(pdb_files)
+        if len(pdb_files) == 1:
+            sbatch_manager.create_and_run_sbatch_script_add_h_and_water(pdb_id, pdb_files[0], site, site_radius, engine)
+            return None
+        return self._record(sbatch_manager.create_and_run_sbatch_array_add_h_and_water(
+            pdb_id, pdb_files, self.throttle, site, site_radius, engine))
+
+    def submit(self, step, args, after=(), name=None):
+        """
+        Submit one 'step' job with 'args' (see SLURM_COMMANDS) that starts only
+        after the jobs in 'after' have succeeded. Returns the job ID or None.
+        """
+        job_ids = [str(job_id) for job_id in after if job_id is not None]
+        dependency = "afterok:" + ":".join(job_ids) if job_ids else None
+        command = slurm_command(step, args)
+        walltime, mem = sbatch_manager.job_resources(step, [args[STEP_INPUT_ARG[step]]])
+        return self._record(sbatch_manager.create_and_run_sbatch_job(name or step, command, dependency, walltime, mem))
+
+    def wait(self):
+        """
+        Slurm runs the jobs asynchronously, so there is nothing to wait for and
+        no failures to report here; the submitted array job IDs are in self.job_ids.
+        """
+        return []
+
+    def dispatch(self):
+        """Slurm releases dependent jobs itself; nothing to do."""
+
+    def shutdown(self):
+        pass
+
+def _init_local_worker():
+    # One PyMOL session per worker process, reused by every task it runs.
+    import pymol
+    pymol.finish_launching(['pymol', '-qc'])
+
+def _local_extract_ligands(pdb_id, pdb_file, ligand_to_keep, chain_id):
+    from protprep_packages.extract_and_clean_specific_ligands import extract_and_clean_specific_ligands
+    return extract_and_clean_specific_ligands(str(pdb_file), pdb_id, ligand_to_keep, chain_id, persistent_session=True)
+
+def _local_add_h(pdb_file):
+    from protprep_packages.add_h import add_hydrogens_keeping_metadata
+    return add_hydrogens_keeping_metadata(pdb_file, persistent_session=True)
+
+def _local_add_water(pdb_file, output_pdb=None, site=None, site_radius=None, engine=None):
+    # Every input gets its own output file, so concurrent workers never write the same path.
+    from protprep_packages import add_water
+    output_pdb = output_pdb or add_water.default_output(pdb_file)
+    return add_water.main(str(pdb_file), str(output_pdb), site, site_radius, engine)
+
+def _local_add_h_and_water(pdb_file, site=None, site_radius=None, engine=None):
+    _local_add_h(pdb_file)
+    return _local_add_water(pdb_file, None, site, site_radius, engine)
+
+def _local_tleap(input_file):
+    # tleap inputs refer to their structures by relative name.
+    input_file = Path(input_file).absolute()
+    subprocess.run(["tleap", "-f", input_file.name], cwd=input_file.parent, check=True)
+    return input_file
+
+LOCAL_STEPS = {
+    "extract_lig": _local_extract_ligands,
+    "add_h": _local_add_h,
+    "add_water": _local_add_water,
+    "tleap": _local_tleap,
+}
+
+def _copy_outcome(source, target):
+    if source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
+
+class LocalExecutor:
+    """Run steps on a local process pool, one PyMOL per worker process."""
+
+    name = "local"
+
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers or os.cpu_count()
+        self.pool = ProcessPoolExecutor(max_workers=self.max_workers, initializer=_init_local_worker)
+        self.futures = []
+        # Filled from future callbacks (pool threads): (function, args, proxy)
+        # for steps whose dependencies are met, or None when a task settled.
+        # Only the thread calling dispatch()/wait() submits to the pool.
+        self._events = queue.SimpleQueue()
+
+    def _wake(self, future=None):
+        self._events.put(None)
+
+    def _submit(self, function, *args):
+        future = self.pool.submit(function, *args)
+        future.add_done_callback(self._wake)
+        self.futures.append((function.__name__.lstrip("_"), args, future))
+        return future
+
+    def extract_ligands(self, tasks):
+        return [self._submit(_local_extract_ligands, *task) for task in tasks]
+
+    def add_h(self, pdb_id, pdb_files):
+        return [self._submit(_local_add_h, pdb_file) for pdb_file in pdb_files]
+
+    def add_water(self, pdb_id, pdb_files, site=None, site_radius=None, engine=None):
+        return [self._submit(_local_add_water, pdb_file, None, site, site_radius, engine) for pdb_file in pdb_files]
+
+    def add_h_and_water(self, pdb_id, pdb_files, site=None, site_radius=None, engine=None):
+        return [self._submit(_local_add_h_and_water, pdb_file, site, site_radius, engine) for pdb_file in pdb_files]
+
+    def submit(self, step, args, after=(), name=None):
+        """
+        Run one 'step' (see LOCAL_STEPS) with 'args' once every future in
+        'after' has completed successfully. Returns a future for the step; it
+        fails without running if a dependency failed.
+        """
+        function = LOCAL_STEPS[step]
+        after = [future for future in after if future is not None]
+        if not after:
+            return self._submit(function, *args)
+
+        proxy = Future()
+        proxy.set_running_or_notify_cancel()
+        self.futures.append((step, args, proxy))
+        remaining = [len(after)]
+        lock = threading.Lock()
+
+        def dependency_done(dependency):
+            with lock:
+                if proxy.done():
+                    return
+                if dependency.exception() is not None:
+                    proxy.set_exception(RuntimeError(f"{name or step} skipped: a dependency failed"))
+                    self._wake()
+                    return
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            self._events.put((function, args, proxy))
+
+        for dependency in after:
+            dependency.add_done_callback(dependency_done)
+        return proxy
+
+    def _handle(self, event):
+        if event is None:
+            return
+        function, args, proxy = event
+        future = self.pool.submit(function, *args)
+        future.add_done_callback(lambda future: _copy_outcome(future, proxy))
+        future.add_done_callback(self._wake)
+
+    def dispatch(self):
+        """Submit the steps whose dependencies have completed since the last call, without blocking."""
+        while True:
+            try:
+                self._handle(self._events.get_nowait())
+            except queue.Empty:
+                return
+
+    def wait(self):
+        """
+        Block until every submitted task has finished, submitting dependent
+        steps as they become ready.
+        Returns a list of (step, args, error) for the tasks that failed.
+        """
+        while True:
+            self.dispatch()
+            if all(future.done() for _, _, future in self.futures):
+                break
+            self._handle(self._events.get())
+        failures = [(step, args, future.exception()) for step, args, future in self.futures
+                    if future.exception() is not None]
+        for step, args, error in failures:
+            print(f"{step} failed for {args}: {error}")
+        self.futures = []
+        return failures
+
+    def shutdown(self):
+        self.pool.shutdown(wait=True)
+
+def get_executor(backend=None, max_workers=None, throttle=None):
+    """
+    Return the executor for 'backend' ('slurm' or 'local'; default
+    $PROTPREP_BACKEND or 'slurm'). max_workers applies to the local backend,
+    throttle to Slurm array jobs.
+    """
+    backend = (backend or os.environ.get("PROTPREP_BACKEND", "slurm")).lower()
+    if backend == "slurm":
+        return SlurmExecutor(throttle)
+    if backend == "local":
+        return LocalExecutor(max_workers)
+    raise ValueError(f"Unknown backend '{backend}'. Choose one of: {', '.join(BACKENDS)}")
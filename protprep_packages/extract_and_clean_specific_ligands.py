@@ -2,10 +2,15 @@ import pymol
 from pymol import cmd
 from pathlib import Path
 import argparse 
+from protprep_packages.tracing import current_span, file_size, traced
 
-def extract_and_clean_specific_ligands(pdb_file, pdb_id, ligand_to_keep, chain_id):
+@traced("extract_lig")
+def extract_and_clean_specific_ligands(pdb_file, pdb_id, ligand_to_keep, chain_id, persistent_session=False):
     # Launch PyMOL (using -cq flags for quiet command-line execution)
-    pymol.finish_launching(['pymol', '-cq'])
+    # unless a packed job has already started it.
+    if not persistent_session:
+        pymol.finish_launching(['pymol', '-cq'])
+    current_span().set(entry=pdb_id, bytes=file_size(pdb_file))
     
     # Load the PDB file into an object named by pdb_id
     cmd.load(pdb_file, pdb_id)
@@ -29,10 +34,28 @@ def extract_and_clean_specific_ligands(pdb_file, pdb_id, ligand_to_keep, chain_i
     
     # Clean up and quit PyMOL (useful in script mode)
     cmd.delete("all")
-    cmd.quit()
+    if not persistent_session:
+        cmd.quit()
 
     return output_file
 
+def extract_ligands_from_task_list(task_list):
+    """
+    Packed-job mode: start PyMOL once and run every extraction listed in
+    task_list, one tab-separated "pdb_file pdb_id ligand_to_keep chain_id" per line.
+    """
+    with open(task_list, "r") as f:
+        tasks = [line.rstrip("\n").split("\t") for line in f if line.strip()]
+
+    pymol.finish_launching(['pymol', '-cq'])
+    for pdb_file, pdb_id, ligand_to_keep, chain_id in tasks:
+        try:
+            extract_and_clean_specific_ligands(pdb_file, pdb_id, ligand_to_keep, chain_id, persistent_session=True)
+        except Exception as e:
+            print(f"Error extracting {ligand_to_keep} from {pdb_file}: {e}")
+            cmd.delete("all")
+    cmd.quit()
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
         description="Create and run an sbatch script using a given pdb_id and pdb_file."
@@ -41,7 +64,11 @@ if __name__ == '__main__':
     parser.add_argument('--pdb_id', type=str, help='PDB identifier')
     parser.add_argument('--ligand_to_keep', type=str, help='Name of the ligand to keep')
     parser.add_argument('--chain_id', type=str, help='Chain identifier')
+    parser.add_argument('--file_list', type=str, help='Tab-separated task list (pdb_file, pdb_id, ligand_to_keep, chain_id) processed in one PyMOL session')
 
     args = parser.parse_args()
 
-    extract_and_clean_specific_ligands(args.pdb_file, args.pdb_id, args.ligand_to_keep, args.chain_id)
\ No newline at end of file
+    if args.file_list:
+        extract_ligands_from_task_list(args.file_list)
+    else:
+        extract_and_clean_specific_ligands(args.pdb_file, args.pdb_id, args.ligand_to_keep, args.chain_id)
\ No newline at end of file
@@ -0,0 +1,63 @@
+import os
+import tempfile
+import threading
+from pathlib import Path
+import requests
+from requests.adapters import HTTPAdapter
+
+"""
+Shared HTTP client used by PDBProcessor, RCSBLigandParser and the structure
+cache. A single requests.Session keeps connections alive and pools them per
+host, so repeated downloads skip the TCP/TLS handshake and no wget process
+is spawned per file.
+"""
+
+DEFAULT_TIMEOUT = (10, 60)  # (connect, read) seconds
+POOL_SIZE = 16
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_session():
+    """Return the process-wide pooled session, creating it on first use."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+def get(url, headers=None, timeout=DEFAULT_TIMEOUT, stream=False):
+    """GET 'url' through the shared session and return the response."""
+    return get_session().get(url, headers=headers, timeout=timeout, stream=stream)
+
+def post(url, json=None, headers=None, timeout=DEFAULT_TIMEOUT):
+    """POST a JSON body to 'url' through the shared session and return the response."""
+    return get_session().post(url, json=json, headers=headers, timeout=timeout)
+
+def download_to_file(url, output_file, headers=None, timeout=DEFAULT_TIMEOUT, chunk_size=1 << 20):
+    """
+    Stream 'url' to 'output_file' without holding the body in memory.
+    The body is written to a temporary file that replaces 'output_file' only
+    once it is complete. Raises requests.exceptions.RequestException on failure.
+    Returns the response headers.
+    """
+    output_file = Path(output_file).absolute()
+    with get(url, headers=headers, timeout=timeout, stream=True) as response:
+        response.raise_for_status()
+        fd, tmp_name = tempfile.mkstemp(dir=output_file.parent, prefix=".tmp_")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in response.iter_content(chunk_size):
+                    f.write(chunk)
+            # mkstemp creates the file private to the user; downloads get the usual permissions.
+            os.chmod(tmp_name, 0o644)
+            os.replace(tmp_name, output_file)
+        except BaseException:
+            if os.path.exists(tmp_name):
+                os.remove(tmp_name)
+            raise
+        return response.headers
@@ -0,0 +1,162 @@
+import argparse
+import subprocess
+import sys
+from pathlib import Path
+from protprep_packages.tables import print_table
+
+"""
+Import-time budget of the CLI and the job entry points.
+Each entry point is imported in a fresh interpreter under -X importtime. The
+check fails if the import takes longer than its budget, not counting the heavy
+dependency the entry point exists to run (PyMOL for the PyMOL jobs, NumPy for
+add_water), or if it loads a module it does not need (e.g. PyMOL or
+OpenBabel for the menu and mode 1). Run it after changing imports:
+
+    python -m protprep_packages.import_budget
+"""
+
+MAIN_SCRIPT = Path(__file__).resolve().parents[1] / "protprep_main_v3.2.py"
+_MARKER = "--protprep-import-budget--"
+
+# Modules only needed on some paths (combining, RCSB downloads, array maths).
+HEAVY = ("pymol", "openbabel", "pyfiglet", "numpy", "requests", "bs4",
+         "protprep_packages.combinator_pdb", "protprep_packages.pdb_combiner")
+
+# name -> (module, or None for the main script; heavy modules it needs; budget in ms)
+ENTRY_POINTS = {
+    "main": (None, (), 60),
+    "add_h": ("protprep_packages.add_h", ("pymol",), 30),
+    "add_h_and_water": ("protprep_packages.add_h_and_water", ("pymol",), 30),
+    "extract_and_clean_specific_ligands": ("protprep_packages.extract_and_clean_specific_ligands", ("pymol",), 30),
+    "add_water": ("protprep_packages.add_water", ("numpy",), 30),
+    "sbatch_manager": ("protprep_packages.sbatch_manager", (), 30),
+}
+
+class ImportNode:
+    def __init__(self, name, self_us, cumulative_us, children):
+        self.name = name
+        self.self_us = self_us
+        self.cumulative_us = cumulative_us
+        self.children = children
+
+def parse_importtime(text):
+    """
+    Build the import tree from -X importtime output (printed children first).
+    Only the lines after the start marker are used. Returns the top-level nodes.
+    """
+    lines = text.split(_MARKER, 1)[-1].splitlines()
+    pending = []            # (level, node) not yet attached to a parent
+    for line in lines:
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue        # the header line
+        name = fields[2][1:]
+        level = (len(name) - len(name.lstrip(" "))) // 2
+        children = [node for node_level, node in pending if node_level == level + 1]
+        pending = [(node_level, node) for node_level, node in pending if node_level <= level]
+        pending.append((level, ImportNode(name.strip(), int(fields[0]), int(fields[1]), children)))
+    return [node for level, node in pending if level == 0]
+
+def _walk(nodes, required, path=()):
+    """Yield (node, import path) for every node not below a required module."""
+    for node in nodes:
+        yield node, path + (node.name,)
+        if node.name.split(".")[0] not in required:
+            yield from _walk(node.children, required, path + (node.name,))
+
+def _import_statement(module):
+    if module is None:
+        return f"import runpy; print({_MARKER!r}, file=sys.stderr); runpy.run_path({str(MAIN_SCRIPT)!r}, run_name='protprep_main')"
+    return f"print({_MARKER!r}, file=sys.stderr); import {module}"
+
+def check_entry_point(name, scale=1.0):
+    """
+    Import one entry point in a fresh interpreter.
+    Returns a dict with the import time in ms excluding its required heavy
+    modules, the budget, the unneeded heavy modules loaded (with the import
+    path that loaded them), the slowest top-level imports and an error if the
+    import failed ('skipped' if only a required module is not installed).
+    """
+    module, required, budget = ENTRY_POINTS[name]
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", "import sys; " + _import_statement(module)],
+                             cwd=MAIN_SCRIPT.parent, capture_output=True, text=True)
+    tree = parse_importtime(process.stderr)
+    result = {'name': name, 'budget_ms': budget * scale, 'error': None, 'skipped': False}
+    if process.returncode != 0:
+        result['error'] = process.stderr.strip().splitlines()[-1] if process.stderr.strip() else "import failed"
+        # A heavy dependency that is not installed here (e.g. PyMOL on a login node) is not a failure.
+        result['skipped'] = any(f"No module named '{module}'" in result['error'] for module in required)
+
+    required_us = 0
+    unneeded = {}
+    for node, path in _walk(tree, required):
+        top = node.name.split(".")[0]
+        if top in required and not any(p.split(".")[0] in required for p in path[:-1]):
+            required_us += node.cumulative_us
+        elif node.name in HEAVY and node.name not in unneeded:
+            unneeded[node.name] = " -> ".join(path)
+    total_us = sum(node.cumulative_us for node in tree)
+    result['import_ms'] = (total_us - required_us) / 1000
+    result['required_ms'] = required_us / 1000
+    result['unneeded'] = unneeded
+    result['slowest'] = [(node.name, node.cumulative_us / 1000)
+                         for node in sorted(tree, key=lambda node: -node.cumulative_us)[:5]]
+    result['ok'] = result['skipped'] or (result['error'] is None and not unneeded
+                                         and result['import_ms'] <= result['budget_ms'])
+    return result
+
+def _status(result):
+    if result['skipped']:
+        return "skipped"
+    if result['error']:
+        return "error"
+    if result['unneeded']:
+        return "unneeded imports"
+    return "ok" if result['ok'] else "over budget"
+
+def print_report(results):
+    """Print the check results in a box, with the offending imports of failed entry points below."""
+    header = ("ENTRY POINT", "IMPORT ms", "BUDGET ms", "REQUIRED ms", "STATUS")
+    rows = [(r['name'], f"{r['import_ms']:.1f}", f"{r['budget_ms']:.0f}", f"{r['required_ms']:.1f}",
+             _status(r))
+            for r in results]
+    print_table(header, rows)
+    for r in results:
+        if r['ok'] and not r['skipped']:
+            continue
+        print(f"\n{r['name']}:")
+        if r['error']:
+            print(f"  import failed: {r['error']}")
+        for module, path in r['unneeded'].items():
+            print(f"  loads {module}: {path}")
+        if r['import_ms'] > r['budget_ms']:
+            for module, ms in r['slowest']:
+                print(f"  {ms:8.1f} ms  {module}")
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Check the import time and the imported modules of the CLI and the job entry points."
+    )
+    parser.add_argument(
+        "entry_points",
+        nargs="*",
+        help=f"Entry points to check (default: all of {', '.join(ENTRY_POINTS)})."
+    )
+    parser.add_argument(
+        "--scale",
+        type=float,
+        default=1.0,
+        help="Multiply every budget by this factor (for slow or loaded machines)."
+    )
+
+    args = parser.parse_args()
+    unknown = [name for name in args.entry_points if name not in ENTRY_POINTS]
+    if unknown:
+        parser.error(f"unknown entry point(s): {', '.join(unknown)}")
+
+    check_results = [check_entry_point(name, args.scale) for name in args.entry_points or ENTRY_POINTS]
+    print_report(check_results)
+    sys.exit(0 if all(r['ok'] for r in check_results) else 1)
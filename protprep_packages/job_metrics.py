@@ -0,0 +1,296 @@
+import argparse
+import glob
+import os
+import re
+import sqlite3
+import time
+from contextlib import closing
+from pathlib import Path
+from protprep_packages.tables import print_table
+
+"""
+Resource measurements of finished Slurm jobs and the sizing model built from them.
+Every generated job runs its command under /usr/bin/time -v; collect() parses
+that report from the job output files (max RSS, wall and CPU time) together
+with the step and the input size taken from the timed command line, and keeps
+one row per job in a small SQLite store. SizingModel fits wall time and memory
+against the number of atoms per step and turns the fit into --time and
+--mem-per-cpu requests for new jobs.
+"""
+
+BYTES_PER_ATOM_RECORD = 81
+
+DEFAULT_WALLTIME = 600      # seconds, used until a step has enough history
+DEFAULT_MEM_MB = 2048
+MIN_SAMPLES = 5
+
+# Module (or program) in the timed command -> pipeline step.
+COMMAND_STEPS = {
+    "protprep_packages.add_h": "add_h",
+    "protprep_packages.add_water": "add_water",
+    "protprep_packages.extract_and_clean_specific_ligands": "extract_lig",
+    "tleap": "tleap",
+}
+
+_TIME_FIELDS = {
+    "Command being timed": "command",
+    "User time (seconds)": "user",
+    "System time (seconds)": "system",
+    "Elapsed (wall clock) time (h:mm:ss or m:ss)": "wall",
+    "Maximum resident set size (kbytes)": "max_rss_kb",
+    "Exit status": "exit_status",
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    source      TEXT PRIMARY KEY,
+    mtime       REAL NOT NULL,
+    step        TEXT NOT NULL,
+    atoms       INTEGER NOT NULL,
+    files       INTEGER NOT NULL,
+    wall        REAL NOT NULL,
+    cpu         REAL NOT NULL,
+    max_rss_kb  INTEGER NOT NULL,
+    killed      INTEGER NOT NULL,
+    recorded_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_step ON jobs (step);
+"""
+
+def default_metrics_path():
+    """Return the metrics store: $PROTPREP_METRICS_DB or ~/.cache/protprep/job_metrics.sqlite3."""
+    return Path(os.environ.get("PROTPREP_METRICS_DB", Path.home() / ".cache" / "protprep" / "job_metrics.sqlite3"))
+
+def estimate_atom_count(pdb_file):
+    """Estimate the number of atom records of a PDB file from its size, without reading it."""
+    return Path(pdb_file).stat().st_size // BYTES_PER_ATOM_RECORD
+
+def _parse_duration(value):
+    """Convert an h:mm:ss or m:ss duration to seconds."""
+    seconds = 0.0
+    for part in value.split(":"):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+def parse_time_report(text):
+    """
+    Parse the report printed by /usr/bin/time -v.
+    Returns a dict with command, wall, cpu, max_rss_kb, exit_status and killed
+    (the command was terminated by a signal), or None if there is no report.
+    """
+    values = {}
+    for line in text.splitlines():
+        label, _, value = line.strip().partition(": ")
+        if label in _TIME_FIELDS:
+            values[_TIME_FIELDS[label]] = value.strip()
+    if "wall" not in values or "max_rss_kb" not in values:
+        return None
+    return {
+        'command': values.get("command", "").strip('"'),
+        'wall': _parse_duration(values["wall"]),
+        'cpu': float(values.get("user", 0)) + float(values.get("system", 0)),
+        'max_rss_kb': int(values["max_rss_kb"]),
+        'exit_status': int(values.get("exit_status", 0)),
+        'killed': "terminated by signal" in text,
+    }
+
+def _command_step(command):
+    for name, step in COMMAND_STEPS.items():
+        if re.search(rf"(^|[\s/]){re.escape(name)}(\s|$)", command):
+            return step
+    return None
+
+def _input_size(command):
+    """Return (atoms, files) processed by a timed command, from its --pdb_file or --file_list argument."""
+    def atoms(path):
+        try:
+            return estimate_atom_count(path)
+        except OSError:
+            return 0
+
+    match = re.search(r"--pdb_file\s+(\S+)", command)
+    if match:
+        return atoms(match.group(1)), 1
+    match = re.search(r"--file_list\s+(\S+)", command)
+    if match:
+        try:
+            with open(match.group(1), "r") as list_file:
+                # Task lists hold one path per line, or tab-separated rows starting with the path.
+                paths = [line.split("\t")[0].strip() for line in list_file if line.strip()]
+        except OSError:
+            return 0, 0
+        return sum(atoms(path) for path in paths), len(paths)
+    return 0, 1
+
+def _read_tail(path, size=8192):
+    # The time report is the last thing a job writes.
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        f.seek(max(0, f.tell() - size))
+        return f.read().decode(errors="replace")
+
+class MetricsStore:
+    def __init__(self, path=None):
+        """path: SQLite file (default: default_metrics_path())."""
+        self.path = Path(path) if path is not None else default_metrics_path()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def collect(self, output_files):
+        """
+        Parse the time reports of job output files and store one row per job.
+        Files already stored with the same mtime are skipped.
+        Returns the number of new rows.
+        """
+        output_files = [Path(path).absolute() for path in output_files]
+        with closing(self._connect()) as conn:
+            known = dict(conn.execute("SELECT source, mtime FROM jobs").fetchall())
+
+        rows = []
+        for path in output_files:
+            try:
+                mtime = path.stat().st_mtime
+            except OSError:
+                continue
+            if known.get(str(path)) == mtime:
+                continue
+            report = parse_time_report(_read_tail(path))
+            if report is None:
+                continue
+            step = _command_step(report['command'])
+            if step is None:
+                continue
+            atoms, files = _input_size(report['command'])
+            rows.append((str(path), mtime, step, atoms, files, report['wall'], report['cpu'],
+                         report['max_rss_kb'], int(report['killed']), time.time()))
+
+        if rows:
+            with closing(self._connect()) as conn, conn:
+                conn.executemany("INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        return len(rows)
+
+    def collect_directory(self, directory=".", pattern="*.txt"):
+        """collect() every job output file matching 'pattern' in 'directory'."""
+        return self.collect(glob.glob(os.path.join(directory, pattern)))
+
+    def history(self, step):
+        """Return the stored (atoms, files, wall, cpu, max_rss_kb, killed) rows of a step."""
+        with closing(self._connect()) as conn:
+            return conn.execute(
+                "SELECT atoms, files, wall, cpu, max_rss_kb, killed FROM jobs WHERE step = ?", (step,)).fetchall()
+
+    def summary(self):
+        """Return per-step (step, jobs, mean atoms, mean wall, max wall, mean cpu, max RSS in kB)."""
+        with closing(self._connect()) as conn:
+            return conn.execute(
+                "SELECT step, COUNT(*), AVG(atoms), AVG(wall), MAX(wall), AVG(cpu), MAX(max_rss_kb) "
+                "FROM jobs GROUP BY step ORDER BY step").fetchall()
+
+class SizingModel:
+    def __init__(self, store, safety=1.25, min_samples=MIN_SAMPLES, default_walltime=DEFAULT_WALLTIME,
+                 default_mem_mb=DEFAULT_MEM_MB, min_walltime=60, max_walltime=24 * 3600, min_mem_mb=256):
+        """
+        store:       MetricsStore with the job history.
+        safety:      factor applied on top of the fitted upper envelope.
+        min_samples: jobs of a step needed before its history replaces the defaults.
+        """
+        self.store = store
+        self.safety = safety
+        self.min_samples = min_samples
+        self.default_walltime = default_walltime
+        self.default_mem_mb = default_mem_mb
+        self.min_walltime = min_walltime
+        self.max_walltime = max_walltime
+        self.min_mem_mb = min_mem_mb
+        self._fits = {}
+
+    @staticmethod
+    def _envelope(features, values):
+        """Least-squares fit shifted up by the largest residual, so it covers every observed job."""
+        import numpy as np
+        coefficients = np.linalg.lstsq(features, values, rcond=None)[0]
+        return coefficients, float(np.max(values - features @ coefficients))
+
+    def _fit(self, step):
+        # NumPy is imported here, not at module level: the CLI imports this
+        # module at startup but only needs the model once jobs are sized.
+        import numpy as np
+        if step not in self._fits:
+            rows = np.array(self.store.history(step), dtype=np.float64).reshape(-1, 6)
+            if len(rows) < self.min_samples:
+                self._fits[step] = None
+            else:
+                atoms, files, wall, _, max_rss_kb, killed = rows.T
+                # A killed job needed more than it got: count it at twice its usage.
+                scale = np.where(killed > 0, 2.0, 1.0)
+                features = np.column_stack([np.ones_like(atoms), files, atoms])
+                self._fits[step] = (self._envelope(features, wall * scale),
+                                    self._envelope(features, max_rss_kb / 1024 * scale))
+        return self._fits[step]
+
+    def request(self, step, atoms, files=1):
+        """
+        Return (walltime_seconds, mem_mb) to request for a job running 'step'
+        on 'files' inputs totalling 'atoms' atoms.
+        """
+        fit = self._fit(step)
+        if fit is None:
+            return self.default_walltime, self.default_mem_mb
+        import numpy as np
+        features = np.array([1.0, files, atoms])
+        (wall_coef, wall_margin), (mem_coef, mem_margin) = fit
+        wall = (features @ wall_coef + wall_margin) * self.safety
+        mem = (features @ mem_coef + mem_margin) * self.safety
+        walltime = int(np.clip(np.ceil(wall / 60) * 60, self.min_walltime, self.max_walltime))
+        mem_mb = int(max(np.ceil(mem / 256) * 256, self.min_mem_mb))
+        return walltime, mem_mb
+
+_default_model = None
+
+def default_model(output_dir="."):
+    """
+    Return the process-wide sizing model. On first use the job outputs in
+    'output_dir' are collected into the default store.
+    """
+    global _default_model
+    if _default_model is None:
+        store = MetricsStore()
+        store.collect_directory(output_dir)
+        _default_model = SizingModel(store)
+    return _default_model
+
+def print_summary(store):
+    """Print the per-step job statistics in a box."""
+    header = ("STEP", "JOBS", "ATOMS", "WALL s", "MAX WALL s", "CPU s", "MAX RSS MB")
+    rows = [(step, str(jobs), f"{atoms:.0f}", f"{wall:.1f}", f"{max_wall:.1f}", f"{cpu:.1f}", f"{rss / 1024:.0f}")
+            for step, jobs, atoms, wall, max_wall, cpu, rss in store.summary()]
+    print_table(header, rows)
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Collect /usr/bin/time -v measurements from Slurm job outputs and show per-step statistics."
+    )
+    parser.add_argument(
+        "outputs",
+        nargs="*",
+        help="Job output files to collect (default: *.txt in the current directory)."
+    )
+    parser.add_argument(
+        "--db",
+        default=None,
+        help="Metrics store (default: $PROTPREP_METRICS_DB or ~/.cache/protprep/job_metrics.sqlite3)."
+    )
+
+    args = parser.parse_args()
+
+    metrics_store = MetricsStore(args.db)
+    added = metrics_store.collect(args.outputs) if args.outputs else metrics_store.collect_directory(".")
+    print(f"Collected {added} new job(s)")
+    print_summary(metrics_store)
@@ -0,0 +1,96 @@
+import json
+import sqlite3
+import time
+from contextlib import closing
+from pathlib import Path
+from typing import Dict, List, Optional
+from protprep_packages.structure_cache import default_cache_dir
+
+"""
+Persistent SQLite cache of parsed ligand metadata per PDB entry.
+Rows hold the same fields as RCSBLigandParser.ligands (ligand ID, name, URL,
+chain list), so a cached entry can be displayed without any network access.
+"""
+
+DEFAULT_TTL = 90 * 24 * 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    pdb_id     TEXT PRIMARY KEY,
+    fetched_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS ligands (
+    pdb_id    TEXT NOT NULL,
+    position  INTEGER NOT NULL,
+    ligand_id TEXT NOT NULL,
+    name      TEXT,
+    url       TEXT,
+    chains    TEXT NOT NULL,
+    PRIMARY KEY (pdb_id, ligand_id)
+);
+"""
+
+class LigandCache:
+    def __init__(self, path=None, ttl: float = DEFAULT_TTL):
+        """
+        path: SQLite file (default: ligands.sqlite3 in the structure cache root).
+        ttl:  seconds for which a cached entry is considered fresh.
+        """
+        self.path = Path(path) if path is not None else default_cache_dir() / "ligands.sqlite3"
+        self.ttl = ttl
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        # A short-lived connection per call keeps the cache safe to use from worker threads and parallel jobs.
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def get_many(self, pdb_ids: List[str], allow_stale: bool = False) -> Dict[str, Dict]:
+        """
+        Return {pdb_id: ligands} for the entries found in the cache. Entries
+        older than the TTL are skipped unless 'allow_stale' is set.
+        """
+        keys = {pdb_id.upper(): pdb_id for pdb_id in pdb_ids}
+        if not keys:
+            return {}
+        oldest = 0 if allow_stale else time.time() - self.ttl
+        placeholders = ",".join("?" * len(keys))
+        with closing(self._connect()) as conn:
+            fresh = {row[0] for row in conn.execute(
+                f"SELECT pdb_id FROM entries WHERE fetched_at >= ? AND pdb_id IN ({placeholders})",
+                [oldest, *keys])}
+            rows = conn.execute(
+                f"SELECT pdb_id, ligand_id, name, url, chains FROM ligands "
+                f"WHERE pdb_id IN ({placeholders}) ORDER BY pdb_id, position",
+                list(keys)).fetchall()
+
+        results = {keys[key]: {} for key in fresh}
+        for key, ligand_id, name, url, chains in rows:
+            if key in fresh:
+                results[keys[key]][ligand_id] = {
+                    'id': ligand_id,
+                    'url': url,
+                    'name': name,
+                    'chains': json.loads(chains)
+                }
+        return results
+
+    def get(self, pdb_id: str, allow_stale: bool = False) -> Optional[Dict]:
+        """Return the cached ligands of one entry, or None if it is not cached."""
+        return self.get_many([pdb_id], allow_stale).get(pdb_id)
+
+    def put_many(self, entries: Dict[str, Dict]) -> None:
+        """Store {pdb_id: ligands} for many entries in one transaction."""
+        now = time.time()
+        with closing(self._connect()) as conn, conn:
+            for pdb_id, ligands in entries.items():
+                key = pdb_id.upper()
+                conn.execute("DELETE FROM ligands WHERE pdb_id = ?", (key,))
+                conn.executemany(
+                    "INSERT INTO ligands (pdb_id, position, ligand_id, name, url, chains) VALUES (?, ?, ?, ?, ?, ?)",
+                    [(key, position, ligand_id, info.get('name'), info.get('url'), json.dumps(info.get('chains', [])))
+                     for position, (ligand_id, info) in enumerate(ligands.items())])
+                conn.execute("INSERT OR REPLACE INTO entries (pdb_id, fetched_at) VALUES (?, ?)", (key, now))
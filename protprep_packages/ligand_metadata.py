@@ -0,0 +1,34 @@
+"""
+Docking metadata of Vina output files.
+Kept apart from pdb_parser (and free of NumPy) because the per-file add_h
+jobs only need these text helpers and start once per input.
+"""
+
+# Metadata lines that Vina writes for every pose of a docked ligand.
+METADATA_KEYWORDS = ["MODEL", "REMARK  Name =", "REMARK VINA RESULT:",
+                     "REMARK INTER + INTRA:", "REMARK INTER:", "REMARK INTRA:", "REMARK UNBOUND:"]
+
+def extract_ligand_metadata(ligand_file):
+    """
+    Collect the metadata REMARKs of the first pose (MODEL 1) of a docked ligand.
+    Works on raw Vina output ("MODEL 1") and on files where the header was
+    already stored as "REMARK MODEL 1"; the header is returned in the latter form.
+    The pose is found through the file's pose index (vina_output.VinaOutput),
+    so only its header is read. Files without a model header have no metadata.
+    Returns a list of stripped metadata lines.
+    """
+    # Imported here: vina_output imports METADATA_KEYWORDS from this module.
+    from protprep_packages.vina_output import VinaOutput
+    try:
+        # The index of a Vina output is kept for later reads; PDB files are
+        # rewritten by add_h right after, so theirs would go stale.
+        with VinaOutput(ligand_file, persist=str(ligand_file).endswith(".pdbqt")) as vina_output:
+            if not len(vina_output):
+                return []
+            header = vina_output.pose_bytes(1)[:len(b"REMARK MODEL")]
+            if not header.startswith((b"MODEL", b"REMARK MODEL")):
+                return []
+            return vina_output.metadata(1)
+    except Exception as e:
+        print(f"Error reading ligand file {ligand_file}: {e}")
+        return []
@@ -1,110 +1,137 @@
-import requests
-from bs4 import BeautifulSoup
-from typing import List, Dict, Optional
-import re
+from protprep_packages import http_client
+from typing import List, Dict
+
+# GraphQL query returning the non-polymer entities (ligands) of many entries at once.
+LIGAND_QUERY = """
+query($ids: [String!]!) {
+  entries(entry_ids: $ids) {
+    rcsb_id
+    nonpolymer_entities {
+      pdbx_entity_nonpoly { comp_id name }
+      nonpolymer_entity_instances {
+        rcsb_nonpolymer_entity_instance_container_identifiers { asym_id auth_asym_id }
+      }
+    }
+  }
+}
+"""
 
 class RCSBLigandParser:
-    def __init__(self):
+    def __init__(self, data_api_url: str = "https://data.rcsb.org", cache=None):
         self.ligands = {}
         self.structure_id = None
+        self.status_code = None
+        self.from_cache = False
         self.base_url = "https://www.rcsb.org"
+        self.data_api_url = data_api_url.rstrip("/")
+        self.cache = cache
 
-    def fetch_structure_page(self, pdb_id: str) -> bool:
+    @classmethod
+    def fetch_many(cls, pdb_ids: List[str], data_api_url: str = "https://data.rcsb.org",
+                   batch_size: int = 200, cache=None) -> Dict[str, "RCSBLigandParser"]:
         """
-        Fetch and parse the structure page from RCSB
+        Look up the ligands of many entries with one RCSB Data API request per
+        batch of 'batch_size' IDs. If a LigandCache is given, fresh cached
+        entries are served from it and only the rest are requested.
+        Returns a dict pdb_id -> populated parser.
         """
-        try:
-            self.structure_id = pdb_id.lower()
-            url = f"https://www.rcsb.org/structure/{self.structure_id}"
-            response = requests.get(url)
-            
-            if response.status_code == 200:
-                # Parse the HTML content
-                soup = BeautifulSoup(response.text, 'html.parser')
-                
-                # Find all ligand rows by the pattern ligand_row_X where X is the ligand ID
-                ligand_rows = soup.find_all('tr', id=re.compile(r'ligand_row_\w+'))
-                
-                if ligand_rows:
-                    self.parse_ligand_rows(ligand_rows)
-                    return True
-                else:
-                    print("No ligand information found on the page")
-                    return False
-                    
-            else:
-                print(f"Failed to fetch page. Status code: {response.status_code}")
-                return False
-                
-        except Exception as e:
-            print(f"Error fetching structure page: {e}")
-            return False
-            
-    def parse_ligand_rows(self, ligand_rows) -> None:
+        parsers = {pdb_id: cls(data_api_url, cache) for pdb_id in dict.fromkeys(pdb_ids)}
+        cls._lookup_entries(parsers, data_api_url.rstrip("/"), cache, batch_size)
+        return parsers
+
+    @classmethod
+    def _lookup_entries(cls, parsers: Dict[str, "RCSBLigandParser"], data_api_url: str,
+                        cache=None, batch_size: int = 200) -> None:
         """
-        Parse individual ligand rows and extract information,
-        including chain (auth) data.
+        Fill in each parser from the cache or the Data API. Successful lookups
+        are written back to the cache; entries whose request failed fall back
+        to stale cached data, so previously seen entries also work offline.
         """
+        cached = cache.get_many(list(parsers)) if cache is not None else {}
+        for pdb_id, ligands in cached.items():
+            parsers[pdb_id]._set_cached(pdb_id, ligands)
+
+        misses = [pdb_id for pdb_id in parsers if pdb_id not in cached]
+        for start in range(0, len(misses), batch_size):
+            batch = {pdb_id: parsers[pdb_id] for pdb_id in misses[start:start + batch_size]}
+            cls._query_entries(batch, data_api_url)
+            if cache is None:
+                continue
+            cache.put_many({pdb_id: p.ligands for pdb_id, p in batch.items() if p.status_code == 200})
+            failed = [pdb_id for pdb_id, p in batch.items() if p.status_code != 200]
+            for pdb_id, ligands in cache.get_many(failed, allow_stale=True).items():
+                print(f"Using cached ligand data for {pdb_id}")
+                parsers[pdb_id]._set_cached(pdb_id, ligands)
+
+    def _set_cached(self, pdb_id: str, ligands: Dict) -> None:
+        self.structure_id = pdb_id.lower()
+        self.ligands = ligands
+        self.from_cache = True
+
+    @staticmethod
+    def _query_entries(parsers: Dict[str, "RCSBLigandParser"], data_api_url: str) -> None:
+        """Run the ligand query for one batch and fill in each parser."""
+        for pdb_id, parser in parsers.items():
+            parser.structure_id = pdb_id.lower()
+            parser.ligands = {}
+            parser.status_code = None
+            parser.from_cache = False
         try:
-            for row in ligand_rows:
-                # Extract ligand ID from the row ID attribute
-                row_id = row.get('id', '')
-                if row_id:
-                    ligand_id = row_id.replace('ligand_row_', '')
-
-                    # Find the ligand link within the row
-                    ligand_link = row.find('a', href=re.compile(r'/ligand/'))
-
-                    # Find the strong tag containing the ligand name
-                    strong_tag = row.find('strong')
-                    ligand_name = strong_tag.text if strong_tag else None
-
-                    if ligand_link:
-                        ligand_url = self.base_url + ligand_link['href']
-                        self.ligands[ligand_id] = {
-                            'id': ligand_id,
-                            'url': ligand_url,
-                            'name': ligand_name
-                        }
-                        
-                        # --- NEW: Parse chain info and store it ---
-                        chain_info = self.parse_ligand_auths(row)
-                        self.ligands[ligand_id]['chains'] = chain_info
-
+            response = http_client.post(f"{data_api_url}/graphql",
+                                        json={'query': LIGAND_QUERY, 'variables': {'ids': [p.upper() for p in parsers]}})
+            for parser in parsers.values():
+                parser.status_code = response.status_code
+            if response.status_code != 200:
+                print(f"Failed to fetch ligand data. Status code: {response.status_code}")
+                return
+            entries = (response.json().get('data') or {}).get('entries') or []
         except Exception as e:
-            print(f"Error parsing ligand rows: {e}")
+            print(f"Error fetching ligand data: {e}")
+            return
+
+        by_id = {pdb_id.upper(): parser for pdb_id, parser in parsers.items()}
+        for entry in entries:
+            if entry and entry.get('rcsb_id', '').upper() in by_id:
+                by_id[entry['rcsb_id'].upper()].parse_entry(entry)
 
-    def parse_ligand_auths(self, row):
+    def fetch_structure_page(self, pdb_id: str) -> bool:
+        """
+        Fetch the ligands of a single entry from the cache or the RCSB Data API.
+        """
+        self._lookup_entries({pdb_id: self}, self.data_api_url, self.cache)
+        if self.ligands:
+            return True
+        if self.status_code == 200 or self.from_cache:
+            print("No ligand information found for this entry")
+        return False
+
+    def parse_entry(self, entry: Dict) -> None:
         """
-        Parse the chain/residue labels (e.g. "H [auth A], M [auth B], R [auth C], ...")
-        from the ligand row and return them as a list of dicts. If the same chain
-        (auth ID) appears more than once, we only keep one entry.
+        Store the ligands of one Data API entry in self.ligands, including the
+        chains (label asym ID and auth chain ID) each ligand occurs in. If the
+        same auth chain appears more than once, only one entry is kept.
         """
-        chain_info = []
-        seen_chain_ids = set()
-        
-        # Attempt to find the second <td>, which often contains the chain info
-        tds = row.find_all('td')
-        if len(tds) > 1:
-            # Get the entire text, merging <br> with spaces
-            chain_text = tds[1].get_text(separator=" ", strip=True)
-            # Example chain_text might be: "H [auth A], M [auth B], R [auth C], W [auth D]"
-            
-            # Use a regex to capture the pattern:
-            #   (\w) \[auth ([A-Za-z0-9]+)\]
-            pattern = re.compile(r'(\w)\s*\[auth\s+([A-Za-z0-9]+)\]')
-            matches = pattern.findall(chain_text)
-            
-            # Each match is a tuple (residue_label, chain_id)
-            for residue_label, chain_id in matches:
-                if chain_id not in seen_chain_ids:
+        for entity in entry.get('nonpolymer_entities') or []:
+            nonpoly = entity.get('pdbx_entity_nonpoly') or {}
+            ligand_id = nonpoly.get('comp_id')
+            if not ligand_id:
+                continue
+            ligand = self.ligands.setdefault(ligand_id, {
+                'id': ligand_id,
+                'url': f"{self.base_url}/ligand/{ligand_id}",
+                'name': nonpoly.get('name'),
+                'chains': []
+            })
+            seen_chain_ids = {cd['chain_id'] for cd in ligand['chains']}
+            for instance in entity.get('nonpolymer_entity_instances') or []:
+                identifiers = instance.get('rcsb_nonpolymer_entity_instance_container_identifiers') or {}
+                chain_id = identifiers.get('auth_asym_id')
+                if chain_id and chain_id not in seen_chain_ids:
                     seen_chain_ids.add(chain_id)
-                    chain_info.append({
-                        'residue_label': residue_label,
+                    ligand['chains'].append({
+                        'residue_label': identifiers.get('asym_id'),
                         'chain_id': chain_id
                     })
-        
-        return chain_info
 
     def display_results(self) -> None:
         """
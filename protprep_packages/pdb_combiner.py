@@ -1,15 +1,32 @@
 import os
 import glob
 import re
-from .combinator_pdb import PymolCombiner
-from protprep_packages import sbatch_manager
+from protprep_packages.combinator_pdb import PymolCombiner
+from protprep_packages import docking_scores
+from protprep_packages.executors import get_executor
 
 class PDBCombiner:
-    def __init__(self):
-        # Initialization can be expanded as needed
-        pass
-
-    def combine_pdb(self):
+    def __init__(self, array_throttle=None, executor=None):
+        # Maximum number of array tasks Slurm may run at once (None = no limit)
+        self.array_throttle = array_throttle
+        # Backend for the post-processing jobs (Slurm or a local process pool)
+        self.executor = executor or get_executor(throttle=array_throttle)
+
+    def combine_pdb(self, ligand_directory=None, top_n=None, max_score=None, post_processing=None):
+        """
+        Combine the cleaned receptor with docked ligands and optionally queue
+        the post-processing jobs.
+        ligand_directory: directory of the ligand .pdbqt files. If None, the
+                          directory and the ligands are asked for; if given,
+                          the ligands are selected without prompts by top_n
+                          and max_score (both None: all ligands).
+        top_n, max_score: combine only the top_n best-scoring ligands and/or
+                          those scoring at or below max_score (the scores come
+                          from the incremental docking score table).
+        post_processing:  "none" or "add_h" to skip the post-processing
+                          prompts (the water options are not offered, as
+                          in the prompt).
+        """
         # Get receptor files and ligand files
         receptor_protein = glob.glob("rec_*_clean.pdbqt")
         pdb_id = None
@@ -18,28 +35,89 @@ class PDBCombiner:
             if match:
                 pdb_id = match.group(1)
 
-        pdbqt_directory = input(
-            "Please input the path to your CSV files (e.g., /path/to/file). "
-            "Press Enter to use the current directory:\n"
-        ).strip()
+        pdbqt_directory = ligand_directory
+        if pdbqt_directory is None:
+            pdbqt_directory = input(
+                "Please input the path to your CSV files (e.g., /path/to/file). "
+                "Press Enter to use the current directory:\n"
+            ).strip()
 
         # Use the current directory if the user presses Enter
         if not pdbqt_directory:
             pdbqt_directory = os.getcwd()
 
         # Get all .pdbqt files and filter out receptor files
-        ligand_files = [
-            f for f in glob.glob(os.path.join(pdbqt_directory, "*.pdbqt"))
-            if not (os.path.basename(f).startswith("rec_") and os.path.basename(f).endswith("_clean.pdbqt"))
-        ]
-        
+        ligand_files = docking_scores.ligand_files(pdbqt_directory)
+
         if not ligand_files:
             print("No ligand .pdbqt files found.")
             return
 
+        # Best docking score of every ligand, read only for files new or changed since the last scan
+        score_rows = docking_scores.DockingScores().scan(ligand_files)
+
+        if ligand_directory is not None:
+            if top_n is not None or max_score is not None:
+                score_rows = docking_scores.select_ligands(score_rows, top_n, max_score)
+            selected_ligands = [row['path'] for row in score_rows]
+            if not selected_ligands:
+                print("No ligand meets the score selection.")
+                return
+        else:
+            selected_ligands = self.select_ligands_interactively(score_rows)
+            if not selected_ligands:
+                return
+
+        print(f"Selected {len(selected_ligands)} ligand(s)")
+
+        # Instantiate the PymolCombiner (assumed to be defined elsewhere)
+        combiner = PymolCombiner(receptor_protein, selected_ligands)
+        # The receptor is serialised once and the ligands are streamed into one complex each.
+        # For PyMOL-written complexes use load_structures() + combine_structures_with_metadata() instead.
+        output_file = combiner.compose_complexes(with_metadata=True)
+
+        if post_processing is not None:
+            post_processing_input = "no" if post_processing == "none" else "yes"
+            option_input = "1" if post_processing == "add_h" else None
+        else:
+            # Ask for post processing options
+            post_processing_input = input(
+                "Now would you like to add polar hydrogens and/or water? Enter (yes/no)\n"
+            ).strip().lower()
+
+        if post_processing_input == "yes":
+            if post_processing is None:
+                print("\nOptions:")
+                print("1. Add polar hydrogens only")
+                #print("2. Add waters only")
+                #print("3. Add polar hydrogens and water\n")
+                option_input = input("Enter your options:\n").strip()
+
+            # One job (or array job) for all complexes instead of one submission per file
+            complex_files = output_file if isinstance(output_file, list) else [output_file]
+            if option_input == "1":
+                self.executor.add_h(pdb_id, complex_files)
+
+            elif option_input == "2":
+                self.executor.add_water(pdb_id, complex_files)
+
+            elif option_input == "3":
+                self.executor.add_h_and_water(pdb_id, complex_files)
+
+            self.executor.wait()
+
+    def select_ligands_interactively(self, score_rows, max_listed=50):
+        """
+        List the ligands best score first (at most max_listed of them) and ask
+        for one by number, 'all', 'top N' or '<= SCORE'.
+        Returns the selected ligand paths ([] on invalid input).
+        """
+        ranked = sorted(score_rows, key=lambda row: (row['score'] is None, row['score'] or 0.0))
+        listed = ranked[:max_listed]
+
         # Determine the maximum filename length for border formatting
-        max_length = max([len(f) for f in ligand_files], default=0)
-        width = max(max_length + 10, 30)  # Ensure a minimum width
+        max_length = max([len(os.path.basename(row['path'])) for row in listed], default=0)
+        width = max(max_length + 22, 30)  # Ensure a minimum width
 
         # Create border characters
         top_border = "┏" + "━" * width + "┓"
@@ -52,66 +130,32 @@ class PDBCombiner:
         print(middle_border)
 
         # Display the ligand options
-        for i, ligand in enumerate(ligand_files, start=1):
-            print("┃ " + f"{i}. {os.path.basename(ligand)}".ljust(width - 2) + " ┃")
+        for i, row in enumerate(listed, start=1):
+            score = f"{row['score']:8.3f}" if row['score'] is not None else "       -"
+            print("┃ " + f"{i}. {score}  {os.path.basename(row['path'])}".ljust(width - 2) + " ┃")
+        if len(ranked) > len(listed):
+            print("┃ " + f"... and {len(ranked) - len(listed)} more".ljust(width - 2) + " ┃")
 
         print(bottom_border)
-        
-        # Ask user to select a ligand or choose all
-        choice = input("Select a ligand by number, or type 'all' to use all ligands: ").strip()
-
-        if choice.lower() == 'all':
-            selected_ligands = ligand_files
-        else:
-            try:
-                index = int(choice)
-                if 1 <= index <= len(ligand_files):
-                    selected_ligands = [ligand_files[index - 1]]
-                else:
-                    print("Invalid number selection. Exiting.")
-                    return
-            except ValueError:
-                print("Invalid input. Please enter a number or 'all'. Exiting.")
-                return
-
-        print("Selected ligands:", selected_ligands)
-        
-        # Instantiate the PymolCombiner (assumed to be defined elsewhere)
-        combiner = PymolCombiner(receptor_protein, selected_ligands)
-        combiner.load_structures()
-        # You can switch between combine_structures() and combine_structures_with_metadata() as needed
-        output_file = combiner.combine_structures_with_metadata(individual_complexes=True)
 
-        # Ask for post processing options
-        post_processing_input = input(
-            "Now would you like to add polar hydrogens and/or water? Enter (yes/no)\n"
+        # Ask user to select a ligand, the best ones or all
+        choice = input(
+            "Select a ligand by number, 'top N' for the N best, '<= SCORE' for those scoring at "
+            "or below SCORE, or 'all' to use all ligands: "
         ).strip().lower()
 
-        if post_processing_input == "yes":
-            print("\nOptions:")
-            print("1. Add polar hydrogens only")
-            #print("2. Add waters only")
-            #print("3. Add polar hydrogens and water\n")
-            option_input = input("Enter your options:\n").strip()
-
-            if option_input == "1":
-                if isinstance(output_file, list):
-                    for file in output_file:
-                        sbatch_manager.create_and_run_sbatch_script_add_h(pdb_id, file)
-                else:
-                    sbatch_manager.create_and_run_sbatch_script_add_h(pdb_id, output_file)
-
-            elif option_input == "2":
-                if isinstance(output_file, list):
-                    for file in output_file:
-                        sbatch_manager.create_and_run_sbatch_script_add_water(pdb_id, file)
-                else:
-                    sbatch_manager.create_and_run_sbatch_script_add_water(pdb_id, output_file)
-
-            elif option_input == "3":
-                if isinstance(output_file, list):
-                    for file in output_file:
-                        sbatch_manager.create_and_run_sbatch_script_add_h_and_water(pdb_id, file)
-                else:
-                    sbatch_manager.create_and_run_sbatch_script_add_h_and_water(pdb_id, output_file)
-
+        try:
+            if choice == 'all':
+                return [row['path'] for row in ranked]
+            if choice.startswith("top"):
+                return [row['path'] for row in docking_scores.select_ligands(score_rows, top_n=int(choice[3:]))]
+            if choice.startswith("<="):
+                return [row['path'] for row in docking_scores.select_ligands(score_rows, max_score=float(choice[2:]))]
+            index = int(choice)
+        except ValueError:
+            print("Invalid input. Please enter a number, 'top N', '<= SCORE' or 'all'. Exiting.")
+            return []
+        if 1 <= index <= len(listed):
+            return [listed[index - 1]['path']]
+        print("Invalid number selection. Exiting.")
+        return []
@@ -0,0 +1,137 @@
+import numpy as np
+
+"""
+Shared reader for fixed-column PDB / PDBQT atom records.
+ATOM and HETATM lines are collected in one pass and their columns are decoded
+in bulk into a NumPy structured array (one row per atom record).
+"""
+
+ATOM_DTYPE = np.dtype([
+    ('record', 'U6'),
+    ('serial', np.int64),
+    ('name', 'U4'),
+    ('resn', 'U5'),
+    ('chain', 'U4'),
+    ('resseq', np.int64),
+    ('xyz', np.float64, (3,)),
+    ('occupancy', np.float64),
+    ('bfactor', np.float64),
+    ('element', 'U2'),
+    ('line', np.int64),
+])
+
+# Fixed PDB columns (0-based, end exclusive) decoded for each field.
+_COLUMNS = {
+    'record': (0, 6),
+    'serial': (6, 11),
+    'name': (12, 16),
+    'resn': (17, 21),
+    'chain': (21, 22),
+    'resseq': (22, 26),
+    'x': (30, 38),
+    'y': (38, 46),
+    'z': (46, 54),
+    'occupancy': (54, 60),
+    'bfactor': (60, 66),
+    'element': (76, 78),
+}
+_RECORD_WIDTH = 80
+
+# Value stored for serial/residue numbers that could not be parsed.
+MISSING_INT = np.iinfo(np.int64).min
+
+def _column(raw, field):
+    """Return one fixed-width column of the (N, 80) byte matrix as an 'S' array."""
+    start, end = _COLUMNS[field]
+    return np.ascontiguousarray(raw[:, start:end]).view(f'S{end - start}').ravel()
+
+def decode_numbers(column, dtype, missing):
+    """Convert a byte column to numbers in bulk, falling back per value for blank or malformed entries."""
+    try:
+        return column.astype(dtype)
+    except ValueError:
+        values = np.full(len(column), missing, dtype=dtype)
+        for i, value in enumerate(column):
+            try:
+                values[i] = dtype(value)
+            except ValueError:
+                continue
+        return values
+
+def _decode_text(column, width):
+    """Decode a byte column to stripped text."""
+    return np.char.strip(np.char.decode(column, 'ascii', 'replace')).astype(f'U{width}')
+
+def parse_atom_records(lines):
+    """
+    Build the atom table for an iterable of PDB/PDBQT lines (str or bytes).
+    The 'line' field holds the index of each record in 'lines', so callers can
+    map table rows back to the original text. Unparsable coordinates are NaN,
+    unparsable serial/residue numbers are MISSING_INT.
+    Returns a structured array with dtype ATOM_DTYPE.
+    """
+    line_numbers = []
+    records = []
+    for i, line in enumerate(lines):
+        if isinstance(line, str):
+            line = line.encode('ascii', 'replace')
+        if line.startswith((b"ATOM", b"HETATM")):
+            line_numbers.append(i)
+            records.append(line.rstrip(b"\r\n"))
+
+    table = np.zeros(len(records), dtype=ATOM_DTYPE)
+    if not records:
+        return table
+
+    raw = np.array(records, dtype=f'S{_RECORD_WIDTH}')
+    # numpy pads short records with NUL bytes; make them blanks so the columns decode cleanly.
+    raw = raw.view('S1').reshape(len(records), _RECORD_WIDTH)
+    raw[raw == b''] = b' '
+
+    table['line'] = line_numbers
+    table['record'] = _decode_text(_column(raw, 'record'), 6)
+    table['serial'] = decode_numbers(_column(raw, 'serial'), np.int64, MISSING_INT)
+    table['name'] = _decode_text(_column(raw, 'name'), 4)
+    table['resn'] = _decode_text(_column(raw, 'resn'), 4)
+    table['chain'] = _decode_text(_column(raw, 'chain'), 1)
+    table['resseq'] = decode_numbers(_column(raw, 'resseq'), np.int64, MISSING_INT)
+    for axis, field in enumerate(('x', 'y', 'z')):
+        table['xyz'][:, axis] = decode_numbers(_column(raw, field), np.float64, np.nan)
+    table['occupancy'] = decode_numbers(_column(raw, 'occupancy'), np.float64, np.nan)
+    table['bfactor'] = decode_numbers(_column(raw, 'bfactor'), np.float64, np.nan)
+    table['element'] = _decode_text(_column(raw, 'element'), 2)
+    return table
+
+def format_atom_records(table):
+    """
+    Return fixed-column PDB ATOM/HETATM lines for the rows of an atom table.
+    Fields that do not fit the PDB format are truncated (residue names to three
+    characters, chain IDs to one character, serial numbers modulo 100000).
+    """
+    record = "{:<6s}{:5d} {:<4s} {:>3s} {:1s}{:4d}    {:8.3f}{:8.3f}{:8.3f}{:6.2f}{:6.2f}          {:>2s}\n"
+    lines = []
+    for row in table.tolist():
+        rec, serial, name, resn, chain, resseq, xyz, occupancy, bfactor, element = row[:10]
+        # Atom names shorter than four characters start in column 14 when the element has one letter.
+        if len(name) < 4 and len(element) <= 1:
+            name = " " + name
+        lines.append(record.format(
+            rec or "ATOM", max(serial, 0) % 100000, name, resn[:3], chain[:1],
+            resseq if resseq != MISSING_INT else 0, *xyz,
+            occupancy if occupancy == occupancy else 1.0,
+            bfactor if bfactor == bfactor else 0.0, element))
+    return lines
+
+def read_atom_table(filename):
+    """
+    Read a PDB/PDBQT file once and return (lines, table): the original lines
+    without line endings and the atom table built by parse_atom_records().
+    """
+    with open(filename, 'r') as f:
+        lines = [line.rstrip("\r\n") for line in f]
+    return lines, parse_atom_records(lines)
+
+def valid_coordinates(table):
+    """Return the (N, 3) coordinates of the records whose x, y and z all parsed."""
+    xyz = table['xyz']
+    return xyz[np.all(np.isfinite(xyz), axis=1)]
@@ -1,14 +1,71 @@
-import subprocess
 import os
+import re
+import csv
+import json
 import requests
 from pathlib import Path
 from datetime import datetime
 import logging
-from .ligand_parser import RCSBLigandParser
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+from protprep_packages.ligand_parser import RCSBLigandParser
+from protprep_packages.structure_cache import StructureCache
+from protprep_packages.tracing import current_span, file_size, traced
+from protprep_packages.ligand_cache import LigandCache
+from protprep_packages import http_client
+
+# Columns of a batch manifest; list columns accept values separated by ';', ',' or whitespace.
+MANIFEST_FIELDS = ('pdb_id', 'ligand', 'chain', 'cofactors', 'cosubstrates', 'metals')
+MANIFEST_LIST_FIELDS = ('cofactors', 'cosubstrates', 'metals')
+
+def read_manifest(manifest_file):
+    """
+    Read a CSV or JSON batch manifest into a list of entry dicts with the keys
+    in MANIFEST_FIELDS. JSON manifests are a list of objects (or an object with
+    an 'entries' list); CSV manifests have a header row.
+    """
+    manifest_file = Path(manifest_file)
+    if manifest_file.suffix.lower() == ".json":
+        with manifest_file.open('r') as f:
+            rows = json.load(f)
+        if isinstance(rows, dict):
+            rows = rows.get('entries', [])
+    else:
+        with manifest_file.open('r', newline='') as f:
+            rows = list(csv.DictReader(f))
+
+    entries = []
+    for row in rows:
+        row = {str(key).strip().lower(): value for key, value in row.items() if key is not None}
+        pdb_id = str(row.get('pdb_id') or '').strip()
+        if not pdb_id:
+            continue
+        entry = {'pdb_id': pdb_id}
+        for field in ('ligand', 'chain'):
+            value = row.get(field)
+            entry[field] = str(value).strip() if value not in (None, '') else None
+        for field in MANIFEST_LIST_FIELDS:
+            value = row.get(field) or []
+            if isinstance(value, str):
+                value = re.split(r"[;,\s]+", value.strip())
+            entry[field] = [str(v).strip() for v in value if str(v).strip()]
+        entries.append(entry)
+    return entries
 
 class PDBProcessor:
-    def __init__(self, export_dir='protprep_logging'):
+    # Download locations for each supported structure format.
+    STRUCTURE_URLS = {
+        'pdb': "https://files.rcsb.org/download/{pdb_id}.pdb",
+        'cif': "https://files.rcsb.org/download/{pdb_id}.cif",
+        'bcif': "https://models.rcsb.org/{pdb_id}.bcif",
+    }
+
+    def __init__(self, export_dir='protprep_logging', file_format='pdb', cache_dir=None, use_cache=True, per_host_limit=4,
+                 ligand_api_url="https://data.rcsb.org"):
         self.pdb_id = None
+        self.file_format = file_format
         self.ligand_name = None
         self.chain_id = None
         self.cofactor_names = []
@@ -21,6 +78,18 @@ class PDBProcessor:
         
         # Setup logging
         self._setup_logging()
+
+        # RCSB Data API used for ligand lookups
+        self.ligand_api_url = ligand_api_url
+
+        # Concurrency limits for bulk downloads
+        self.per_host_limit = per_host_limit
+        self._host_slots = {}
+        self._host_slots_lock = threading.Lock()
+
+        # Shared structure cache consulted before any download
+        self.cache = StructureCache(cache_dir, logger=self.logger) if use_cache else None
+        self.ligand_cache = LigandCache(self.cache.root / "ligands.sqlite3") if use_cache else None
         
         # Log initialization
         #self.logger.info(f"Initialized {self.__class__.__name__} with export directory: {self.export_dir}")
@@ -59,51 +128,149 @@ class PDBProcessor:
         self.logger.addHandler(fh)
         self.logger.addHandler(ch)
 
-    def wget_pdb_file(self):
+    def _download_file(self, url, output_file):
         """
-        Download PDB file using wget or requests as fallback.
+        Download a single file through the shared HTTP client.
+        The structure cache is consulted first and updated after a download.
+        Returns True if the file was written.
+        """
+        if self.cache is not None and self.cache.fetch(url, output_file):
+            return True
+
+        with self._host_slot(url):
+            headers = self._download_uncached(url, output_file)
+        if headers is None:
+            return False
+
+        # Verify file exists and has content
+        if os.path.exists(output_file) and os.path.getsize(output_file) > 0:
+            if self.cache is not None:
+                self.cache.store_file(url, output_file, headers)
+            return True
+        self.logger.info(f"Download failed or file is empty")
+        return False
+
+    def _download_uncached(self, url, output_file):
+        """
+        Stream 'url' into 'output_file' through the shared HTTP client.
+        Returns the response headers, or None if the download failed.
+        """
+        try:
+            headers = http_client.download_to_file(url, output_file)
+            self.logger.info(f"Successfully downloaded {output_file}")
+            return headers
+        except requests.exceptions.RequestException as e:
+            self.logger.info(f"Error downloading file: {e}")
+            return None
+
+    @traced("download")
+    def wget_pdb_file(self, file_format=None, pdb_id=None):
+        """
+        Download the structure file in the requested format ('pdb', 'cif' or 'bcif',
+        default self.file_format). PDB format is not provided by RCSB for large
+        entries, so a failed PDB download falls back to mmCIF.
+        'pdb_id' defaults to self.pdb_id; pass it explicitly from worker threads.
         Returns the path to the downloaded file.
         """
-        if not self.pdb_id:
+        pdb_id = pdb_id or self.pdb_id
+        if not pdb_id:
             raise ValueError("PDB ID not set. Call get_basic_info() first.")
 
-        url = f"https://files.rcsb.org/download/{self.pdb_id}.pdb"
-        output_file = f"{self.pdb_id}.pdb"
+        file_format = (file_format or self.file_format).lower()
+        if file_format not in self.STRUCTURE_URLS:
+            raise ValueError(f"Unsupported structure format: {file_format}")
 
-        try:
-            # First attempt: using wget
-            result = subprocess.run(
-                ["wget", url, "-O", output_file],
-                capture_output=True,
-                text=True,
-                check=True
-            )
-            self.pdb_file_path = output_file
-            self.logger.info(f"Successfully downloaded {output_file} using wget")
-            
-        except (subprocess.CalledProcessError, FileNotFoundError):
-            # Fallback: using requests if wget fails or is not available
-            try:
-                self.logger.info(f"Wget failed or not found, trying direct download...")
-                response = requests.get(url)
-                response.raise_for_status()
-                
-                with open(output_file, 'wb') as f:
-                    f.write(response.content)
-                
+        formats = [file_format] + (["cif"] if file_format == "pdb" else [])
+        for fmt in formats:
+            url = self.STRUCTURE_URLS[fmt].format(pdb_id=pdb_id)
+            output_file = f"{pdb_id}.{fmt}"
+            if self._download_file(url, output_file):
                 self.pdb_file_path = output_file
-                self.logger.info(f"Successfully downloaded {output_file} using direct download")
-                
-            except requests.exceptions.RequestException as e:
-                self.logger.info(f"Error downloading file: {e}")
-                return None
+                current_span().set(entry=pdb_id, format=fmt, bytes=file_size(output_file))
+                return Path(output_file).absolute()
+            if fmt != formats[-1]:
+                self.logger.info(f"{fmt.upper()} format not available for {pdb_id}, trying the next format...")
+        return None
 
-        # Verify file exists and has content
-        if os.path.exists(output_file) and os.path.getsize(output_file) > 0:
-            return Path(output_file).absolute()
-        else:
-            self.logger.info(f"Download failed or file is empty")
-            return None
+    def _host_slot(self, url):
+        """Return the semaphore limiting concurrent requests to the host of 'url'."""
+        host = urlparse(url).netloc
+        with self._host_slots_lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.BoundedSemaphore(self.per_host_limit)
+            return self._host_slots[host]
+
+    def _with_retries(self, action, description, retries, backoff):
+        """
+        Call action() until it returns a truthy value, sleeping with exponential
+        backoff between attempts. Returns the last result.
+        """
+        result = None
+        for attempt in range(retries + 1):
+            result = action()
+            if result:
+                return result
+            if attempt < retries:
+                delay = backoff * 2 ** attempt
+                self.logger.info(f"{description} failed, retrying in {delay:.1f}s")
+                time.sleep(delay)
+        return result
+
+    @traced("ligand_lookup")
+    def _fetch_ligands(self, pdb_ids):
+        """
+        Look up ligand metadata for a batch of entries in one request.
+        Returns the parsers, or None if the request failed in a way worth
+        retrying (network errors, 429, 5xx).
+        """
+        current_span().set(entries=len(pdb_ids))
+        with self._host_slot(self.ligand_api_url):
+            parsers = RCSBLigandParser.fetch_many(pdb_ids, self.ligand_api_url, cache=self.ligand_cache)
+        failed = [p for p in parsers.values() if not p.from_cache and
+                  (p.status_code is None or p.status_code == 429 or p.status_code >= 500)]
+        return None if failed else parsers
+
+    def download_structure(self, pdb_id, retries=3, backoff=1.0):
+        """Download one structure with retries; returns its path or None. Safe to call from worker threads."""
+        return self._with_retries(
+            lambda: self.wget_pdb_file(pdb_id=pdb_id), f"Download of {pdb_id}", retries, backoff)
+
+    def bulk_fetch(self, pdb_ids, max_workers=8, retries=3, backoff=1.0, ligand_batch_size=200, ligands=True):
+        """
+        Download the structures and ligand metadata of many entries concurrently.
+        Structures are downloaded on a bounded thread pool, at most
+        self.per_host_limit at a time per host; ligand metadata is looked up
+        in batches of 'ligand_batch_size' entries per request (skipped with
+        ligands=False, leaving empty analyzers). Failed requests are retried
+        with exponential backoff.
+        Returns a dict pdb_id -> {'pdb_file': path or None, 'analyzer': RCSBLigandParser}.
+        """
+        pdb_ids = list(dict.fromkeys(pdb_ids))
+
+        def fetch_structure(pdb_id):
+            return self.download_structure(pdb_id, retries, backoff)
+
+        def fetch_ligand_batch(batch):
+            parsers = self._with_retries(
+                lambda: self._fetch_ligands(batch), f"Ligand lookup for {len(batch)} entries", retries, backoff)
+            return parsers or {}
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            ligand_futures = [pool.submit(fetch_ligand_batch, pdb_ids[i:i + ligand_batch_size])
+                              for i in range(0, len(pdb_ids), ligand_batch_size)] if ligands else []
+            structure_futures = {pdb_id: pool.submit(fetch_structure, pdb_id) for pdb_id in pdb_ids}
+            analyzers = {}
+            for future in ligand_futures:
+                analyzers.update(future.result())
+            results = {}
+            for pdb_id, future in structure_futures.items():
+                analyzer = analyzers.get(pdb_id)
+                if analyzer is None:
+                    analyzer = RCSBLigandParser(self.ligand_api_url, self.ligand_cache)
+                    analyzer.structure_id = pdb_id.lower()
+                results[pdb_id] = {'pdb_file': future.result(), 'analyzer': analyzer}
+        self.logger.info(f"Fetched {len(results)} entries")
+        return results
 
     def get_basic_info(self):
         """Get one or more PDB and ligand information from user."""
@@ -115,29 +282,61 @@ class PDBProcessor:
             pdb_id = input("\nEnter the PDB ID in uppercase (e.g., 3ERK):\n")
             self.pdb_id = pdb_id
             pdb_file = self.wget_pdb_file()
-            analyzer = RCSBLigandParser()
+            analyzer = RCSBLigandParser(self.ligand_api_url, self.ligand_cache)
             analyzer.fetch_structure_page(pdb_id)
             analyzer.display_results()
             ligand = input("\nEnter the ligand of interest in uppercase (e.g., SB4):\n").upper()
             self.pdb_data[pdb_id] = {'pdb_file': pdb_file, 'ligand': ligand}
         elif mode == 'multiple':
+            # Collect all IDs first so the downloads can run concurrently.
+            pdb_ids = []
             while True:
                 pdb_id = input("\nEnter the PDB ID in uppercase (e.g., 3ERK) or type 'done' to finish:\n")
                 if pdb_id.lower() == 'done':
                     break
+                pdb_ids.append(pdb_id)
+
+            fetched = self.bulk_fetch(pdb_ids)
+            for pdb_id, entry in fetched.items():
                 self.pdb_id = pdb_id
-                pdb_file = self.wget_pdb_file()
-                analyzer = RCSBLigandParser()
-                analyzer.fetch_structure_page(pdb_id)
-                analyzer.display_results()
+                entry['analyzer'].display_results()
                 ligand = input("\nEnter the ligand of interest in uppercase (e.g., SB4):\n")
-                self.pdb_data[pdb_id] = {'pdb_file': pdb_file, 'ligand': ligand}
+                self.pdb_data[pdb_id] = {'pdb_file': entry['pdb_file'], 'ligand': ligand}
         else:
             print("Invalid input. Please enter 'single' or 'multiple'.")
             return None
 
         return self.pdb_data 
 
+    def load_manifest(self, manifest_file):
+        """
+        Non-interactive replacement for get_basic_info() and process_all_entries():
+        download every manifest entry in bulk and fill self.pdb_data and
+        self.processed_results from the manifest columns. Later rows of a
+        repeated PDB ID replace earlier ones. The ligands come from the
+        manifest, so no ligand metadata is looked up.
+        """
+        entries = list({entry['pdb_id']: entry for entry in read_manifest(manifest_file)}.values())
+        fetched = self.bulk_fetch([entry['pdb_id'] for entry in entries], ligands=False)
+
+        self.pdb_data = {}
+        self.processed_results = {}
+        for entry in entries:
+            pdb_id = entry['pdb_id']
+            ligand = (entry['ligand'] or '').upper()
+            self.pdb_data[pdb_id] = {'pdb_file': fetched[pdb_id]['pdb_file'], 'ligand': ligand}
+            self.processed_results[pdb_id] = {
+                'pdb_id': pdb_id,
+                'ligand_name': ligand,
+                'chain_id': entry['chain'],
+                'cofactors': entry['cofactors'],
+                'cosubstrates': entry['cosubstrates'],
+                'metal_ions': entry['metals']
+            }
+
+        self.logger.info("Processed results: %s", self.processed_results)
+        return self.pdb_data
+
     def process_chain_extraction(self):
         """Process chain extraction preferences."""
         extract_one_chain = input("\nDo you want to extract only one chain? (Y/N):\n")
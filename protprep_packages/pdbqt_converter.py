@@ -0,0 +1,230 @@
+import argparse
+import hashlib
+import os
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
+from pathlib import Path
+from protprep_packages.tracing import current_span, traced
+
+"""
+Native PDBQT -> PDB conversion.
+A PDBQT atom record is a PDB record with the partial charge and the AutoDock
+atom type appended, so conversion is a per-line rewrite: columns 1-66 are
+kept, the charge is dropped and the AutoDock type is mapped to its element in
+columns 77-78. The AutoDock-only records (ROOT, BRANCH, TORSDOF, ...) are
+dropped, so each file is a single read and write with no OpenBabel round trip.
+Like OpenBabel, only the first model of a multi-pose file is converted.
+PDBQTConverter converts many files across a process pool and skips outputs
+that are newer than their inputs, or whose input still has the content hash
+recorded when the output was written.
+"""
+
+# AutoDock 4 / Vina atom types -> element symbols.
+AD_TYPE_ELEMENTS = {
+    "C": "C", "A": "C", "G0": "C", "G1": "C", "G2": "C", "G3": "C",
+    "CG0": "C", "CG1": "C", "CG2": "C", "CG3": "C",
+    "N": "N", "NA": "N", "NS": "N",
+    "O": "O", "OA": "O", "OS": "O", "W": "O",
+    "S": "S", "SA": "S",
+    "H": "H", "HD": "H", "HS": "H",
+    "P": "P", "F": "F", "Cl": "CL", "CL": "CL", "Br": "BR", "BR": "BR", "I": "I",
+    "Mg": "MG", "MG": "MG", "Ca": "CA", "Mn": "MN", "MN": "MN", "Fe": "FE", "FE": "FE",
+    "Zn": "ZN", "ZN": "ZN", "Cu": "CU", "Na": "NA", "K": "K", "Si": "SI", "Se": "SE",
+}
+
+# Residues written as ATOM records; any other residue becomes HETATM, as OpenBabel writes it.
+STANDARD_RESIDUES = frozenset((
+    "ALA", "ARG", "ASN", "ASP", "CYS", "GLN", "GLU", "GLY", "HIS", "ILE", "LEU", "LYS", "MET",
+    "PHE", "PRO", "SER", "THR", "TRP", "TYR", "VAL", "HID", "HIE", "HIP", "CYX", "ASH", "GLH", "LYN",
+    "A", "C", "G", "U", "DA", "DC", "DG", "DT",
+))
+
+# Torsion tree records that only AutoDock understands.
+PDBQT_ONLY_RECORDS = ("ROOT", "ENDROOT", "BRANCH", "ENDBRANCH", "TORSDOF")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversions (
+    output       TEXT PRIMARY KEY,
+    source       TEXT NOT NULL,
+    sha256       TEXT NOT NULL,
+    output_mtime REAL NOT NULL,
+    converted_at REAL NOT NULL
+);
+"""
+
+def default_index_path():
+    """Return the conversion index: $PROTPREP_CONVERSIONS_DB or ~/.cache/protprep/pdbqt_conversions.sqlite3."""
+    return Path(os.environ.get("PROTPREP_CONVERSIONS_DB",
+                               Path.home() / ".cache" / "protprep" / "pdbqt_conversions.sqlite3"))
+
+def pdb_path(pdbqt_file):
+    """Output path of a conversion: the input path with a .pdb extension."""
+    return os.path.splitext(pdbqt_file)[0] + ".pdb"
+
+def ad_type_element(ad_type):
+    """Element symbol of an AutoDock atom type (unknown types: their leading letters)."""
+    element = AD_TYPE_ELEMENTS.get(ad_type)
+    if element is None:
+        element = ad_type[:2] if len(ad_type) > 1 and ad_type[1].islower() else ad_type[:1]
+    return element.upper()
+
+def pdbqt_to_pdb_lines(lines):
+    """
+    Yield the PDB lines (with line endings) for an iterable of PDBQT lines.
+    Only the first model is converted, as OpenBabel reads one molecule from
+    a multi-pose Vina output: MODEL is dropped and conversion stops at the
+    first ENDMDL. PDBQT files carry no bonds, so unlike OpenBabel no CONECT
+    records are written; PyMOL assigns the ligand bonds from the distances.
+    """
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if line.startswith("ENDMDL"):
+            return
+        if line.startswith(("ATOM", "HETATM")):
+            # The AutoDock type starts in column 78; fall back to the last field for sloppy writers.
+            ad_type = line[77:].strip() or (line[66:].split() or [""])[-1]
+            record = line[:6]
+            if record.startswith("ATOM") and line[17:21].strip() not in STANDARD_RESIDUES:
+                record = "HETATM"
+            yield f"{record:<6s}{line[6:66]:<60s}          {ad_type_element(ad_type):>2s}\n"
+        elif line.startswith(PDBQT_ONLY_RECORDS + ("MODEL",)):
+            continue
+        elif line:
+            yield line + "\n"
+
+def convert_file(pdbqt_file, pdb_file=None):
+    """
+    Convert one PDBQT file to PDB (default output: pdb_path(pdbqt_file)).
+    The output is written to a temporary file and moved into place, so a
+    parallel reader never sees a partial file.
+    Returns (pdb_file, SHA-256 of the input).
+    """
+    pdb_file = pdb_file or pdb_path(pdbqt_file)
+    digest = hashlib.sha256()
+
+    def read_lines(f):
+        for line in f:
+            digest.update(line)
+            yield line.decode("ascii", "replace")
+
+    fd, tmp_name = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(pdb_file)), prefix=".tmp_")
+    try:
+        with open(pdbqt_file, "rb") as source, os.fdopen(fd, "w") as f:
+            f.writelines(pdbqt_to_pdb_lines(read_lines(source)))
+        # mkstemp creates the file private to the user; outputs get the usual permissions.
+        os.chmod(tmp_name, 0o644)
+        os.replace(tmp_name, pdb_file)
+    except BaseException:
+        if os.path.exists(tmp_name):
+            os.remove(tmp_name)
+        raise
+    return pdb_file, digest.hexdigest()
+
+def _convert_task(pdbqt_file):
+    return convert_file(pdbqt_file)
+
+def _sha256_file(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class PDBQTConverter:
+    def __init__(self, max_workers=None, index_path=None, force=False, min_parallel=8):
+        """
+        max_workers:  size of the process pool (default: number of CPUs).
+        index_path:   SQLite file recording the input hash of every output
+                      (default: default_index_path()).
+        force:        convert every file, even if its output is up to date.
+        min_parallel: batches smaller than this are converted in this process.
+        """
+        self.max_workers = max_workers or os.cpu_count()
+        self.index_path = Path(index_path) if index_path is not None else default_index_path()
+        self.force = force
+        self.min_parallel = min_parallel
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.index_path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _up_to_date(self, pdbqt_file, pdb_file, recorded, touched):
+        """
+        True if pdb_file need not be rewritten: it is newer than its input, or
+        it is unchanged since it was written from an input with the same hash
+        (e.g. the PDBQT was copied again). In the latter case the output's
+        mtime is refreshed (and added to 'touched') so the next check is
+        mtime-only.
+        """
+        try:
+            output_mtime = os.path.getmtime(pdb_file)
+            if output_mtime >= os.path.getmtime(pdbqt_file):
+                return True
+        except OSError:
+            return False
+        row = recorded.get(os.path.abspath(pdb_file))
+        if row is None or row[1] != output_mtime or row[0] != _sha256_file(pdbqt_file):
+            return False
+        os.utime(pdb_file)
+        touched.append((os.path.getmtime(pdb_file), os.path.abspath(pdb_file)))
+        return True
+
+    @traced("pdbqt_to_pdb")
+    def convert(self, pdbqt_files):
+        """
+        Convert PDBQT files to PDB next to their inputs, in parallel, skipping
+        the outputs that are up to date. Returns the PDB paths in input order.
+        """
+        outputs = [pdb_path(pdbqt_file) for pdbqt_file in pdbqt_files]
+        with closing(self._connect()) as conn:
+            recorded = {output: (sha256, output_mtime) for output, sha256, output_mtime in conn.execute(
+                "SELECT output, sha256, output_mtime FROM conversions")}
+
+        touched = []
+        # dict.fromkeys: a file listed twice is converted once.
+        pending = [pdbqt_file for pdbqt_file, pdb_file in dict.fromkeys(zip(pdbqt_files, outputs))
+                   if self.force or not self._up_to_date(pdbqt_file, pdb_file, recorded, touched)]
+
+        if len(pending) >= self.min_parallel and self.max_workers > 1:
+            workers = min(self.max_workers, len(pending))
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(_convert_task, pending, chunksize=max(1, len(pending) // (workers * 4))))
+        else:
+            results = [convert_file(pdbqt_file) for pdbqt_file in pending]
+
+        now = time.time()
+        rows = [(os.path.abspath(pdb_file), os.path.abspath(pdbqt_file), sha256, os.path.getmtime(pdb_file), now)
+                for pdbqt_file, (pdb_file, sha256) in zip(pending, results)]
+        if rows or touched:
+            with closing(self._connect()) as conn, conn:
+                conn.executemany("INSERT OR REPLACE INTO conversions VALUES (?, ?, ?, ?, ?)", rows)
+                conn.executemany("UPDATE conversions SET output_mtime = ? WHERE output = ?", touched)
+        current_span().set(files=len(outputs), converted=len(pending),
+                           bytes=sum(os.path.getsize(pdbqt_file) for pdbqt_file in pending))
+        print(f"Converted {len(pending)} PDBQT file(s) to PDB, {len(set(outputs)) - len(pending)} already up to date")
+        return outputs
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Convert PDBQT files to PDB (next to each input), skipping outputs that are up to date."
+    )
+    parser.add_argument("pdbqt_files", nargs="+", help="PDBQT files to convert.")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of worker processes (default: number of CPUs)."
+    )
+    parser.add_argument("--force", action="store_true", help="Convert every file, even if its output is up to date.")
+
+    args = parser.parse_args()
+
+    PDBQTConverter(max_workers=args.workers, force=args.force).convert(args.pdbqt_files)
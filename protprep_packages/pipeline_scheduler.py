@@ -0,0 +1,181 @@
+import logging
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+
+"""
+Dependency-aware scheduler for the per-entry preparation stages
+(download -> chain clean -> ligand extraction -> add_h -> water -> tleap).
+Each entry is a small chain of stages; a stage starts as soon as its own
+dependencies are met, so independent entries overlap and a campaign's wall
+time approaches its longest chain rather than the sum of all stages.
+
+Two kinds of stages exist:
+- call stages run a Python function in the driver (on a thread pool), e.g.
+  downloads and chain cleaning, and pass their return value on to later stages;
+- job stages are handed to an executor (executors.py) as soon as their
+  dependencies are done or submitted; the executor enforces the order between
+  jobs itself (Slurm --dependency=afterok, or future chaining locally).
+"""
+
+class Stage:
+    def __init__(self, entry, name, kind, action, after):
+        self.entry = entry
+        self.name = name
+        self.kind = kind            # "call" or "job"
+        self.action = action
+        self.after = list(after)
+        self.step = None            # executor step of a job stage
+        self.output = None          # function(results) -> path a job stage writes
+        self.state = "PENDING"      # PENDING, RUNNING, DONE, SUBMITTED, FAILED or SKIPPED
+        self.value = None           # call result, or the executor's job handle
+        self.detail = ""
+
+class PipelineScheduler:
+    def __init__(self, executor, max_workers=8, logger=None):
+        """
+        executor:    backend for the job stages (executors.get_executor()).
+        max_workers: threads running call stages in the driver.
+        """
+        self.executor = executor
+        self.max_workers = max_workers
+        self.logger = logger or logging.getLogger(__name__)
+        self.stages = {}        # (entry, name) -> Stage, in insertion order
+        self.results = {}       # entry -> {stage name: call result or job output path}
+        self._dependents = {}   # (entry, name) -> stages waiting on it
+        self._remaining = {}    # (entry, name) -> number of unmet dependencies
+
+    def _add(self, entry, name, kind, action, after):
+        key = (entry, name)
+        if key in self.stages:
+            raise ValueError(f"Stage '{name}' of {entry} was added twice")
+        for dependency in after:
+            upstream = self.stages.get((entry, dependency))
+            # Dependencies must already exist, which also rules out cycles.
+            if upstream is None:
+                raise ValueError(f"Stage '{name}' of {entry} depends on unknown stage '{dependency}'")
+            if kind == "call" and upstream.kind == "job":
+                raise ValueError(f"Call stage '{name}' of {entry} cannot depend on job stage '{dependency}'")
+        stage = Stage(entry, name, kind, action, after)
+        self.stages[key] = stage
+        self.results.setdefault(entry, {})
+        self._dependents[key] = []
+        self._remaining[key] = len(stage.after)
+        for dependency in stage.after:
+            self._dependents[(entry, dependency)].append(stage)
+        return stage
+
+    def add_call(self, entry, name, function, after=()):
+        """
+        Add a stage that runs function(results) in the driver, where 'results'
+        maps the entry's finished call stages to their return values.
+        A return value of None counts as a failure.
+        """
+        return self._add(entry, name, "call", function, after)
+
+    def add_job(self, entry, name, step, make_args, after=(), output=None):
+        """
+        Add a stage that submits executor step 'step' with the arguments
+        returned by make_args(results). If the job writes a file, output(results)
+        gives its path; it is entered in 'results' under the stage name once
+        the job is submitted, so later job stages can take it as input.
+        """
+        stage = self._add(entry, name, "job", make_args, after)
+        stage.step = step
+        stage.output = output
+        return stage
+
+    def _settle(self, stage, state, value=None, detail=""):
+        """Record the outcome of a stage and release or skip the stages waiting on it."""
+        stage.state, stage.value, stage.detail = state, value, detail
+        if state == "DONE" and stage.kind == "call":
+            self.results[stage.entry][stage.name] = value
+        ready = []
+        for dependent in self._dependents[(stage.entry, stage.name)]:
+            if dependent.state != "PENDING":
+                continue
+            if state in ("FAILED", "SKIPPED"):
+                self._settle(dependent, "SKIPPED", detail=f"{stage.name} did not complete")
+                continue
+            key = (dependent.entry, dependent.name)
+            self._remaining[key] -= 1
+            if not self._remaining[key]:
+                ready.append(dependent)
+        return ready
+
+    def _submit_job(self, stage):
+        upstream = [self.stages[(stage.entry, name)] for name in stage.after]
+        handles = [dependency.value for dependency in upstream if dependency.kind == "job"]
+        try:
+            args = stage.action(self.results[stage.entry])
+            output = stage.output(self.results[stage.entry]) if stage.output is not None else None
+            handle = self.executor.submit(stage.step, args, after=handles, name=f"{stage.entry}_{stage.name}")
+        except Exception as e:
+            return self._settle(stage, "FAILED", detail=f"{type(e).__name__}: {e}")
+        if handle is None:
+            return self._settle(stage, "FAILED", detail="submission failed")
+        if output is not None:
+            self.results[stage.entry][stage.name] = output
+        return self._settle(stage, "SUBMITTED", handle, str(handle) if not isinstance(handle, Future) else "")
+
+    def run(self):
+        """
+        Run every stage in dependency order, overlapping independent entries,
+        then wait for the executor. Returns summary().
+        """
+        ready = deque(stage for key, stage in self.stages.items() if not self._remaining[key])
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while ready or running:
+                # Local executors submit jobs released by finished dependencies here, on this thread.
+                self.executor.dispatch()
+                while ready:
+                    stage = ready.popleft()
+                    if stage.kind == "job":
+                        ready.extend(self._submit_job(stage))
+                    else:
+                        stage.state = "RUNNING"
+                        running[pool.submit(stage.action, self.results[stage.entry])] = stage
+                if not running:
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    error = future.exception()
+                    if error is not None:
+                        ready.extend(self._settle(stage, "FAILED", detail=f"{type(error).__name__}: {error}"))
+                    elif future.result() is None:
+                        ready.extend(self._settle(stage, "FAILED", detail="no result"))
+                    else:
+                        ready.extend(self._settle(stage, "DONE", future.result(), str(future.result())))
+                    self.logger.info("%s %s: %s", stage.entry, stage.name, stage.state)
+
+        # Local jobs finish here; Slurm jobs stay SUBMITTED.
+        self.executor.wait()
+        for stage in self.stages.values():
+            if stage.state == "SUBMITTED" and isinstance(stage.value, Future):
+                error = stage.value.exception()
+                if error is None:
+                    stage.state, stage.detail = "DONE", str(stage.value.result())
+                else:
+                    stage.state, stage.detail = "FAILED", f"{type(error).__name__}: {error}"
+        return self.summary()
+
+    def summary(self):
+        """
+        Return {entry: (status, detail)}: the first failed stage of an entry,
+        the submitted Slurm job IDs, or the result of its last stage.
+        """
+        stages = {}
+        for (entry, _), stage in self.stages.items():
+            stages.setdefault(entry, []).append(stage)
+        summary = {}
+        for entry, entry_stages in stages.items():
+            failed = [stage for stage in entry_stages if stage.state == "FAILED"]
+            submitted = [stage for stage in entry_stages if stage.state == "SUBMITTED"]
+            if failed:
+                summary[entry] = ("FAILED", f"{failed[0].name}: {failed[0].detail}")
+            elif submitted:
+                summary[entry] = ("SUBMITTED", ", ".join(f"{stage.name}={stage.detail}" for stage in submitted))
+            else:
+                summary[entry] = ("OK", entry_stages[-1].detail)
+        return summary
@@ -1,8 +1,47 @@
+import shlex
 import subprocess
 import argparse 
+from functools import lru_cache
+from pathlib import Path
+from protprep_packages.job_metrics import DEFAULT_WALLTIME, default_model, estimate_atom_count
+from protprep_packages.tracing import current_span, traced
 
+def estimate_job_request(step, pdb_files, packed=False):
+    """
+    Return (walltime_seconds, mem_mb) for a job running 'step' on pdb_files,
+    sized from the measurements of earlier jobs (job_metrics.SizingModel).
+    A packed job processes all files; otherwise the largest file is sized, as
+    every task of an array job gets the same request.
+    """
+    atoms = []
+    for pdb_file in pdb_files:
+        try:
+            atoms.append(estimate_atom_count(pdb_file))
+        except OSError:
+            atoms.append(0)
+    if packed:
+        return default_model().request(step, sum(atoms), len(atoms))
+    return default_model().request(step, max(atoms, default=0))
+
+def job_resources(step, pdb_files, packed=False):
+    """estimate_job_request() as sbatch --time and --mem-per-cpu values."""
+    walltime, mem_mb = estimate_job_request(step, pdb_files, packed)
+    return _format_walltime(walltime), f"{mem_mb}M"
+
+def water_args(site=None, site_radius=None, engine=None):
+    """add_water command-line options for a pocket-mode site and a placement engine (none: the defaults)."""
+    args = ""
+    if site:
+        args += f" --site {shlex.quote(site)}" + (f" --site_radius {site_radius}" if site_radius is not None else "")
+    if engine:
+        args += f" --engine {shlex.quote(engine)}"
+    return args
+
+@traced("sbatch_submit", step="add_h")
 def create_and_run_sbatch_script_add_h(pdb_id=None, pdb_file=None):
 
+    current_span().set(entry=pdb_id)
+    walltime, mem = job_resources("add_h", [pdb_file])
     sbatch_script = f"""\
 #!/bin/bash
 #
@@ -13,12 +52,12 @@ def create_and_run_sbatch_script_add_h(pdb_id=None, pdb_file=None):
     sbatch_script += "#SBATCH --ntasks=1\n"
     sbatch_script += "#SBATCH --cpus-per-task=1\n"
     sbatch_script += "#SBATCH --ntasks-per-node=1\n"
-    sbatch_script += "#SBATCH --time=00:10:00\n"
-    sbatch_script += "#SBATCH --mem-per-cpu=2G\n"
+    sbatch_script += f"#SBATCH --time={walltime}\n"
+    sbatch_script += f"#SBATCH --mem-per-cpu={mem}\n"
 
     sbatch_script += f"ml conda\n"
     sbatch_script += f"conda activate /fred/oz241/BSIM/conda_meeko\n"
-    sbatch_script += f"/usr/bin/time -v python protprep_packages/add_h.py --pdb_file {pdb_file}\n"
+    sbatch_script += f"/usr/bin/time -v python -m protprep_packages.add_h --pdb_file {pdb_file}\n"
 
     # Write the sbatch script to a file
     script_filename = f"rec_protein_{pdb_id}_add_h.sh"
@@ -28,7 +67,11 @@ def create_and_run_sbatch_script_add_h(pdb_id=None, pdb_file=None):
     # Launch the sbatch script using subprocess
     subprocess.run(["sbatch", script_filename])
 
-def create_and_run_sbatch_script_add_water(pdb_id=None, pdb_file=None):
+@traced("sbatch_submit", step="add_water")
+def create_and_run_sbatch_script_add_water(pdb_id=None, pdb_file=None, site=None, site_radius=None, engine=None):
+
+    current_span().set(entry=pdb_id)
+    walltime, mem = job_resources("add_water", [pdb_file])
 
     # Create the Add Water SBATCH script with dependency on Add Hydrogen job
     add_water_script = f"""\
@@ -40,12 +83,12 @@ def create_and_run_sbatch_script_add_water(pdb_id=None, pdb_file=None):
 #SBATCH --ntasks=1
 #SBATCH --cpus-per-task=1
 #SBATCH --ntasks-per-node=1
-#SBATCH --time=00:10:00
-#SBATCH --mem-per-cpu=2G
+#SBATCH --time={walltime}
+#SBATCH --mem-per-cpu={mem}
 
 ml conda
 conda activate /fred/oz241/BSIM/conda_meeko
-/usr/bin/time -v python protprep_packages/add_water.py --pdb_file {pdb_file}
+/usr/bin/time -v python -m protprep_packages.add_water --pdb_file {pdb_file}{water_args(site, site_radius, engine)}
 """
 
     water_script_filename = f"rec_protein_{pdb_id}_add_water.sh"
@@ -55,7 +98,13 @@ conda activate /fred/oz241/BSIM/conda_meeko
     # Launch the sbatch script using subprocess
     subprocess.run(["sbatch", water_script_filename])
 
-def create_and_run_sbatch_script_add_h_and_water(pdb_id=None, pdb_file=None):
+@traced("sbatch_submit", step="add_h_and_water")
+def create_and_run_sbatch_script_add_h_and_water(pdb_id=None, pdb_file=None, site=None, site_radius=None,
+                                                 engine=None):
+    current_span().set(entry=pdb_id)
+    h_walltime, h_mem = job_resources("add_h", [pdb_file])
+    water_walltime, water_mem = job_resources("add_water", [pdb_file])
+
     # Create the Add Hydrogen SBATCH script
     add_h_script = f"""\
 #!/bin/bash
@@ -66,12 +115,12 @@ def create_and_run_sbatch_script_add_h_and_water(pdb_id=None, pdb_file=None):
 #SBATCH --ntasks=1
 #SBATCH --cpus-per-task=1
 #SBATCH --ntasks-per-node=1
-#SBATCH --time=00:10:00
-#SBATCH --mem-per-cpu=2G
+#SBATCH --time={h_walltime}
+#SBATCH --mem-per-cpu={h_mem}
 
 ml conda
 conda activate /fred/oz241/BSIM/conda_meeko
-/usr/bin/time -v python protprep_packages/add_h.py --pdb_file {pdb_file}
+/usr/bin/time -v python -m protprep_packages.add_h --pdb_file {pdb_file}
 """
 
     h_script_filename = f"rec_protein_{pdb_id}_add_h.sh"
@@ -98,13 +147,13 @@ conda activate /fred/oz241/BSIM/conda_meeko
 #SBATCH --ntasks=1
 #SBATCH --cpus-per-task=1
 #SBATCH --ntasks-per-node=1
-#SBATCH --time=00:10:00
-#SBATCH --mem-per-cpu=2G
+#SBATCH --time={water_walltime}
+#SBATCH --mem-per-cpu={water_mem}
 #SBATCH --dependency=afterok:{job_id}  # Dependency on add_h job
 
 ml conda
 conda activate /fred/oz241/BSIM/conda_meeko
-/usr/bin/time -v python protprep_packages/add_water.py --pdb_file {pdb_file}
+/usr/bin/time -v python -m protprep_packages.add_water --pdb_file {pdb_file}{water_args(site, site_radius, engine)}
 """
 
     water_script_filename = f"rec_protein_{pdb_id}_add_water.sh"
@@ -118,8 +167,11 @@ conda activate /fred/oz241/BSIM/conda_meeko
     else:
         print(f"Failed to submit add_water job: {result.stderr}")
 
+@traced("sbatch_submit", step="extract_lig")
 def create_and_run_sbatch_script_extract_and_clean_specific_ligands(pdb_id, pdb_file, ligand_to_keep, chain_id):
 
+    current_span().set(entry=pdb_id)
+    walltime, mem = job_resources("extract_lig", [pdb_file])
     sbatch_script = f"""\
 #!/bin/bash
 #
@@ -130,12 +182,12 @@ def create_and_run_sbatch_script_extract_and_clean_specific_ligands(pdb_id, pdb_
     sbatch_script += "#SBATCH --ntasks=1\n"
     sbatch_script += "#SBATCH --cpus-per-task=1\n"
     sbatch_script += "#SBATCH --ntasks-per-node=1\n"
-    sbatch_script += "#SBATCH --time=00:10:00\n"
-    sbatch_script += "#SBATCH --mem-per-cpu=2G\n"
+    sbatch_script += f"#SBATCH --time={walltime}\n"
+    sbatch_script += f"#SBATCH --mem-per-cpu={mem}\n"
 
     sbatch_script += f"ml conda\n"
     sbatch_script += f"conda activate /fred/oz241/BSIM/conda_meeko\n"
-    sbatch_script += f"/usr/bin/time -v python protprep_packages/extract_and_clean_specific_ligands.py --pdb_file {pdb_file} --pdb_id {pdb_id} --ligand_to_keep {ligand_to_keep} --chain_id {chain_id}\n"
+    sbatch_script += f"/usr/bin/time -v python -m protprep_packages.extract_and_clean_specific_ligands --pdb_file {pdb_file} --pdb_id {pdb_id} --ligand_to_keep {ligand_to_keep} --chain_id {chain_id}\n"
 
     # Write the sbatch script to a file
     script_filename = f"extracting_lig_{pdb_id}.sh"
@@ -144,3 +196,268 @@ def create_and_run_sbatch_script_extract_and_clean_specific_ligands(pdb_id, pdb_
 
     # Launch the sbatch script using subprocess
     subprocess.run(["sbatch", script_filename])
+
+@traced("sbatch_submit")
+def create_and_run_sbatch_job(job_name, command, dependency=None, walltime="00:10:00", mem="2G"):
+    """
+    Write and submit a single-task sbatch script running 'command'.
+    'dependency' is a Slurm dependency list such as "afterok:123:124"; jobs
+    whose dependencies failed are cancelled instead of pending forever.
+    Returns the job ID, or None if the submission failed.
+    """
+    current_span().set(job=job_name)
+    dependency_lines = ""
+    if dependency:
+        dependency_lines = f"#SBATCH --dependency={dependency}\n#SBATCH --kill-on-invalid-dep=yes\n"
+    sbatch_script = f"""\
+#!/bin/bash
+#
+#SBATCH --job-name={job_name}
+#SBATCH --output={job_name}.txt
+#
+#SBATCH --ntasks=1
+#SBATCH --cpus-per-task=1
+#SBATCH --ntasks-per-node=1
+#SBATCH --time={walltime}
+#SBATCH --mem-per-cpu={mem}
+{dependency_lines}
+ml conda
+conda activate /fred/oz241/BSIM/conda_meeko
+/usr/bin/time -v {command}
+"""
+
+    script_filename = f"{job_name}.sh"
+    with open(script_filename, "w") as sbatch_file:
+        sbatch_file.write(sbatch_script)
+
+    result = subprocess.run(["sbatch", script_filename], capture_output=True, text=True)
+    if result.returncode != 0:
+        print(f"Failed to submit {job_name}: {result.stderr}")
+        return None
+    job_id = result.stdout.strip().split()[-1]  # Extract the Job ID from sbatch output
+    print(f"Submitted {job_name} with ID {job_id}")
+    return job_id
+
+def _write_array_index(index_filename, pdb_files):
+    """Write one input path per line; line N+1 is the input of array task N."""
+    with open(index_filename, "w") as index_file:
+        for pdb_file in pdb_files:
+            index_file.write(f"{Path(pdb_file).absolute()}\n")
+
+def _format_walltime(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+# Slurm's default MaxArraySize, used when scontrol cannot be queried.
+DEFAULT_MAX_ARRAY_SIZE = 1001
+
+@lru_cache(maxsize=None)
+def max_array_size():
+    """Return the cluster's MaxArraySize (from scontrol show config); array task IDs must stay below it."""
+    try:
+        result = subprocess.run(["scontrol", "show", "config"], capture_output=True, text=True)
+    except OSError:
+        return DEFAULT_MAX_ARRAY_SIZE
+    for line in result.stdout.splitlines():
+        key, _, value = line.partition("=")
+        if key.strip() == "MaxArraySize" and value.strip().isdigit():
+            return int(value)
+    return DEFAULT_MAX_ARRAY_SIZE
+
+def _array_script(job_name, index_filename, n_tasks, module, throttle=None, dependency=None,
+                  input_flag="--pdb_file", walltime="00:10:00", mem="2G", extra_args=""):
+    """Build an sbatch array script that runs 'module' on the input of each array task."""
+    array_range = f"0-{n_tasks - 1}" + (f"%{throttle}" if throttle else "")
+    dependency_line = f"#SBATCH --dependency={dependency}\n" if dependency else ""
+    return f"""\
+#!/bin/bash
+#
+#SBATCH --job-name={job_name}
+#SBATCH --output={job_name}_%A_%a.txt
+#
+#SBATCH --array={array_range}
+#SBATCH --ntasks=1
+#SBATCH --cpus-per-task=1
+#SBATCH --ntasks-per-node=1
+#SBATCH --time={walltime}
+#SBATCH --mem-per-cpu={mem}
+{dependency_line}
+PDB_FILE=$(sed -n "$((SLURM_ARRAY_TASK_ID + 1))p" {index_filename})
+
+ml conda
+conda activate /fred/oz241/BSIM/conda_meeko
+/usr/bin/time -v python -m {module} {input_flag} "$PDB_FILE"{extra_args}
+"""
+
+@traced("sbatch_submit")
+def _submit_array(job_name, script, label):
+    """Write and submit an array script; returns the array job ID or None."""
+    current_span().set(job=job_name, step=label)
+    script_filename = f"{job_name}.sh"
+    with open(script_filename, "w") as sbatch_file:
+        sbatch_file.write(script)
+
+    result = subprocess.run(["sbatch", script_filename], capture_output=True, text=True)
+    if result.returncode != 0:
+        print(f"Failed to submit {label} array job: {result.stderr}")
+        return None
+    job_id = result.stdout.strip().split()[-1]  # Extract the Job ID from sbatch output
+    print(f"Submitted {label} array job with ID {job_id}")
+    return job_id
+
+def _submit_array_chunks(pdb_id, pdb_files, step, module, throttle=None, dependency=None,
+                         input_flag="--pdb_file", walltime=None, mem=None, extra_args=""):
+    """
+    Submit the array jobs of create_and_run_sbatch_array(), one per chunk of at
+    most max_array_size() inputs. 'dependency' applies to every chunk, or is a
+    list with one entry per chunk (None: no dependency).
+    Returns the job ID of each chunk, None where the submission failed.
+    """
+    if walltime is None or mem is None:
+        sized_walltime, sized_mem = job_resources(step, pdb_files)
+        walltime = walltime or sized_walltime
+        mem = mem or sized_mem
+    chunk_size = max_array_size()
+    chunks = [pdb_files[start:start + chunk_size] for start in range(0, len(pdb_files), chunk_size)]
+    if not isinstance(dependency, list):
+        dependency = [dependency] * len(chunks)
+
+    job_ids = []
+    for i, (chunk, chunk_dependency) in enumerate(zip(chunks, dependency)):
+        job_name = f"rec_protein_{pdb_id}_{step}_array" + (f"_{i}" if len(chunks) > 1 else "")
+        index_filename = f"{job_name}_files.txt"
+        _write_array_index(index_filename, chunk)
+        script = _array_script(job_name, index_filename, len(chunk), module, throttle, chunk_dependency,
+                               input_flag, walltime, mem, extra_args)
+        job_ids.append(_submit_array(job_name, script, step))
+    return job_ids
+
+def create_and_run_sbatch_array(pdb_id, pdb_files, step, module, throttle=None, dependency=None,
+                                input_flag="--pdb_file", walltime=None, mem=None, extra_args=""):
+    """
+    Submit Slurm array jobs that run 'module' on every file in pdb_files.
+    The inputs are listed in an index file and each task picks its line by
+    SLURM_ARRAY_TASK_ID, so the submission cost does not grow with the batch.
+    Batches larger than the cluster's MaxArraySize are split into several
+    array jobs. 'throttle' limits the number of tasks of each array job
+    running at once (--array=...%N). 'walltime' and 'mem' default to
+    job_resources() for the largest input; 'extra_args' is appended to the
+    command of every task.
+    Returns the submitted job IDs joined by ':' (usable in an afterok:
+    dependency), or None if nothing was submitted.
+    """
+    pdb_files = list(pdb_files)
+    if not pdb_files:
+        return None
+    job_ids = [job_id for job_id in _submit_array_chunks(pdb_id, pdb_files, step, module, throttle, dependency,
+                                                         input_flag, walltime, mem, extra_args)
+               if job_id is not None]
+    return ":".join(job_ids) or None
+
+# Each water task writes <input stem>_water.pdb next to its input, as add_water.default_output() does.
+WATER_OUTPUT_ARGS = ' --output "${PDB_FILE%.*}_water.pdb"'
+
+def create_and_run_sbatch_array_add_h(pdb_id, pdb_files, throttle=None):
+    return create_and_run_sbatch_array(pdb_id, pdb_files, "add_h", "protprep_packages.add_h", throttle)
+
+def create_and_run_sbatch_array_add_water(pdb_id, pdb_files, throttle=None, site=None, site_radius=None, engine=None):
+    return create_and_run_sbatch_array(pdb_id, pdb_files, "add_water", "protprep_packages.add_water", throttle,
+                                       extra_args=WATER_OUTPUT_ARGS + water_args(site, site_radius, engine))
+
+def create_and_run_sbatch_array_add_h_and_water(pdb_id, pdb_files, throttle=None, site=None, site_radius=None,
+                                                engine=None):
+    # aftercorr starts water task N of a chunk as soon as add_h task N of the same chunk has succeeded.
+    pdb_files = list(pdb_files)
+    if not pdb_files:
+        return None
+    h_job_ids = _submit_array_chunks(pdb_id, pdb_files, "add_h", "protprep_packages.add_h", throttle)
+    if None in h_job_ids:
+        print("Failed to submit every add_h array job; add_water not submitted")
+        return None
+    water_job_ids = _submit_array_chunks(pdb_id, pdb_files, "add_water", "protprep_packages.add_water", throttle,
+                                         [f"aftercorr:{job_id}" for job_id in h_job_ids],
+                                         extra_args=WATER_OUTPUT_ARGS + water_args(site, site_radius, engine))
+    return ":".join(job_id for job_id in water_job_ids if job_id is not None) or None
+
+# Runtime model for packed jobs: a fixed PyMOL start-up per job plus a per-file
+# cost that grows with the number of atoms. Conservative defaults; adjust to the cluster.
+PYMOL_STARTUP_SECONDS = 20.0
+SECONDS_PER_FILE = 0.5
+SECONDS_PER_ATOM = {"add_h": 5e-5, "extract_lig": 2e-5}
+
+def estimate_runtime(pdb_file, step):
+    """Estimated seconds to process one file in an already running PyMOL session."""
+    return SECONDS_PER_FILE + SECONDS_PER_ATOM[step] * estimate_atom_count(pdb_file)
+
+def pack_by_runtime(items, runtimes, capacity):
+    """
+    Bin-pack items into groups whose summed runtime stays within 'capacity'
+    (first-fit decreasing). An item longer than capacity gets a group of its own.
+    Returns a list of item lists.
+    """
+    bins = []
+    loads = []
+    for runtime, item in sorted(zip(runtimes, items), key=lambda pair: -pair[0]):
+        for i, load in enumerate(loads):
+            if load + runtime <= capacity:
+                bins[i].append(item)
+                loads[i] += runtime
+                break
+        else:
+            bins.append([item])
+            loads.append(runtime)
+    return bins
+
+def _create_and_run_sbatch_packed(pdb_id, items, runtimes, step, module, walltime, throttle, safety, format_line,
+                                  input_path=str):
+    """
+    Pack items into per-task lists that fit the target walltime and submit them
+    as one array job. The --time and --mem-per-cpu requests are those the
+    sizing model gives the largest pack.
+    """
+    if not items:
+        return None
+    walltime = walltime or DEFAULT_WALLTIME
+    capacity = walltime * safety - PYMOL_STARTUP_SECONDS
+    packs = pack_by_runtime(items, runtimes, capacity)
+
+    list_files = []
+    for i, pack in enumerate(packs):
+        list_filename = f"rec_protein_{pdb_id}_{step}_pack_{i}.txt"
+        with open(list_filename, "w") as list_file:
+            for item in pack:
+                list_file.write(format_line(item) + "\n")
+        list_files.append(list_filename)
+
+    requests = [estimate_job_request(step, [input_path(item) for item in pack], packed=True) for pack in packs]
+    job_walltime = max(request[0] for request in requests)
+    mem_mb = max(request[1] for request in requests)
+
+    print(f"Packed {len(items)} {step} inputs into {len(packs)} jobs")
+    return create_and_run_sbatch_array(pdb_id, list_files, f"{step}_packed", module, throttle,
+                                       input_flag="--file_list", walltime=_format_walltime(job_walltime),
+                                       mem=f"{mem_mb}M")
+
+def create_and_run_sbatch_packed_add_h(pdb_id, pdb_files, walltime=None, throttle=None, safety=0.8):
+    """
+    Packed add_h: each array task starts PyMOL once and processes a list of
+    files, with files bin-packed by estimated runtime to fit 'walltime' seconds
+    (times 'safety' to leave headroom; default: job_metrics.DEFAULT_WALLTIME).
+    """
+    pdb_files = [str(Path(pdb_file).absolute()) for pdb_file in pdb_files]
+    runtimes = [estimate_runtime(pdb_file, "add_h") for pdb_file in pdb_files]
+    return _create_and_run_sbatch_packed(pdb_id, pdb_files, runtimes, "add_h", "protprep_packages.add_h",
+                                         walltime, throttle, safety, str)
+
+def create_and_run_sbatch_packed_extract_and_clean_specific_ligands(tasks, walltime=None, throttle=None, safety=0.8, batch_id="batch"):
+    """
+    Packed ligand extraction for many entries. 'tasks' is a list of
+    (pdb_id, pdb_file, ligand_to_keep, chain_id) tuples.
+    """
+    tasks = [(pdb_id, str(Path(pdb_file).absolute()), ligand, chain) for pdb_id, pdb_file, ligand, chain in tasks]
+    runtimes = [estimate_runtime(task[1], "extract_lig") for task in tasks]
+    return _create_and_run_sbatch_packed(
+        batch_id, tasks, runtimes, "extract_lig", "protprep_packages.extract_and_clean_specific_ligands",
+        walltime, throttle, safety,
+        lambda task: "\t".join([task[1], task[0], task[2], str(task[3])]),
+        input_path=lambda task: task[1])
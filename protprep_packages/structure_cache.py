@@ -0,0 +1,224 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+import requests
+from protprep_packages import http_client
+
+"""
+Shared on-disk cache for downloaded structure files.
+File contents are stored once under their SHA-256 ("blobs"), and each URL has a
+small JSON reference pointing at its blob together with the HTTP validators
+needed for conditional revalidation. All writes go through a temporary file
+and os.replace, so concurrent Slurm jobs sharing the cache never see partial
+files. The least recently used blobs are evicted once the cache exceeds its
+size cap.
+"""
+
+DEFAULT_MAX_BYTES = 10 * 1024 ** 3
+DEFAULT_MAX_AGE = 30 * 24 * 3600
+
+def default_cache_dir():
+    """Return the cache root: $PROTPREP_CACHE_DIR or ~/.cache/protprep/structures."""
+    return Path(os.environ.get("PROTPREP_CACHE_DIR", Path.home() / ".cache" / "protprep" / "structures"))
+
+def _sha256_file(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _copy_from(source):
+    """Return a writer for _atomic_write() that copies the contents of 'source'."""
+    def write(f):
+        with open(source, "rb") as src:
+            shutil.copyfileobj(src, f)
+    return write
+
+def _atomic_write(path, write):
+    """Call write(file_object) on a temporary file next to 'path', then move it into place."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=".tmp_")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        # mkstemp creates the file private to the user; the cache is shared with other users' jobs.
+        os.chmod(tmp_name, 0o644)
+        os.replace(tmp_name, path)
+    except BaseException:
+        if os.path.exists(tmp_name):
+            os.remove(tmp_name)
+        raise
+
+class StructureCache:
+    def __init__(self, root=None, max_bytes=DEFAULT_MAX_BYTES, max_age=DEFAULT_MAX_AGE, logger=None):
+        """
+        root:      cache directory (default: default_cache_dir()).
+        max_bytes: size cap of the stored blobs; LRU blobs are evicted above it.
+        max_age:   seconds after which a cached entry is revalidated with the server.
+        """
+        self.root = Path(root) if root is not None else default_cache_dir()
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.logger = logger or logging.getLogger(__name__)
+
+    def _blob_path(self, sha256):
+        return self.root / "blobs" / sha256[:2] / sha256
+
+    def _ref_path(self, url):
+        key = hashlib.sha256(url.encode()).hexdigest()
+        return self.root / "refs" / key[:2] / f"{key}.json"
+
+    def _read_ref(self, url):
+        try:
+            with open(self._ref_path(url), "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write_ref(self, url, ref):
+        _atomic_write(self._ref_path(url), lambda f: f.write(json.dumps(ref).encode()))
+
+    def _copy_out(self, blob, output_file):
+        # Copy rather than link so later in-place edits of the output never touch the cache.
+        _atomic_write(Path(output_file).absolute(), _copy_from(blob))
+        # The blob's mtime is its LRU timestamp.
+        os.utime(blob)
+
+    def lookup(self, url):
+        """Return (ref, blob_path) for a cached URL, or (None, None) on a miss."""
+        ref = self._read_ref(url)
+        if ref is None:
+            return None, None
+        blob = self._blob_path(ref["sha256"])
+        if not blob.exists():
+            return None, None
+        return ref, blob
+
+    def _revalidate(self, url, ref, timeout):
+        """
+        Ask the server whether the cached copy is still current.
+        Returns a requests.Response for changed content, or None if the cached copy can be used.
+        """
+        headers = {}
+        if ref.get("etag"):
+            headers["If-None-Match"] = ref["etag"]
+        if ref.get("last_modified"):
+            headers["If-Modified-Since"] = ref["last_modified"]
+        try:
+            response = http_client.get(url, headers=headers, timeout=timeout, stream=True)
+        except requests.exceptions.RequestException as e:
+            # Offline or server unavailable: the cached copy is the best we have.
+            self.logger.info(f"Revalidation of {url} failed ({e}), using cached copy")
+            return None
+        if response.status_code == 304 or not response.ok:
+            response.close()
+            return None
+        return response
+
+    def fetch(self, url, output_file, timeout=http_client.DEFAULT_TIMEOUT):
+        """
+        Copy a cached URL to 'output_file', revalidating entries older than max_age.
+        Returns True if output_file was produced from the cache, False on a miss.
+        """
+        ref, blob = self.lookup(url)
+        if ref is None:
+            return False
+
+        if time.time() - ref.get("validated_at", 0) > self.max_age:
+            response = self._revalidate(url, ref, timeout)
+            if response is not None:
+                self.logger.info(f"Cached copy of {url} is out of date, refreshing")
+                try:
+                    with response:
+                        self.store_stream(url, response.iter_content(1 << 20), response.headers)
+                    ref, blob = self.lookup(url)
+                except requests.exceptions.RequestException as e:
+                    # Connection lost mid-download: as in _revalidate(), the cached copy is the best we have.
+                    self.logger.info(f"Refreshing {url} failed ({e}), using cached copy")
+            else:
+                ref["validated_at"] = time.time()
+                self._write_ref(url, ref)
+
+        try:
+            self._copy_out(blob, output_file)
+        except FileNotFoundError:
+            # Evicted by another process in the meantime.
+            return False
+        self.logger.info(f"Using cached copy of {url}")
+        return True
+
+    def store_file(self, url, path, headers=None):
+        """Add an already downloaded file to the cache under 'url'."""
+        sha256 = _sha256_file(path)
+        blob = self._blob_path(sha256)
+        if not blob.exists():
+            _atomic_write(blob, _copy_from(path))
+        self._finish_store(url, sha256, blob, headers)
+
+    def store_stream(self, url, chunks, headers=None):
+        """Add downloaded content, given as an iterable of byte chunks, to the cache under 'url'."""
+        digest = hashlib.sha256()
+        staging = self.root / "blobs" / "staging"
+        staging.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=staging, prefix=".tmp_")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in chunks:
+                    digest.update(chunk)
+                    f.write(chunk)
+            sha256 = digest.hexdigest()
+            blob = self._blob_path(sha256)
+            blob.parent.mkdir(parents=True, exist_ok=True)
+            os.chmod(tmp_name, 0o644)
+            os.replace(tmp_name, blob)
+        except BaseException:
+            if os.path.exists(tmp_name):
+                os.remove(tmp_name)
+            raise
+        self._finish_store(url, sha256, blob, headers)
+        return blob
+
+    def _finish_store(self, url, sha256, blob, headers):
+        headers = headers or {}
+        self._write_ref(url, {
+            "url": url,
+            "sha256": sha256,
+            "size": blob.stat().st_size,
+            "etag": headers.get("ETag"),
+            "last_modified": headers.get("Last-Modified"),
+            "validated_at": time.time(),
+        })
+        os.utime(blob)
+        self.evict()
+
+    def evict(self):
+        """Delete least recently used blobs until the cache is below max_bytes."""
+        blobs = []
+        total = 0
+        for blob in (self.root / "blobs").glob("??/*"):
+            if blob.name.startswith("."):
+                # In-progress write of another process.
+                continue
+            try:
+                stat = blob.stat()
+            except FileNotFoundError:
+                continue
+            blobs.append((stat.st_mtime, stat.st_size, blob))
+            total += stat.st_size
+        if total <= self.max_bytes:
+            return
+        for _, size, blob in sorted(blobs):
+            try:
+                blob.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
+            self.logger.info(f"Evicted {blob.name} from the structure cache")
+            if total <= self.max_bytes:
+                break
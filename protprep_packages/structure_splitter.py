@@ -0,0 +1,121 @@
+from pathlib import Path
+from contextlib import ExitStack
+
+"""
+Single-pass splitter that breaks a PDB structure into the component files
+expected by TleapInputGenerator. The input is streamed line by line, so memory
+use does not depend on the size of the structure.
+"""
+
+def component_tag(pdb_id, chain_id):
+    """Return the identifier used in the file names of one chain's components."""
+    return f"{pdb_id}_{chain_id}"
+
+def split_structure(pdb_file, pdb_id, chains=None, cofactors=None, metal_ions=None, output_dir=".",
+                    cosubstrates=None):
+    """
+    Split a PDB file into per-chain receptor and component files in one pass.
+    Only the first model of a multi-model file is read.
+
+    For every chain (or only those listed in 'chains') with tag = "{pdb_id}_{chain}":
+      rec_{tag}.pdb                               ATOM records of the chain, and
+                                                  HETATM records of its cosubstrates
+      {tag}_single_chain_with_{cofactor}.pdb      HETATM records of each cofactor
+      {tag}_single_chain_with_{metal_ion}.pdb     HETATM records of each metal ion
+      {tag}_all_metal_ions_single_chain.pdb       HETATM records of all metal ions
+    A residue listed both as a cofactor and as a metal ion is treated as a
+    metal ion. The tag can be passed as 'pdb_id' to TleapInputGenerator.
+
+    Returns a dict keyed by chain ID with the tag and the paths written.
+    """
+    # Convert cofactors and metal_ions to sets if a single string is provided.
+    if isinstance(cofactors, str):
+        cofactors = [cofactors]
+    if isinstance(metal_ions, str):
+        metal_ions = [metal_ions]
+    if isinstance(cosubstrates, str):
+        cosubstrates = [cosubstrates]
+    metal_ions = set(metal_ions or [])
+    cofactors = set(cofactors or []) - metal_ions
+    cosubstrates = set(cosubstrates or [])
+    if isinstance(chains, str):
+        chains = [chains]
+    chains = set(chains) if chains else None
+
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    results = {}
+    handles = {}
+
+    with ExitStack() as stack:
+        def write(path, line):
+            # Output files are opened lazily the first time a record is routed to them.
+            handle = handles.get(path)
+            if handle is None:
+                handle = stack.enter_context(open(path, "w"))
+                handles[path] = handle
+            handle.write(line)
+
+        def chain_entry(chain_id):
+            entry = results.get(chain_id)
+            if entry is None:
+                tag = component_tag(pdb_id, chain_id)
+                entry = results[chain_id] = {
+                    'tag': tag,
+                    'receptor': None,
+                    'cofactors': {},
+                    'metal_ions': {},
+                    'all_metal_ions': None,
+                }
+            return entry
+
+        last_atom_chain = None
+        with open(pdb_file, "r") as infile:
+            for line in infile:
+                if not line.endswith("\n"):
+                    line += "\n"
+                if line.startswith("ENDMDL"):
+                    break
+                if line.startswith("ATOM"):
+                    chain_id = line[21:22].strip()
+                    if chains is not None and chain_id not in chains:
+                        continue
+                    entry = chain_entry(chain_id)
+                    if entry['receptor'] is None:
+                        entry['receptor'] = output_dir / f"rec_{entry['tag']}.pdb"
+                    write(entry['receptor'], line)
+                    last_atom_chain = chain_id
+                elif line.startswith("HETATM"):
+                    chain_id = line[21:22].strip()
+                    if chains is not None and chain_id not in chains:
+                        continue
+                    resname = line[17:20].strip()  # Residue name is typically in columns 18-20.
+                    if resname in cosubstrates:
+                        entry = chain_entry(chain_id)
+                        if entry['receptor'] is None:
+                            entry['receptor'] = output_dir / f"rec_{entry['tag']}.pdb"
+                        write(entry['receptor'], line)
+                    if resname in cofactors:
+                        entry = chain_entry(chain_id)
+                        path = entry['cofactors'].setdefault(
+                            resname, output_dir / f"{entry['tag']}_single_chain_with_{resname}.pdb")
+                        write(path, line)
+                    if resname in metal_ions:
+                        entry = chain_entry(chain_id)
+                        path = entry['metal_ions'].setdefault(
+                            resname, output_dir / f"{entry['tag']}_single_chain_with_{resname}.pdb")
+                        write(path, line)
+                        if entry['all_metal_ions'] is None:
+                            entry['all_metal_ions'] = output_dir / f"{entry['tag']}_all_metal_ions_single_chain.pdb"
+                        write(entry['all_metal_ions'], line)
+                elif line.startswith("TER"):
+                    # Close off the chain whose ATOM records were just written.
+                    if last_atom_chain is not None:
+                        write(results[last_atom_chain]['receptor'], "TER\n")
+                        last_atom_chain = None
+
+        for handle in handles.values():
+            handle.write("END\n")
+
+    return results
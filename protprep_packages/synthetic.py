@@ -0,0 +1,137 @@
+import numpy as np
+from protprep_packages.pdb_parser import ATOM_DTYPE, format_atom_records
+
+"""
+Deterministic synthetic structures for benchmarks.
+The same arguments (including the seed) always produce byte-identical files:
+a protein-like PDB with chains, residues and HETATM groups, a matching
+receptor PDBQT, and a multi-pose Vina-style ligand PDBQT with the usual
+docking REMARKs.
+"""
+
+RESIDUE_NAMES = ("ALA", "GLY", "SER", "LEU", "LYS", "ASP", "GLU", "VAL", "THR", "PHE")
+RESIDUE_ATOMS = ("N", "CA", "C", "O", "CB", "CG", "CD", "CE")
+HETERO_GROUPS = {          # residue name -> atom names
+    "HEM": ("FE", "NA", "NB", "NC", "ND", "C1A", "C2A", "C3A"),
+    "SO4": ("S", "O1", "O2", "O3", "O4"),
+    "ZN": ("ZN",),
+    "HOH": ("O",),
+}
+ATOMS_PER_A3 = 0.1          # roughly the atom density of a folded protein
+
+def _elements(names):
+    """Element symbols for atom names (first letter, or the whole name for metals)."""
+    names = np.asarray(names, dtype="U4")
+    first = np.char.ljust(names, 1).astype("U1")
+    return np.where(np.isin(names, ("FE", "ZN")), names, first)
+
+def _coordinates(rng, n_atoms):
+    """Random coordinates filling a cube at protein density."""
+    side = (max(n_atoms, 1) / ATOMS_PER_A3) ** (1 / 3)
+    return rng.uniform(0.0, side, size=(n_atoms, 3))
+
+def make_atom_table(n_atoms, n_chains=2, hetatm_fraction=0.02, seed=0):
+    """
+    Build an atom table (pdb_parser.ATOM_DTYPE) of 'n_atoms' records: protein
+    residues split evenly over 'n_chains' chains, followed by HETATM groups
+    (HEM, SO4, ZN, HOH) making up about 'hetatm_fraction' of the atoms.
+    """
+    rng = np.random.default_rng(seed)
+    n_hetero = int(n_atoms * hetatm_fraction)
+    n_protein = n_atoms - n_hetero
+
+    table = np.zeros(n_atoms, dtype=ATOM_DTYPE)
+    table['serial'] = np.arange(1, n_atoms + 1)
+    table['xyz'] = _coordinates(rng, n_atoms)
+    table['occupancy'] = 1.0
+    table['line'] = np.arange(n_atoms)
+
+    # Protein: residues of len(RESIDUE_ATOMS) atoms, chains in contiguous blocks.
+    residue = np.arange(n_protein) // len(RESIDUE_ATOMS)
+    table['record'][:n_protein] = "ATOM"
+    table['name'][:n_protein] = np.array(RESIDUE_ATOMS)[np.arange(n_protein) % len(RESIDUE_ATOMS)]
+    table['resn'][:n_protein] = np.array(RESIDUE_NAMES)[rng.integers(0, len(RESIDUE_NAMES), residue.max(initial=-1) + 1)][residue]
+    chain = np.minimum(np.arange(n_protein) * n_chains // max(n_protein, 1), n_chains - 1)
+    table['chain'][:n_protein] = np.array([chr(ord("A") + i) for i in range(n_chains)])[chain]
+    table['resseq'][:n_protein] = residue % 10000 + 1
+
+    # Hetero groups, cycling through HETERO_GROUPS and assigned to chains in turn.
+    groups = list(HETERO_GROUPS.items())
+    names, resns, resseqs, chains = [], [], [], []
+    group = 0
+    while len(names) < n_hetero:
+        resn, atom_names = groups[group % len(groups)]
+        names.extend(atom_names)
+        resns.extend([resn] * len(atom_names))
+        resseqs.extend([5001 + group] * len(atom_names))
+        chains.extend([chr(ord("A") + group % n_chains)] * len(atom_names))
+        group += 1
+    hetero = slice(n_protein, n_atoms)
+    table['record'][hetero] = "HETATM"
+    table['name'][hetero] = names[:n_hetero]
+    table['resn'][hetero] = resns[:n_hetero]
+    table['resseq'][hetero] = np.array(resseqs[:n_hetero], dtype=np.int64) % 10000
+    table['chain'][hetero] = chains[:n_hetero]
+
+    table['element'] = _elements(table['name'])
+    return table
+
+def write_pdb(filename, n_atoms, n_chains=2, hetatm_fraction=0.02, seed=0):
+    """Write a synthetic PDB file (see make_atom_table()) and return its path."""
+    table = make_atom_table(n_atoms, n_chains, hetatm_fraction, seed)
+    with open(filename, "w") as f:
+        f.write("HEADER    SYNTHETIC STRUCTURE\n")
+        f.writelines(format_atom_records(table))
+        f.write("END\n")
+    return filename
+
+def _pdbqt_lines(table, rng):
+    """PDB lines of 'table' extended with the PDBQT charge and AutoDock type columns."""
+    charges = rng.uniform(-0.5, 0.5, len(table))
+    ad_types = np.where(table['element'] == "C", "C", np.char.ljust(table['element'], 1).astype("U2"))
+    return [f"{line[:66]}    {charge:+6.3f} {ad_type:<2s}\n"
+            for line, charge, ad_type in zip(format_atom_records(table), charges, ad_types)]
+
+def write_receptor_pdbqt(filename, n_atoms, n_chains=2, seed=0):
+    """Write a synthetic receptor PDBQT (protein atoms only) and return its path."""
+    table = make_atom_table(n_atoms, n_chains, hetatm_fraction=0.0, seed=seed)
+    with open(filename, "w") as f:
+        f.writelines(_pdbqt_lines(table, np.random.default_rng(seed + 1)))
+    return filename
+
+def write_ligand_pdbqt(filename, n_atoms=30, n_poses=9, seed=0):
+    """
+    Write a synthetic multi-pose Vina output PDBQT: 'n_poses' MODEL blocks of
+    an 'n_atoms' ligand, each with VINA RESULT, INTER + INTRA, INTER, INTRA,
+    UNBOUND and Name REMARKs. Returns the path.
+    """
+    rng = np.random.default_rng(seed)
+    table = np.zeros(n_atoms, dtype=ATOM_DTYPE)
+    table['record'] = "ATOM"
+    table['serial'] = np.arange(1, n_atoms + 1)
+    table['name'] = np.array(["C", "N", "O", "C", "C", "S"])[np.arange(n_atoms) % 6]
+    table['resn'] = "UNL"
+    table['resseq'] = 1
+    table['occupancy'] = 1.0
+    table['element'] = table['name']
+    scores = np.sort(rng.uniform(-11.0, -5.0, n_poses))
+
+    with open(filename, "w") as f:
+        for pose, score in enumerate(scores, start=1):
+            table['xyz'] = rng.normal(0.0, 3.0, size=(n_atoms, 3))
+            inter = score * 1.3
+            intra = -score * 0.2
+            rmsd_lb, rmsd_ub = (0.0, 0.0) if pose == 1 else sorted(rng.uniform(0.5, 8.0, 2))
+            f.write(f"MODEL {pose}\n")
+            f.write(f"REMARK VINA RESULT:    {score:6.3f}      {rmsd_lb:.3f}      {rmsd_ub:.3f}\n")
+            f.write(f"REMARK INTER + INTRA:         {inter + intra:.3f}\n")
+            f.write(f"REMARK INTER:                 {inter:.3f}\n")
+            f.write(f"REMARK INTRA:                 {intra:.3f}\n")
+            f.write(f"REMARK UNBOUND:               {intra:.3f}\n")
+            f.write(f"REMARK  Name = synthetic_ligand_{seed}\n")
+            f.write("ROOT\n")
+            f.writelines(_pdbqt_lines(table, rng))
+            f.write("ENDROOT\n")
+            f.write("TORSDOF 0\n")
+            f.write("ENDMDL\n")
+    return filename
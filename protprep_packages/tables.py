@@ -0,0 +1,15 @@
+"""
+Box-drawn tables for the command-line reports (status, timings, job metrics).
+"""
+
+def print_table(header, rows):
+    """Print 'rows' under 'header' in a ┏━┳━┓ box, one column per header field, each cell left-aligned."""
+    rows = [tuple(str(cell) for cell in row) for row in rows]
+    header = tuple(str(cell) for cell in header)
+    widths = [max(len(row[i]) for row in rows + [header]) + 2 for i in range(len(header))]
+    print("┏" + "┳".join("━" * w for w in widths) + "┓")
+    print("┃" + "┃".join(f" {h}".ljust(w) for h, w in zip(header, widths)) + "┃")
+    print("┣" + "╋".join("━" * w for w in widths) + "┫")
+    for row in rows:
+        print("┃" + "┃".join(f" {c}".ljust(w) for c, w in zip(row, widths)) + "┃")
+    print("┗" + "┻".join("━" * w for w in widths) + "┛")
@@ -8,13 +8,14 @@ class TleapInputGenerator:
             "source leaprc.gaff"
         ]
 
-    def generate_multiple_metals_input(self, pdb_id):
+    def generate_multiple_metals_input(self, pdb_id, receptor=None):
         """Generate tleap input for multiple metal ions configuration."""
+        receptor = receptor or f"rec_{pdb_id}.pdb"
         tleap_input = f"""\
 {self._get_sources()}
 
 # Load the protein and the ligand (cofactor)
-protein = loadpdb rec_{pdb_id}.pdb
+protein = loadpdb {receptor}
 metal_ion = loadpdb {pdb_id}_all_metal_ions_single_chain.pdb
 
 # Combine the protein and cofactor into a single structure
@@ -22,18 +23,20 @@ combined_structure = combine {{ protein metal_ion }}
 
 # Check and save the combined structure
 check combined_structure
-savepdb combined_structure rec_{pdb_id}_clean.pdb
+savepdb combined_structure rec_{pdb_id}_tleap.pdb
 """
         tleap_input_filename = f"{pdb_id}_tleap_2S_multiple_metals.in"
         self._write_tleap_file(tleap_input_filename, tleap_input)
+        return tleap_input_filename
 
-    def generate_three_component_input(self, pdb_id, cofactor_name, metal_ion_name):
+    def generate_three_component_input(self, pdb_id, cofactor_name, metal_ion_name, receptor=None):
         """Generate tleap input for protein, cofactor, and metal ions."""
+        receptor = receptor or f"rec_{pdb_id}.pdb"
         tleap_input = f"""\
 {self._get_sources()}
 
 # Load the protein, cofactor, and metal_ion files
-protein = loadpdb rec_{pdb_id}.pdb
+protein = loadpdb {receptor}
 cofactor = loadpdb {pdb_id}_single_chain_with_{cofactor_name}.pdb
 metal_ion = loadpdb {pdb_id}_single_chain_with_{metal_ion_name}.pdb
 
@@ -42,30 +45,34 @@ combined_structure = combine {{ protein cofactor metal_ion}}
 
 # Check and save the combined structure
 check combined_structure
-savepdb combined_structure rec_{pdb_id}_clean.pdb
+savepdb combined_structure rec_{pdb_id}_tleap.pdb
 """
         tleap_input_filename = f"{pdb_id}_tleap_3S.in"
         self._write_tleap_file(tleap_input_filename, tleap_input)
+        return tleap_input_filename
 
-    def generate_protein_only_input(self, pdb_id):
+    def generate_protein_only_input(self, pdb_id, receptor=None):
         """Generate tleap input for just protein."""
+        receptor = receptor or f"rec_{pdb_id}.pdb"
         tleap_input = f"""\
 {self._get_sources()}
 
-protein = loadpdb rec_{pdb_id}.pdb
+protein = loadpdb {receptor}
 check protein
-savepdb protein rec_{pdb_id}_clean.pdb
+savepdb protein rec_{pdb_id}_tleap.pdb
 """
         tleap_input_filename = f"{pdb_id}_tleap.in"
         self._write_tleap_file(tleap_input_filename, tleap_input)
+        return tleap_input_filename
 
-    def generate_protein_cofactor_input(self, pdb_id, cofactor_name):
+    def generate_protein_cofactor_input(self, pdb_id, cofactor_name, receptor=None):
         """Generate tleap input for protein and cofactor."""
+        receptor = receptor or f"rec_{pdb_id}.pdb"
         tleap_input = f"""\
 {self._get_sources()}
 
 # Load the protein and the ligand (cofactor)
-protein = loadpdb rec_{pdb_id}.pdb
+protein = loadpdb {receptor}
 cofactor = loadpdb {pdb_id}_single_chain_with_{cofactor_name}.pdb
 
 # Combine the protein and cofactor into a single structure
@@ -73,18 +80,20 @@ combined_structure = combine {{ protein cofactor }}
 
 # Check and save the combined structure
 check combined_structure
-savepdb combined_structure rec_{pdb_id}_clean.pdb
+savepdb combined_structure rec_{pdb_id}_tleap.pdb
 """
         tleap_input_filename = f"{pdb_id}_tleap_2S_PC.in"
         self._write_tleap_file(tleap_input_filename, tleap_input)
+        return tleap_input_filename
 
-    def generate_protein_metal_input(self, pdb_id, metal_ion_name):
+    def generate_protein_metal_input(self, pdb_id, metal_ion_name, receptor=None):
         """Generate tleap input for protein and metal ion."""
+        receptor = receptor or f"rec_{pdb_id}.pdb"
         tleap_input = f"""\
 {self._get_sources()}
 
 # Load the protein, cofactor, and metal_ion files
-protein = loadpdb rec_{pdb_id}.pdb
+protein = loadpdb {receptor}
 metal_ion = loadpdb {pdb_id}_single_chain_with_{metal_ion_name}.pdb
 
 # Combine the protein and cofactor into a single structure
@@ -92,10 +101,11 @@ combined_structure = combine {{ protein metal_ion}}
 
 # Check and save the combined structure
 check combined_structure
-savepdb combined_structure rec_{pdb_id}_clean.pdb
+savepdb combined_structure rec_{pdb_id}_tleap.pdb
 """
         tleap_input_filename = f"{pdb_id}_tleap_2S_PMI.in"
         self._write_tleap_file(tleap_input_filename, tleap_input)
+        return tleap_input_filename
 
     def generate_all_inputs(self, pdb_id, cofactor_name=None, metal_ion_name=None):
         """Generate all possible tleap input combinations based on available components."""
@@ -108,6 +118,39 @@ savepdb combined_structure rec_{pdb_id}_clean.pdb
         if metal_ion_name:
             self.generate_protein_metal_input(pdb_id, metal_ion_name)
 
+    def generate_split_input(self, entry, receptor=None):
+        """
+        Generate the tleap input of one chain returned by
+        structure_splitter.split_structure(): its receptor combined with its
+        first cofactor and metal ion, or with all its metal ions if it has
+        several and no cofactor. 'receptor' replaces the split receptor
+        (e.g. the receptor after adding hydrogens and water).
+        Returns the input file name.
+        """
+        tag = entry['tag']
+        cofactor_name = next(iter(entry['cofactors']), None)
+        metal_ion_name = next(iter(entry['metal_ions']), None)
+        if cofactor_name and metal_ion_name:
+            return self.generate_three_component_input(tag, cofactor_name, metal_ion_name, receptor)
+        if cofactor_name:
+            return self.generate_protein_cofactor_input(tag, cofactor_name, receptor)
+        if len(entry['metal_ions']) > 1:
+            return self.generate_multiple_metals_input(tag, receptor)
+        if metal_ion_name:
+            return self.generate_protein_metal_input(tag, metal_ion_name, receptor)
+        return self.generate_protein_only_input(tag, receptor)
+
+    def generate_split_inputs(self, components, receptors=None):
+        """
+        Generate the tleap input of every chain returned by
+        structure_splitter.split_structure() (see generate_split_input()).
+        'receptors' maps chain IDs to replacement receptor files.
+        Returns {chain: input file name}.
+        """
+        receptors = receptors or {}
+        return {chain_id: self.generate_split_input(entry, receptors.get(chain_id))
+                for chain_id, entry in components.items()}
+
     def _get_sources(self):
         """Return the standard source commands as a string."""
         return "\n".join(self.base_sources)
@@ -0,0 +1,202 @@
+import argparse
+import functools
+import glob
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from protprep_packages.tables import print_table
+
+"""
+Lightweight tracing of the preparation stages.
+Wrap a stage in span("name", entry=..., atoms=..., bytes=...) or decorate it
+with @traced(); attributes known only inside the stage can be added with
+Span.set(). Tracing is off unless enable() was called or $PROTPREP_TRACE names
+a directory. Every process (local workers, Slurm jobs started from the same
+environment) appends its finished spans to its own spans-<host>-<pid>.jsonl
+file in that directory, so the spans of a whole campaign can be merged into a
+Chrome trace (chrome://tracing, Perfetto) and a per-stage summary table.
+"""
+
+TRACE_ENV = "PROTPREP_TRACE"
+
+_writer_lock = threading.Lock()
+_writer = None              # (pid, file object) of this process's span file
+_local = threading.local()
+
+class Span:
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+
+    def set(self, **attrs):
+        """Add or update attributes (e.g. atoms, bytes) of the running span."""
+        self.attrs.update(attrs)
+
+class _NullSpan:
+    def set(self, **attrs):
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+def trace_dir():
+    """Return the trace directory, or None if tracing is off."""
+    directory = os.environ.get(TRACE_ENV)
+    return Path(directory) if directory else None
+
+def enable(directory):
+    """
+    Turn tracing on for this process and every process started from it
+    (the directory is passed on through $PROTPREP_TRACE).
+    """
+    directory = Path(directory).absolute()
+    directory.mkdir(parents=True, exist_ok=True)
+    os.environ[TRACE_ENV] = str(directory)
+    return directory
+
+def _write(event):
+    global _writer
+    directory = trace_dir()
+    if directory is None:
+        return
+    line = json.dumps(event, default=str) + "\n"
+    with _writer_lock:
+        # A forked worker must not share its parent's file object.
+        if _writer is None or _writer[0] != os.getpid():
+            directory.mkdir(parents=True, exist_ok=True)
+            path = directory / f"spans-{os.uname().nodename}-{os.getpid()}.jsonl"
+            _writer = (os.getpid(), open(path, "a", buffering=1))
+        _writer[1].write(line)
+
+def current_span():
+    """Return the innermost running span of this thread (a no-op span if none)."""
+    stack = getattr(_local, "stack", None)
+    return stack[-1] if stack else _NULL_SPAN
+
+@contextmanager
+def span(name, **attrs):
+    """
+    Time the enclosed block as a span called 'name'. Conventional attributes
+    are entry (PDB ID), atoms and bytes; any JSON-serialisable value is kept.
+    """
+    if trace_dir() is None:
+        yield _NULL_SPAN
+        return
+    current = Span(name, {key: value for key, value in attrs.items() if value is not None})
+    stack = _local.__dict__.setdefault("stack", [])
+    stack.append(current)
+    start = time.time_ns()
+    try:
+        yield current
+    except Exception as e:
+        current.set(error=f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        end = time.time_ns()
+        stack.pop()
+        _write({
+            "name": name,
+            "ts": start / 1000,
+            "dur": (end - start) / 1000,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "args": current.attrs,
+        })
+
+def traced(name=None, **attrs):
+    """Decorator form of span(); the span is named after the function unless 'name' is given."""
+    def decorator(function):
+        span_name = name or function.__qualname__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(span_name, **attrs):
+                return function(*args, **kwargs)
+        return wrapper
+
+    if callable(name):
+        function, name = name, None
+        return decorator(function)
+    return decorator
+
+def file_size(path):
+    """Size of 'path' in bytes for the bytes attribute, or None if it does not exist."""
+    try:
+        return os.path.getsize(path)
+    except (OSError, TypeError):
+        return None
+
+def load_spans(directory=None):
+    """Read every span recorded in 'directory' (default: the active trace directory)."""
+    directory = Path(directory) if directory is not None else trace_dir()
+    spans = []
+    for path in sorted(glob.glob(str(directory / "spans-*.jsonl"))):
+        with open(path, "r") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    try:
+                        spans.append(json.loads(line))
+                    except ValueError:
+                        # Partial last line of a process that was killed.
+                        continue
+    return spans
+
+def export_chrome_trace(output_file, directory=None):
+    """Merge the recorded spans into a Chrome trace JSON file; returns the number of spans."""
+    spans = load_spans(directory)
+    events = [{"name": s["name"], "cat": "protprep", "ph": "X", "ts": s["ts"], "dur": s["dur"],
+               "pid": s["pid"], "tid": s["tid"], "args": s.get("args", {})} for s in spans]
+    with open(output_file, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+    return len(events)
+
+def summarize(directory=None):
+    """
+    Aggregate the recorded spans per name.
+    Returns a list of (name, count, total s, mean s, max s, atoms, bytes), slowest total first.
+    """
+    totals = {}
+    for s in load_spans(directory):
+        entry = totals.setdefault(s["name"], [0, 0.0, 0.0, 0, 0])
+        seconds = s["dur"] / 1e6
+        args = s.get("args", {})
+        entry[0] += 1
+        entry[1] += seconds
+        entry[2] = max(entry[2], seconds)
+        entry[3] += int(args.get("atoms") or 0)
+        entry[4] += int(args.get("bytes") or 0)
+    rows = [(name, count, total, total / count, longest, atoms, n_bytes)
+            for name, (count, total, longest, atoms, n_bytes) in totals.items()]
+    return sorted(rows, key=lambda row: -row[2])
+
+def print_summary(directory=None):
+    """Print summarize() in a box."""
+    header = ("STAGE", "COUNT", "TOTAL s", "MEAN s", "MAX s", "ATOMS", "MB")
+    rows = [(name, str(count), f"{total:.3f}", f"{mean:.3f}", f"{longest:.3f}", str(atoms), f"{n_bytes / 1e6:.1f}")
+            for name, count, total, mean, longest, atoms, n_bytes in summarize(directory)]
+    print_table(header, rows)
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Summarise the spans recorded in a trace directory and export them as a Chrome trace."
+    )
+    parser.add_argument(
+        "trace_dir",
+        help="Directory the spans were recorded in ($PROTPREP_TRACE of the run)."
+    )
+    parser.add_argument(
+        "--chrome",
+        default=None,
+        help="Write a Chrome trace JSON file (open in chrome://tracing or ui.perfetto.dev)."
+    )
+
+    args = parser.parse_args()
+
+    print_summary(args.trace_dir)
+    if args.chrome:
+        n_spans = export_chrome_trace(args.chrome, args.trace_dir)
+        print(f"Wrote {n_spans} spans to {args.chrome}")
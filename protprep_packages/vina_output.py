@@ -0,0 +1,227 @@
+import argparse
+import json
+import mmap
+import os
+import tempfile
+from protprep_packages.ligand_metadata import METADATA_KEYWORDS
+from protprep_packages.tables import print_table
+
+"""
+Indexed reader for multi-pose AutoDock Vina output (PDBQT) files.
+The file is memory-mapped and scanned once for its MODEL ... ENDMDL blocks;
+the byte range of every pose is stored with the values of its REMARK lines
+(VINA RESULT, INTER + INTRA, INTER, INTRA, UNBOUND, Name). The index is saved
+next to the file as <file>.poseidx.json and reused while the file's size and
+mtime are unchanged, so any pose can be read later by slicing the map,
+without rescanning, and memory use does not grow with the file size.
+
+    python -m protprep_packages.vina_output docked.pdbqt --pose 3
+"""
+
+INDEX_SUFFIX = ".poseidx.json"
+INDEX_VERSION = 1
+
+# Values kept for every pose (besides its model number and byte range).
+POSE_FIELDS = ("score", "rmsd_lb", "rmsd_ub", "inter_intra", "inter", "intra", "unbound", "name")
+
+# REMARK label (the text before the colon) -> fields of the values after it.
+_REMARK_VALUES = {
+    "REMARK VINA RESULT": ("score", "rmsd_lb", "rmsd_ub"),
+    "REMARK INTER + INTRA": ("inter_intra",),
+    "REMARK INTER": ("inter",),
+    "REMARK INTRA": ("intra",),
+    "REMARK UNBOUND": ("unbound",),
+}
+_HEADER_BYTES = 2048        # the REMARKs of a pose are read from the start of its block only
+_COLUMNS = ("model", "start", "end") + POSE_FIELDS
+
+def index_path(path):
+    """Where the pose index of 'path' is stored."""
+    return str(path) + INDEX_SUFFIX
+
+def parse_pose_remarks(lines):
+    """Return the POSE_FIELDS values (None where missing) from the REMARK lines at the start of a pose."""
+    values = dict.fromkeys(POSE_FIELDS)
+    for line in lines:
+        line = line.strip()
+        if line.startswith("MODEL"):
+            continue
+        if not line.startswith("REMARK"):
+            break
+        label, _, text = line.partition(":")
+        fields = _REMARK_VALUES.get(label)
+        if fields:
+            for field, value in zip(fields, text.split()):
+                try:
+                    values[field] = float(value)
+                except ValueError:
+                    pass
+        elif line.startswith("REMARK  Name ="):
+            values['name'] = line.split("=", 1)[1].strip()
+    return values
+
+class VinaOutput:
+    def __init__(self, path, persist=True):
+        """
+        path:    Vina output file (PDBQT, or a PDB with MODEL blocks).
+        persist: save the index next to the file (skipped if the directory is read-only).
+        """
+        self.path = str(path)
+        self.persist = persist
+        self._file = open(self.path, "rb")
+        stat = os.fstat(self._file.fileno())
+        self.size, self.mtime_ns = stat.st_size, stat.st_mtime_ns
+        # An empty file cannot be mapped; it simply has no poses.
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b""
+        # Column name -> list with one value per pose.
+        self.columns = self._load_index()
+        if self.columns is None:
+            self.columns = self._build_index()
+            if self.persist:
+                self._save_index()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+        self._file.close()
+
+    def __len__(self):
+        return len(self.columns['start'])
+
+    @property
+    def poses(self):
+        """Every pose's index entry, as returned by pose()."""
+        return [self.pose(k) for k in range(1, len(self) + 1)]
+
+    def _load_index(self):
+        try:
+            with open(index_path(self.path), "r") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if (index.get('version') != INDEX_VERSION or index.get('size') != self.size
+                or index.get('mtime_ns') != self.mtime_ns):
+            return None
+        return index['columns']
+
+    def _save_index(self):
+        index = {'version': INDEX_VERSION, 'size': self.size, 'mtime_ns': self.mtime_ns, 'columns': self.columns}
+        directory = os.path.dirname(os.path.abspath(self.path))
+        try:
+            fd, tmp_name = tempfile.mkstemp(dir=directory, prefix=".tmp_")
+        except OSError:
+            return
+        try:
+            with os.fdopen(fd, "w") as f:
+                # json.dumps uses the C encoder; json.dump would encode in Python.
+                f.write(json.dumps(index))
+            os.chmod(tmp_name, 0o644)
+            os.replace(tmp_name, index_path(self.path))
+        except BaseException:
+            if os.path.exists(tmp_name):
+                os.remove(tmp_name)
+            raise
+
+    def _find_record(self, record, pos):
+        """Offset of the first line at or after 'pos' that starts with 'record', or -1."""
+        if pos == 0 and self._map[:len(record)] == record:
+            return 0
+        # mmap.find (memchr/memmem) is much faster than a multiline regex over the map.
+        i = self._map.find(b"\n" + record, max(pos - 1, 0))
+        return i + 1 if i >= 0 else -1
+
+    def _line_end(self, pos):
+        """Offset just past the line containing 'pos'."""
+        i = self._map.find(b"\n", pos)
+        return i + 1 if i >= 0 else self.size
+
+    def _build_index(self):
+        """Scan the map once for the MODEL ... ENDMDL blocks (the whole file is one pose if there are none)."""
+        columns = {column: [] for column in _COLUMNS}
+        has_endmdl = True
+        start = self._find_record(b"MODEL", 0)
+        while start >= 0:
+            number = self._map[start + len(b"MODEL"):self._line_end(start)].strip()
+            model = int(number) if number.isdigit() else len(columns['start']) + 1
+            next_start = self._find_record(b"MODEL", start + 1)
+            # Once a file has no ENDMDL left, stop looking for one (every search would scan to the end).
+            endmdl = self._find_record(b"ENDMDL", start + 1) if has_endmdl else -1
+            has_endmdl = endmdl >= 0
+            if has_endmdl and (next_start < 0 or endmdl < next_start):
+                end = self._line_end(endmdl)
+            else:
+                # MODEL without ENDMDL: the block ends where the next one starts.
+                end = next_start if next_start >= 0 else self.size
+            self._add_pose(columns, model, start, end)
+            start = next_start
+        if not columns['start'] and self.size:
+            self._add_pose(columns, 1, 0, self.size)
+        return columns
+
+    def _add_pose(self, columns, model, start, end):
+        # Only the REMARKs before the first torsion tree or atom record are decoded.
+        limit = min(end, start + _HEADER_BYTES)
+        for record in (b"\nROOT", b"\nATOM", b"\nHETATM"):
+            i = self._map.find(record, start, limit)
+            if i >= 0:
+                limit = i
+        header = self._map[start:limit].decode("ascii", "replace").splitlines()
+        values = parse_pose_remarks(header)
+        values.update(model=model, start=start, end=end)
+        for column in _COLUMNS:
+            columns[column].append(values[column])
+
+    def pose(self, k):
+        """The index entry (model, byte range and REMARK values) of pose k (1-based)."""
+        if not 1 <= k <= len(self):
+            raise IndexError(f"{self.path} has {len(self)} pose(s), no pose {k}")
+        return {column: self.columns[column][k - 1] for column in _COLUMNS}
+
+    def pose_bytes(self, k):
+        """The raw MODEL ... ENDMDL block of pose k."""
+        pose = self.pose(k)
+        return self._map[pose['start']:pose['end']]
+
+    def pose_lines(self, k):
+        """The lines (with line endings) of pose k."""
+        return self.pose_bytes(k).decode("ascii", "replace").splitlines(keepends=True)
+
+    def metadata(self, k=1):
+        """
+        The docking metadata REMARKs of pose k in the form
+        extract_ligand_metadata() returns for MODEL 1: "REMARK MODEL <model>"
+        followed by the REMARK lines starting with one of METADATA_KEYWORDS.
+        """
+        lines = [f"REMARK MODEL {self.pose(k)['model']}"]
+        for line in self.pose_lines(k):
+            line = line.strip()
+            if line.startswith(("ROOT", "ATOM", "HETATM")):
+                break
+            if any(line.startswith(key) for key in METADATA_KEYWORDS if key != "MODEL"):
+                lines.append(line)
+        return lines
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Index a multi-pose Vina output file and print its poses, or one pose."
+    )
+    parser.add_argument("vina_file", help="Vina output file (PDBQT).")
+    parser.add_argument("--pose", type=int, default=None, help="Print this pose (1-based) instead of the table.")
+
+    args = parser.parse_args()
+
+    with VinaOutput(args.vina_file) as vina_output:
+        if args.pose is not None:
+            print("".join(vina_output.pose_lines(args.pose)), end="")
+        else:
+            header = ("POSE", "MODEL", "SCORE", "RMSD LB", "RMSD UB", "BYTES")
+            rows = [(str(i), str(p['model']), f"{p['score']}", f"{p['rmsd_lb']}", f"{p['rmsd_ub']}",
+                     str(p['end'] - p['start'])) for i, p in enumerate(vina_output.poses, start=1)]
+            print_table(header, rows)
@@ -0,0 +1,147 @@
+import argparse
+import math
+from pathlib import Path
+import numpy as np
+
+"""
+Pre-equilibrated periodic water box used by add_water's tiling engine.
+The bundled box (water_box_tip3p.pdb, next to this module) holds 216 rigid
+TIP3P waters in a cubic periodic cell at 0.997 g/cm3. It was produced by
+equilibrate_water_box(): NVT Metropolis Monte Carlo at 298 K from a cubic
+lattice, with minimum-image Lennard-Jones + Coulomb interactions. Because the
+cell is periodic, copies of it can be laid side by side without seams.
+Regenerate (or make a larger box) with:
+
+    python -m protprep_packages.water_box --n_side 6 --sweeps 3000
+"""
+
+BOX_FILE = Path(__file__).with_name("water_box_tip3p.pdb")
+
+# TIP3P: rigid geometry (Å, degrees), charges (e) and oxygen Lennard-Jones parameters.
+TIP3P_OH = 0.9572
+TIP3P_HOH = 104.52
+TIP3P_CHARGES = np.array([-0.834, 0.417, 0.417])
+TIP3P_SIGMA = 3.15061       # Å
+TIP3P_EPSILON = 0.1521      # kcal/mol
+
+COULOMB = 332.0637          # kcal·Å/(mol·e²)
+BOLTZMANN = 0.0019872041    # kcal/(mol·K)
+WATER_MASS = 18.015         # g/mol
+AVOGADRO = 6.02214076e23
+
+def tip3p_template():
+    """TIP3P water (O, H1, H2) with the oxygen at the origin, shape (3, 3)."""
+    half = math.radians(TIP3P_HOH) / 2
+    return np.array([[0.0, 0.0, 0.0],
+                     [TIP3P_OH * math.sin(half), TIP3P_OH * math.cos(half), 0.0],
+                     [-TIP3P_OH * math.sin(half), TIP3P_OH * math.cos(half), 0.0]])
+
+def box_length(n_waters, density=0.997):
+    """Edge (Å) of the cubic box holding n_waters at 'density' g/cm3."""
+    volume_cm3 = n_waters * WATER_MASS / AVOGADRO / density
+    return (volume_cm3 * 1e24) ** (1.0 / 3.0)
+
+def _rotation(rng, max_angle):
+    """Rotation matrix about a random axis by an angle up to max_angle (radians)."""
+    axis = rng.normal(size=3)
+    axis /= np.linalg.norm(axis)
+    angle = rng.uniform(-max_angle, max_angle)
+    k = np.array([[0.0, -axis[2], axis[1]], [axis[2], 0.0, -axis[0]], [-axis[1], axis[0], 0.0]])
+    return np.eye(3) + math.sin(angle) * k + (1 - math.cos(angle)) * k @ k
+
+def _pair_energies(water, others, length, cutoff):
+    """Interaction energy (kcal/mol) of one water (3, 3) with each of 'others' (M, 3, 3), minimum image."""
+    shift = others[:, 0, :] - water[0]
+    shift = -length * np.round(shift / length)
+    others = others + shift[:, None, :]
+    r_oo = np.linalg.norm(others[:, 0, :] - water[0], axis=1)
+    sr6 = (TIP3P_SIGMA / r_oo) ** 6
+    lj = 4 * TIP3P_EPSILON * (sr6 * sr6 - sr6)
+    r = np.linalg.norm(others[:, None, :, :] - water[None, :, None, :], axis=-1)
+    coulomb = COULOMB * np.sum(TIP3P_CHARGES[None, :, None] * TIP3P_CHARGES[None, None, :] / r, axis=(1, 2))
+    return np.where(r_oo < cutoff, lj + coulomb, 0.0)
+
+def equilibrate_water_box(n_side=6, density=0.997, temperature=298.0, sweeps=3000, seed=0,
+                          max_shift=0.15, max_angle=math.radians(15), verbose=True):
+    """
+    Equilibrate n_side**3 rigid TIP3P waters in a cubic periodic box by NVT
+    Metropolis Monte Carlo (one translation + rotation trial per water per
+    sweep), starting from a cubic lattice with random orientations.
+    Returns (box edge in Å, (N, 3, 3) water coordinates wrapped into the box).
+    """
+    rng = np.random.default_rng(seed)
+    n_waters = n_side ** 3
+    length = box_length(n_waters, density)
+    cutoff = min(9.0, length / 2)
+    beta = 1.0 / (BOLTZMANN * temperature)
+
+    steps = (np.arange(n_side) + 0.5) * length / n_side
+    oxygens = np.stack(np.meshgrid(steps, steps, steps, indexing="ij"), axis=-1).reshape(-1, 3)
+    template = tip3p_template()
+    waters = np.array([template @ _rotation(rng, math.pi).T + oxygen for oxygen in oxygens])
+
+    accepted = 0
+    for sweep in range(1, sweeps + 1):
+        for i in rng.permutation(n_waters):
+            others = np.delete(waters, i, axis=0)
+            old = waters[i]
+            center = old[0]
+            new = (old - center) @ _rotation(rng, max_angle).T + center + rng.uniform(-max_shift, max_shift, 3)
+            delta = _pair_energies(new, others, length, cutoff).sum() - _pair_energies(old, others, length, cutoff).sum()
+            if delta <= 0 or rng.random() < math.exp(-beta * delta):
+                # Keep the oxygen inside the cell; the hydrogens follow it.
+                waters[i] = new - length * np.floor(new[0] / length)
+                accepted += 1
+        if verbose and (sweep % 100 == 0 or sweep == sweeps):
+            print(f"Sweep {sweep}/{sweeps}: acceptance {accepted / (sweep * n_waters):.2f}, "
+                  f"energy {total_energy(waters, length, cutoff) / n_waters:.2f} kcal/mol per water")
+    return length, waters
+
+def total_energy(waters, length, cutoff=9.0):
+    """Total interaction energy (kcal/mol) of a periodic water box."""
+    return 0.5 * sum(_pair_energies(water, np.delete(waters, i, axis=0), length, min(cutoff, length / 2)).sum()
+                     for i, water in enumerate(waters))
+
+def write_water_box(filename, length, waters):
+    """Write a water box as PDB: a CRYST1 record with the cell, then one HOH residue per water."""
+    names = ("O", "H1", "H2")
+    with open(filename, "w") as f:
+        f.write(f"CRYST1{length:9.3f}{length:9.3f}{length:9.3f}  90.00  90.00  90.00 P 1           1\n")
+        for i, water in enumerate(waters):
+            for j, (name, (x, y, z)) in enumerate(zip(names, water)):
+                f.write(f"ATOM  {(3 * i + j + 1) % 100000:5d} {name:^4s} HOH W{(i + 1) % 10000:4d}    "
+                        f"{x:8.3f}{y:8.3f}{z:8.3f}  1.00  0.00           {name[0]:>2s}\n")
+        f.write("END\n")
+
+def load_water_box(filename=None):
+    """
+    Read a water box written by write_water_box() (default: the bundled box).
+    Returns (cell edges (3,) in Å, (N, 3, 3) water coordinates: water, atom (O, H1, H2), xyz).
+    """
+    cell = None
+    coords = []
+    with open(filename or BOX_FILE, "r") as f:
+        for line in f:
+            if line.startswith("CRYST1"):
+                cell = np.array([float(line[6:15]), float(line[15:24]), float(line[24:33])])
+            elif line.startswith(("ATOM", "HETATM")):
+                coords.append((float(line[30:38]), float(line[38:46]), float(line[46:54])))
+    if cell is None:
+        raise ValueError(f"{filename or BOX_FILE} has no CRYST1 record")
+    return cell, np.array(coords).reshape(-1, 3, 3)
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Equilibrate a periodic TIP3P water box by Monte Carlo and write it as PDB."
+    )
+    parser.add_argument("--n_side", type=int, default=6, help="Waters per box edge on the starting lattice (default: 6).")
+    parser.add_argument("--sweeps", type=int, default=3000, help="Monte Carlo sweeps (default: 3000).")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed (default: 0).")
+    parser.add_argument("--output", default=str(BOX_FILE), help="Output PDB file (default: the bundled box).")
+
+    args = parser.parse_args()
+
+    box_edge, box_waters = equilibrate_water_box(args.n_side, sweeps=args.sweeps, seed=args.seed)
+    write_water_box(args.output, box_edge, box_waters)
+    print(f"Wrote {len(box_waters)} waters in a {box_edge:.3f} Å box to {args.output}")